@@ -1,6 +1,8 @@
 class Checkpoint:
-    def __init__(self, src, dest, workq, totalsize):
+    def __init__(self, src, dest, workq, totalsize, files=None):
         self.totalsize = totalsize
         self.src = src
         self.dest = dest
         self.workq = workq
+        # file table snapshot, the work items only have file ids
+        self.files = files
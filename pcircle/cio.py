@@ -1,44 +1,82 @@
 __author__ = 'f7b'
 
-import time
+"""
+Chunk I/O: positional reads and writes through reusable buffers.
+
+    preadn(fd, view, offset)    fill "view" from "offset", fewer bytes at
+                                the end of the file, returns the count
+    pwriten(fd, view, offset)   write all of "view" at "offset"
+    pool(size)                  the buffers of "size" bytes of this rank
+    hash_range(fd, offset, length, m)
+    copy_range(rfd, wfd, offset, length, m=None)
+                                a range of a file, a block at a time,
+                                through the hash "m" if there is one
+
+Nothing here moves a file offset, so one fd can serve any number of
+chunks, and no lseek() goes with them. Reads land in a bytearray taken
+from the pool (preadv(), or FileIO.readinto() before Python 3.7), the
+hash and the write take a memoryview of it: a chunk costs no allocation
+of its size, and a rank holds one block per thread doing I/O at most,
+whatever the number of chunks.
+"""
+
+import io
 import os
+import time
+import threading
+from contextlib import contextmanager
 
 MAX_TRIES = 5
 SLEEP = 0.1
 
+BLOCKSIZE = 4 * 1024 * 1024
 
-def readn(fd, size):
-    tries = 0
-    ret = ''
-    while len(ret) < size:
+
+if hasattr(os, "preadv"):
+    def _pread(fd, view, offset):
+        return os.preadv(fd, [view], offset)
+else:
+    def _pread(fd, view, offset):
+        os.lseek(fd, offset, os.SEEK_SET)
+        return io.FileIO(fd, "r", closefd=False).readinto(view)
+
+if hasattr(os, "pwrite"):
+    def _pwrite(fd, view, offset):
+        return os.pwrite(fd, view, offset)
+else:
+    def _pwrite(fd, view, offset):
+        os.lseek(fd, offset, os.SEEK_SET)
+        return io.FileIO(fd, "w", closefd=False).write(view)
+
+
+def _ioerror(e):
+    return IOError(e.errno, e.strerror, getattr(e, "filename", None))
+
+
+def preadn(fd, view, offset):
+    size = len(view)
+    n = 0
+    while n < size:
         try:
-            buf = os.read(fd, size - len(ret))
+            rc = _pread(fd, view[n:], offset + n)
         except OSError as e:
-            raise IOError(e.message)
-        if len(buf) > 0:
-            tries = MAX_TRIES
-            ret += buf
-        elif not buf:
+            raise _ioerror(e)
+        if not rc:
             # EOF
-            return ret
-        else:
-            tries -= 1
-            if tries < 0:
-                raise IOError("Failed after %s tries on read." % MAX_TRIES)
-            time.sleep(SLEEP)
-
-    return ret
+            break
+        n += rc
+    return n
 
 
-def writen(fd, buf):
-    size = len(buf)
+def pwriten(fd, view, offset):
+    size = len(view)
     n = 0
     tries = 0
     while n < size:
         try:
-            rc = os.write(fd, buf[n:])
+            rc = _pwrite(fd, view[n:], offset + n)
         except OSError as e:
-            raise IOError(e.message)
+            raise _ioerror(e)
         if rc > 0:
             n += rc
             tries = MAX_TRIES
@@ -49,3 +87,72 @@ def writen(fd, buf):
             time.sleep(SLEEP)
 
     return n
+
+
+class BufferPool(object):
+    """ bytearrays of "size" bytes, made when nobody gave one back """
+
+    def __init__(self, size):
+        self.size = size
+        self.free = []
+        self.made = 0
+        self.lock = threading.Lock()
+
+    def get(self):
+        with self.lock:
+            if self.free:
+                return self.free.pop()
+            self.made += 1
+        return bytearray(self.size)
+
+    def put(self, buf):
+        with self.lock:
+            self.free.append(buf)
+
+    @contextmanager
+    def buffer(self):
+        """ a memoryview of a buffer of the pool, for the with block """
+        buf = self.get()
+        try:
+            yield memoryview(buf)
+        finally:
+            self.put(buf)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def pool(size=BLOCKSIZE):
+    with _pools_lock:
+        if size not in _pools:
+            _pools[size] = BufferPool(size)
+        return _pools[size]
+
+
+def hash_range(fd, offset, length, m, blocksize=BLOCKSIZE):
+    """ update "m" with "length" bytes at "offset", returns the count """
+    done = 0
+    with pool(blocksize).buffer() as view:
+        while done < length:
+            n = preadn(fd, view[:min(blocksize, length - done)], offset + done)
+            if n == 0:
+                break
+            m.update(view[:n])
+            done += n
+    return done
+
+
+def copy_range(rfd, wfd, offset, length, m=None, blocksize=BLOCKSIZE):
+    """ copy "length" bytes at "offset", returns the count """
+    done = 0
+    with pool(blocksize).buffer() as view:
+        while done < length:
+            n = preadn(rfd, view[:min(blocksize, length - done)], offset + done)
+            if n == 0:
+                break
+            pwriten(wfd, view[:n], offset + done)
+            if m:
+                m.update(view[:n])
+            done += n
+    return done
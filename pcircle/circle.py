@@ -13,6 +13,12 @@ import time
 from collections import deque
 from pprint import pprint
 import itertools
+import numpy as np
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 
 """
 
@@ -53,19 +59,31 @@ Reduce Note:
 from pcircle import utils
 from pcircle.globals import T, G
 from pcircle.dbstore import DbStore
+from pcircle.segstore import make_store
 from pcircle.utils import getLogger
-from pcircle.token import Token
+from pcircle.token import make_term
+from pcircle import wire
+from pcircle import steal
+from pcircle.split import make_split, split_ranges
+from pcircle.fdef import ChunkRange
+from pcircle.idle import make_idle
+from pcircle.executor import IOExecutor
+from pcircle.vreduce import ReduceSchema
+from pcircle import counters
+from pcircle import trace
+from pcircle.mpihelper import PostedRecv, SendQueue, wait_any
 from builtins import range
 
 DB_BUFSIZE = 10000
 
 
 class Circle:
-    def __init__(self, name="Circle", split="equal", k=2, dbname=None, resume=False):
+    def __init__(self, name="Circle", split=None, k=2, dbname=None, resume=False, term=None):
 
         random.seed()  # use system time to seed
         self.comm = MPI.COMM_WORLD
         self.comm.Set_name(name)
+        self.name = name
         self.size = self.comm.Get_size()
         self.rank = self.comm.Get_rank()
         self.host = MPI.Get_processor_name()
@@ -74,12 +92,16 @@ class Circle:
         self.d = {"rank": "rank %s" % self.rank}
         self.logger = getLogger(__name__)
 
-        self.split = split
+        self.split = split if split else G.split_policy
+        self.term = term if term else G.term_policy
+        self.splitter = make_split(self.split, G.split_min_items, G.split_min_bytes)
         self.dbname = dbname
         self.resume = resume
         self.reduce_time_interval = G.reduce_interval
 
         self.task = None
+        self.executor = None
+        self.batching = False
         self.abort = False
         self.requestors = []
 
@@ -87,8 +109,9 @@ class Circle:
         self.work_requested = 0
         self.work_processed = 0
         self.work_request_received = 0
-        self.workreq_outstanding = False
-        self.workreq_rank = None
+        # ranks we have sent a work request to and not heard back from
+        self.workreq_outstanding = set()
+        self.steal_requests = max(1, min(G.steal_requests, self.size - 1))
 
         # reduction
         self.reduce_enabled = False
@@ -96,8 +119,21 @@ class Circle:
         self.reduce_outstanding = False
         self.reduce_replies = 0
         self.reduce_buf = {}
+        self.reduce_schema = None   # task.reduce_fields, see vreduce.py
+        self.reduce_comm = None
+        self.reduce_reqs = []
         self.reduce_status = None
 
+        # idle strategy and time spent in each loop state
+        self.idler = make_idle(G.idle_policy, self, G.idle_min, G.idle_max)
+        self.state_time = {"work": 0.0, "comm": 0.0, "idle": 0.0, "term": 0.0}
+        self.counters = counters.Counters()
+        self.tracer = None
+        if G.trace_file:
+            self.tracer = trace.Tracer(self.comm, G.trace_events)
+        self.barrier_time_start = 0
+        self.time_begin = self.time_end = MPI.Wtime()
+
         # periodic report
         self.report_enabled = False
         self.report_interval = 60
@@ -121,7 +157,10 @@ class Circle:
                 pass
 
         # token
-        self.token = Token(self)
+        self.token = make_term(self.term, self)
+
+        # work stealing victim selection
+        self.victim = steal.make_policy(G.steal_policy, self.comm, G.steal_local_tries)
 
         # tree init
         self.k = k
@@ -151,6 +190,11 @@ class Circle:
         self.logger.debug("parent: %s, children: %s" % (self.parent_rank, self.child_ranks),
                           extra=self.d)
 
+        # every protocol message lands in a pre-posted receive,
+        # every send is non-blocking and completed lazily
+        self.sends = SendQueue()
+        self.post_recvs()
+
         # workq init
         # TODO: compare list vs. deque
         # 3 possible workq: workq, workq_buf(locates in memory, used when pushing to or retrieving from database )
@@ -165,7 +209,48 @@ class Circle:
 
         self.logger.debug("Circle initialized", extra=self.d)
 
+    def post_recvs(self):
+        """ post persistent receives for all tags but TOKEN (see Token) """
+        comm = self.comm
+        self.workreq_recv = PostedRecv(comm, np.zeros(1, dtype=np.int64),
+                                       MPI.ANY_SOURCE, T.WORK_REQUEST)
+        self.reply_recv = PostedRecv(comm, bytearray(G.WIRE_BUFSIZE), MPI.ANY_SOURCE, T.WORK_REPLY)
+        self.reduce_child_recvs = [PostedRecv(comm, bytearray(G.REDUCE_BUFSIZE), child, T.REDUCE)
+                                   for child in self.child_ranks]
+        self.barrier_child_recvs = [PostedRecv(comm, bytearray(1), child, T.BARRIER)
+                                    for child in self.child_ranks]
+        self.reduce_parent_recv = None
+        self.barrier_parent_recv = None
+        if self.parent_rank != MPI.PROC_NULL:
+            self.reduce_parent_recv = PostedRecv(comm, bytearray(1), self.parent_rank, T.REDUCE)
+            self.barrier_parent_recv = PostedRecv(comm, bytearray(1), self.parent_rank, T.BARRIER)
+
+        self.posted = [self.workreq_recv, self.reply_recv] + \
+            self.reduce_child_recvs + self.barrier_child_recvs
+        if self.parent_rank != MPI.PROC_NULL:
+            self.posted += [self.reduce_parent_recv, self.barrier_parent_recv]
+
+    def free_recvs(self):
+        """ cancel the pre-posted receives, complete the pending sends """
+        for p in self.posted:
+            if not p.cancel():
+                self.logger.warn("message lost at cancel, tag %s" % p.tag, extra=self.d)
+        self.posted = []
+        self.token.free()
+        self.sends.wait_all()
+
+    def isend(self, buf, dest, tag):
+        """ non-blocking buffer send, tracked until complete """
+        req = self.comm.Isend(buf, dest=dest, tag=tag)
+        self.sends.post(req, buf)
+
     def finalize(self, cleanup=True):
+        self.victim.free()
+        if G.counters_file:
+            self.report_counters(G.counters_file)
+        if self.tracer:
+            trace.write_trace(G.trace_file, self.name, self.tracer, self.comm)
+
         if cleanup and hasattr(self, "workq_db"):
             self.workq_db.cleanup()
 
@@ -191,20 +276,54 @@ class Circle:
                 self.dbname = os.path.join(G.tempdir, "workq-%s" % self.rank)
             else:
                 self.dbname = os.path.join(G.tempdir, "%s.workq-%s" % (dbname, self.rank))
-            self.workq_db = DbStore(self.dbname, resume=G.resume)
+            self.workq_db = make_store(G.spill_backend, self.dbname, resume=G.resume)
 
     # after task(fcp) creation, push works in workq_buf into workq_db
     def push_remaining_buf(self):
         if len(self.workq_buf) > 0:
+            self.count_spill()
             self.workq_db.mput(self.workq_buf)
             self.workq_db.clear()
 
+    def count_spill(self):
+        self.counters["spills"] += 1
+        self.counters["items_spilled"] += len(self.workq_buf)
+
+    def report_counters(self, path):
+        """ collective, gather the counters, rank 0 adds them to the
+        JSON report at "path", see counters.py """
+        mine = self.counters
+        mine["items_processed"] = self.work_processed
+        for k, v in self.state_time.items():
+            mine["time_" + k] = round(v, 6)
+        all_counters = self.comm.gather(mine)
+        if self.rank == 0:
+            phase = counters.phase_report(self.name, self.time_end - self.time_begin,
+                                          all_counters)
+            counters.write_report(path, phase)
+
     def next_proc(self):
         """ Note next proc could return rank of itself """
-        if self.size == 1:
-            return MPI.PROC_NULL
-        else:
-            return random.randint(0, self.size - 1)
+        return self.victim.next()
+
+    def state_summary(self):
+        """ collective, per-rank (work, comm, idle) seconds, returned at root """
+        st = self.state_time
+        mine = (round(st["work"], 2), round(st["comm"], 2), round(st["idle"], 2))
+        return self.comm.gather(mine)
+
+    def steal_summary(self):
+        """ collective, steal success rates of all ranks, returned at root """
+        all_counts = self.comm.gather(self.victim.stats())
+        if self.rank != 0:
+            return None
+        total = {}
+        for counts in all_counts:
+            for k, (attempts, successes) in counts.items():
+                cnt = total.setdefault(k, [0, 0])
+                cnt[0] += attempts
+                cnt[1] += successes
+        return "%s: %s" % (self.victim.name, steal.fmt_stats(total))
 
     def workq_info(self):
         s = "has %s items in work queue\n" % self.qsize
@@ -220,10 +339,26 @@ class Circle:
         """ entry point to work """
 
         self.task = task
+        if getattr(task, "reduce_fields", None):
+            self.reduce_schema = ReduceSchema(task.reduce_fields)
+            self.reduce_comm = self.comm.Dup()
+        self.time_begin = MPI.Wtime()
         self.task.create()
+        if G.io_threads > 0 and hasattr(task, "io"):
+            self.executor = IOExecutor(task.io, G.io_threads, G.io_depth)
+        elif G.batch_items > 1 and getattr(task, "batchable", False):
+            self.batching = True
         self.comm.barrier()
         self.loop()
+        if self.executor:
+            self.executor.shutdown()
+            self.executor = None
         self.cleanup()
+        self.free_recvs()
+        if self.reduce_comm:
+            self.reduce_comm.Free()
+            self.reduce_comm = None
+        self.time_end = MPI.Wtime()
         if self.report_enabled:
             self.do_periodic_report(prefix="Circle final report")
         self.comm.barrier()
@@ -236,10 +371,11 @@ class Circle:
 
     def loop(self):
         """ central loop to finish the work """
+        time_mark = MPI.Wtime()
         while True:
 
             # check if we shall do report
-            cur_time = MPI.Wtime()
+            cur_time = time_mark
             if self.report_enabled and (cur_time - self.report_last > self.report_interval):
                 self.report_last = cur_time
                 self.do_periodic_report()
@@ -254,13 +390,71 @@ class Circle:
                 self.request_work()
 
             # if I have work, and no abort signal, process one
-            if self.qsize() > 0 and not self.abort:
-                self.task.process()
-                self.work_processed += 1
+            # (or keep the I/O threads busy, in executor mode)
+            busy = self.qsize() > 0 and not self.abort
+            if self.executor:
+                busy = busy or self.executor.inflight() > 0
+            if busy:
+                time_mark = MPI.Wtime()
+                self.state_time["comm"] += time_mark - cur_time
+                if self.tracer:
+                    self.tracer.busy(time_mark)
+                if self.executor:
+                    n = self.io_progress()
+                elif self.batching:
+                    n = self.task.process_batch(G.batch_items, G.batch_time)
+                else:
+                    self.task.process()
+                    n = 1
+                self.work_processed += n
+                self.idler.reset()
+                cur_time, time_mark = time_mark, MPI.Wtime()
+                self.state_time["work"] += time_mark - cur_time
+                if self.tracer:
+                    self.tracer.span(trace.WORK, cur_time, time_mark, n)
             else:
+                time_mark = MPI.Wtime()
+                self.state_time["comm"] += time_mark - cur_time
                 status = self.token.check_for_term()
+                cur_time, time_mark = time_mark, MPI.Wtime()
+                self.state_time["term"] += time_mark - cur_time
+                if self.tracer:
+                    self.tracer.idle(cur_time)
                 if status == G.TERMINATE:
+                    if self.tracer:
+                        self.tracer.busy(time_mark)
                     break
+                self.idler.idle()
+                cur_time, time_mark = time_mark, MPI.Wtime()
+                self.state_time["idle"] += time_mark - cur_time
+
+    def io_progress(self):
+        """ executor mode: refill the pipeline from the queue, hand the
+        completions back to the task. The loop won't take part in termination
+        while anything is in flight, the I/O may produce more work.
+        """
+        ex = self.executor
+        while not self.abort and not ex.full() and self.qsize() > 0:
+            ex.submit(self.deq())
+
+        # nothing else to do but wait for the I/O, briefly so that
+        # incoming requests are still serviced
+        wait = 0 if self.qsize() > 0 and not self.abort else G.idle_max
+        n = 0
+        for work, result in ex.completed(wait):
+            self.task.io_done(work, result)
+            n += 1
+        return n
+
+    def io_pending(self):
+        """ work items handed to the I/O threads and not finished yet """
+        return self.executor.items() if self.executor else []
+
+    def wait_for_message(self, timeout, poll):
+        """ block until one of our pre-posted receives completes,
+        or "timeout" seconds passed, checking every "poll" seconds """
+        self.sends.progress()
+        return wait_any(self.posted + self.token.posted(), timeout, poll)
 
     def enq(self, work):
         if work is None:
@@ -275,6 +469,7 @@ class Circle:
                 if self.use_store == False:
                     self.workq_init(self.dbname, G.resume)
                     self.use_store = True
+                self.count_spill()
                 self.workq_db.mput(self.workq_buf)
                 self.workq_buf.clear()
 
@@ -287,20 +482,31 @@ class Circle:
     def deq(self):
         # deque a work starting from workq, then from workq_buf, then from workq_db
         if len(self.workq) > 0:
-            return self.workq.pop()
+            q = self.workq
         elif len(self.workq_buf) > 0:
-            return self.workq_buf.pop()
+            q = self.workq_buf
         elif hasattr(self, "workq_db") and len(self.workq_db) > 0:
             #read a batch of works into memory
             workq, objs_size = self.workq_db.mget(G.memitem_threshold)
             self.workq = deque(workq)
             self.workq_db.mdel(G.memitem_threshold, objs_size)
-            if len(self.workq) > 0:
-               return self.workq.pop()
+            if len(self.workq) == 0:
+                return None
+            q = self.workq
         else:
             return None
 
+        if isinstance(q[-1], ChunkRange):
+            # one chunk at a time, the range leaves once it is used up
+            work = q[-1].take()
+            if q[-1].start >= q[-1].end:
+                q.pop()
+            return work
+        return q.pop()
+
     def barrier_start(self):
+        if self.tracer and not self.barrier_started:
+            self.barrier_time_start = MPI.Wtime()
         self.barrier_started = True
 
     def barrier_test(self):
@@ -310,19 +516,17 @@ class Circle:
         # check if we have received message from all children
         if self.barrier_replies < self.children:
             # still waiting for barries from children
-            st = MPI.Status()
-            flag = self.comm.Iprobe(MPI.ANY_SOURCE, T.BARRIER, st)
-            if flag:
-                child = st.Get_source()
-                self.comm.recv(source=child, tag=T.BARRIER)
-                self.barrier_replies += 1
+            for p in self.barrier_child_recvs:
+                if p.test():
+                    p.restart()
+                    self.barrier_replies += 1
 
         # if we have not sent a message to our parent, and we
         # have received a message from all of our children (or we have no children)
         # send a message to our parent
         if not self.barrier_up and self.barrier_replies == self.children:
             if self.parent_rank != MPI.PROC_NULL:
-                self.comm.send(None, self.parent_rank, T.BARRIER)
+                self.isend(bytearray(0), self.parent_rank, T.BARRIER)
 
             # transition to state where we're waiting for parent
             # to notify us that the barrier is complete
@@ -333,9 +537,8 @@ class Circle:
         if self.barrier_up:
             if self.parent_rank != MPI.PROC_NULL:
                 # check for message from parent
-                flag = self.comm.Iprobe(self.parent_rank, T.BARRIER)
-                if flag:
-                    self.comm.recv(source=self.parent_rank, tag=T.BARRIER)
+                if self.barrier_parent_recv.test():
+                    self.barrier_parent_recv.restart()
                     # mark barrier as complete
                     complete = True
             else:
@@ -346,7 +549,10 @@ class Circle:
         # barrier is complete, send messages to children if any and return true
         if complete:
             for child in self.child_ranks:
-                self.comm.send(None, dest=child, tag=T.BARRIER)
+                self.isend(bytearray(0), child, T.BARRIER)
+
+            if self.tracer:
+                self.tracer.span(trace.BARRIER, self.barrier_time_start, MPI.Wtime())
 
             # reset state for another barrier
             self.barrier_started = False
@@ -359,10 +565,9 @@ class Circle:
 
     def bcast_abort(self):
         self.abort = True
-        buf = G.ABORT
         for i in range(self.size):
             if (i != self.rank):
-                self.comm.send(buf, dest=i, tag=T.WORK_REQUEST)
+                self.isend(np.array([G.ABORT], dtype=np.int64), i, T.WORK_REQUEST)
                 self.logger.warn("abort message sent to %s" % i, extra=self.d)
 
     def cleanup(self):
@@ -396,6 +601,8 @@ class Circle:
                 if self.token.send_req.Test():
                     self.token.send_req = MPI.REQUEST_NULL
 
+            self.sends.progress()
+
 
     def workreq_check(self, cleanup=False):
         """ for any process that sends work request message:
@@ -406,14 +613,12 @@ class Circle:
                 send "no work" message to each requester
             reset the requester list to empty
         """
-        while True:
-            st = MPI.Status()
-            ret = self.comm.Iprobe(source=MPI.ANY_SOURCE, tag=T.WORK_REQUEST, status=st)
-            if not ret:  # no work request, break out the loop
-                break
+        self.sends.progress()
+        while self.workreq_recv.test():
             # we have work request message
-            rank = st.Get_source()
-            buf = self.comm.recv(source=rank, tag=T.WORK_REQUEST, status=st)
+            rank = self.workreq_recv.status.Get_source()
+            buf = int(self.workreq_recv.buf[0])
+            self.workreq_recv.restart()
             if buf == G.ABORT:
                 self.logger.warn("Abort request from rank %s" % rank, extra=self.d)
                 self.abort = True
@@ -421,6 +626,7 @@ class Circle:
                 return
             else:
                 self.logger.debug("receive work request from requestor [%s]" % rank, extra=self.d)
+                self.counters["steal_requests_received"] += 1
                 # add rank to requesters
                 self.requestors.append(rank)
 
@@ -457,40 +663,28 @@ class Circle:
         """
         @rcount: # of requestors
         @wcount: # of work items
-        @return: spread it evenly among all requesters
-
-        case 1: wcount == rcount:
-                    base = 0
-                    extra = wcount
-                    each requestor get 1
-        case 2: wcount < rcount:
-                    base = 0
-                    extra = wcount
-                    first "wcount" requester get 1
-        case 3: wcount > rcount:
-                    is it possible?
-        """
+        @return: # of work items for each requester, as decided by the split policy
 
-        if self.split != "equal":
-            raise NotImplementedError
-        base = wcount // (rcount + 1)  # leave self a base number of works
-        extra = wcount - base * (rcount + 1)
-        assert extra <= rcount
-        sizes = [base] * rcount
-        for i in range(extra):
-            sizes[i] += 1
-        return sizes
+        The sizes are taken from the left of self.workq in requester order,
+        see pcircle/split.py. A policy may hand out zero to everyone when
+        the queue is too small to be worth splitting.
+        """
+        return self.splitter.spread(self.workq, rcount, wcount)
 
     def send_no_work(self, rank):
         """ send no work reply to someone requesting work"""
 
-        buf = {G.KEY: G.ABORT} if self.abort else {G.KEY: G.ZERO}
-        r = self.comm.isend(buf, dest=rank, tag=T.WORK_REPLY)
-        r.wait()
+        buf = wire.encode_ctrl(G.ABORT if self.abort else G.ZERO)
+        self.isend([buf, MPI.BYTE], rank, T.WORK_REPLY)
+        if self.tracer:
+            self.tracer.instant(trace.STEAL_SERVED, 0)
         self.logger.debug("Send no work reply to %s" % rank, extra=self.d)
 
     def send_work_to_many(self):
         rcount = len(self.requestors)
+        if len(self.workq) <= rcount:
+            # too few items to go around, cut ranges of chunks in two
+            split_ranges(self.workq, rcount + 1)
         wcount = len(self.workq)
         sizes = self.spread_counts(rcount, wcount)
 
@@ -509,18 +703,29 @@ class Circle:
             return
 
         # for termination detection
-        if (rank < self.rank) or (rank == self.token.src):
-            self.token.proc = G.BLACK
+        self.token.work_sent(rank)
 
         buf = None
 
         # based on if it is memory or store-based
         # we have different ways of constructing buf
         sliced = list(itertools.islice(self.workq, 0, witems))
-        buf = {G.KEY: witems, G.VAL: sliced}
-
-        self.comm.send(buf, dest=rank, tag=T.WORK_REPLY)
+        buf = wire.encode_work(sliced, rank)
+        while len(buf) > G.WIRE_BUFSIZE:
+            # must fit in the thief's pre-posted receive buffer
+            if witems == 1:
+                raise ValueError("work item too large to send: %s" % sliced[0])
+            witems //= 2
+            sliced = sliced[:witems]
+            buf = wire.encode_work(sliced, rank)
+
+        self.isend([buf, MPI.BYTE], rank, T.WORK_REPLY)
+        wire.mark_sent(sliced, rank)
         self.logger.debug("%s work items sent to rank %s" % (witems, rank), extra=self.d)
+        self.counters["items_given"] += witems
+        self.counters["bytes_given"] += len(buf)
+        if self.tracer:
+            self.tracer.instant(trace.STEAL_SERVED, witems)
 
         # remove (witems) of work items
         # for DbStotre, all we need is a number, not the actual objects
@@ -534,36 +739,44 @@ class Circle:
             self.workq.popleft()
 
     def request_work(self, cleanup=False):
-        if self.workreq_outstanding:
-            st = MPI.Status()
-            reply = self.comm.Iprobe(source=self.work_requested_rank,
-                                     tag=T.WORK_REPLY, status=st)
-            if reply:
-                self.work_receive(self.work_requested_rank)
-                # flip flag to indicate we no longer waiting for reply
-                self.workreq_outstanding = False
-                # else:
-                #    self.logger.debug("has req outstanding, dest = %s, no reply" %
-                #                 self.work_requested_rank, extra = self.d)
-
-        elif not cleanup:
-            # send request
+        """ keep up to self.steal_requests work requests outstanding,
+        to distinct victims. The first work reply gets us going, later
+        ones are simply appended to the queue.
+        """
+        # also drains unsolicited replies, e.g. to an abort broadcast
+        while self.reply_recv.test():
+            self.work_receive()
+
+        if cleanup or self.qsize() > 0:
+            return
+
+        # send requests, skipping ranks we are already waiting on
+        buf = G.ABORT if self.abort else G.MSG
+        for i in range(self.steal_requests - len(self.workreq_outstanding)):
             dest = self.next_proc()
-            if dest == self.rank or dest == MPI.PROC_NULL:
-                # have no one to ask, we are done
-                return
-            buf = G.ABORT if self.abort else G.MSG
-            # blocking send
+            if dest == self.rank or dest == MPI.PROC_NULL or dest in self.workreq_outstanding:
+                # try again next time around
+                continue
             self.logger.debug("send work request to rank %s : %s" % (dest, G.str[buf]),
                               extra=self.d)
-            self.comm.send(buf, dest, T.WORK_REQUEST)
-            self.workreq_outstanding = True
-            self.work_requested_rank = dest
-
-    def work_receive(self, rank):
-        """ when incoming work reply detected """
-
-        buf = self.comm.recv(source=rank, tag=T.WORK_REPLY)
+            self.isend(np.array([buf], dtype=np.int64), dest, T.WORK_REQUEST)
+            self.workreq_outstanding.add(dest)
+            self.work_requested += 1
+            self.counters["steal_requests_sent"] += 1
+            if self.tracer:
+                self.tracer.instant(trace.STEAL_REQUEST, dest)
+
+    def work_receive(self):
+        """ when incoming work reply landed in the pre-posted buffer """
+
+        rank = self.reply_recv.status.Get_source()
+        count = self.reply_recv.count()
+        buf = wire.decode(memoryview(self.reply_recv.buf)[:count], rank)
+        self.reply_recv.restart()
+        self.workreq_outstanding.discard(rank)
+        if self.tracer:
+            self.tracer.instant(trace.STEAL_REPLY, len(buf.get(G.VAL) or ()))
+        self.victim.record(rank, buf[G.KEY] not in (G.ZERO, G.ABORT))
 
         if buf[G.KEY] == G.ABORT:
             self.logger.debug("receive abort signal", extra=self.d)
@@ -571,9 +784,14 @@ class Circle:
             return
         elif buf[G.KEY] == G.ZERO:
             self.logger.debug("receive no work signal", extra=self.d)
+            self.counters["steals_empty"] += 1
             return
         else:
             assert type(buf[G.VAL]) == list
+            self.counters["steals_ok"] += 1
+            self.counters["items_stolen"] += len(buf[G.VAL])
+            self.counters["bytes_stolen"] += count
+            self.token.work_received(rank)
             self.workq.extend(buf[G.VAL])
 
     def reduce(self, buf):
@@ -585,17 +803,20 @@ class Circle:
         initiate and progress a reduce operation at specified interval,
         ensure progress of reduction in background, stop reduction if cleanup flag is True
         """
+        if self.reduce_schema:
+            return self.reduce_check_vector(cleanup)
 
         if self.reduce_outstanding:
             # if we have outstanding reduce, check message from children
             # otherwise, check whether we should start new reduce
 
-            for child in self.child_ranks:
-                if self.comm.Iprobe(source=child, tag=T.REDUCE):
+            for child, p in zip(self.child_ranks, self.reduce_child_recvs):
+                if p.test():
                     # receive message from child
                     # 'status' element is G.MSG_VALID or not
                     # the rest is opaque
-                    inbuf = self.comm.recv(source=child, tag=T.REDUCE)
+                    inbuf = pickle.loads(bytes(p.buf[:p.count()]))
+                    p.restart()
                     self.reduce_replies += 1
 
                     self.logger.debug("client data from %s: %s" %
@@ -616,7 +837,7 @@ class Circle:
 
                 # send message to parent if we have one
                 if self.parent_rank != MPI.PROC_NULL:
-                    self.comm.send(self.reduce_buf, self.parent_rank, T.REDUCE)
+                    self.send_reduce_buf()
                 else:
                     # we are the root, print results if we have valid data
                     if self.reduce_status and hasattr(self.task, "reduce_report"):
@@ -628,6 +849,8 @@ class Circle:
 
                 # disable flag to indicate we got what we want
                 self.reduce_outstanding = False
+                if self.tracer:
+                    self.tracer.span(trace.REDUCE, self.reduce_time_last, MPI.Wtime())
         else:
             # we don't have an outstanding reduction
             # determine if a new reduce should be started
@@ -642,10 +865,10 @@ class Circle:
                 if self.parent_rank == MPI.PROC_NULL:
                     # we are root, kick it off
                     start_reduce = True
-                elif self.comm.Iprobe(source=self.parent_rank, tag=T.REDUCE):
+                elif self.reduce_parent_recv.test():
                     # we are not root, check if parent sent us a message
                     # receive message from parent and set flag to start reduce
-                    self.comm.recv(source=self.parent_rank, tag=T.REDUCE)
+                    self.reduce_parent_recv.restart()
                     start_reduce = True
 
             # it is critical that we don't start a reduce if we are in cleanup
@@ -657,7 +880,8 @@ class Circle:
                 # if we have parent, send invalid msg
                 if self.parent_rank != MPI.PROC_NULL:
                     self.reduce_status = G.MSG_INVALID
-                    self.comm.send(self.reduce_buf, self.parent_rank, T.REDUCE)
+                    self.reduce_buf['status'] = G.MSG_INVALID
+                    self.send_reduce_buf()
 
             if start_reduce:
                 # set flag to indicate we have a reduce outstanding
@@ -675,7 +899,53 @@ class Circle:
 
                 # sent message to each child
                 for child in self.child_ranks:
-                    self.comm.send(None, child, T.REDUCE)
+                    self.isend(bytearray(0), child, T.REDUCE)
+
+    def reduce_check_vector(self, cleanup=False):
+        """ reduce_check() for tasks with reduce_fields: the start signal
+        still goes down the tree, the data goes up in Ireduce. Every rank
+        must join every reduction the root started, cleanup or not, the
+        root won't start the final barrier until it is complete.
+        """
+        if self.reduce_outstanding:
+            if MPI.Request.Testall(self.reduce_reqs):
+                self.reduce_outstanding = False
+                self.reduce_reqs = []
+                if self.tracer:
+                    self.tracer.span(trace.REDUCE, self.reduce_time_last, MPI.Wtime())
+                if self.parent_rank == MPI.PROC_NULL:
+                    buf = self.reduce_schema.result()
+                    if hasattr(self.task, "reduce_report"):
+                        self.task.reduce_report(buf)
+                    if hasattr(self.task, "reduce_finish"):
+                        self.task.reduce_finish(buf)
+            return
+
+        time_now = MPI.Wtime()
+        if self.parent_rank == MPI.PROC_NULL:
+            # we are root, kick it off, but never during cleanup
+            start_reduce = not cleanup and \
+                time_now >= self.reduce_time_last + self.reduce_time_interval
+        else:
+            start_reduce = self.reduce_parent_recv.test()
+            if start_reduce:
+                self.reduce_parent_recv.restart()
+
+        if start_reduce:
+            self.reduce_time_last = time_now
+            self.reduce_outstanding = True
+            for child in self.child_ranks:
+                self.isend(bytearray(0), child, T.REDUCE)
+
+            buf = {}
+            self.task.reduce_init(buf)
+            self.reduce_reqs = self.reduce_schema.start(self.reduce_comm, buf)
+
+    def send_reduce_buf(self):
+        buf = pickle.dumps(self.reduce_buf, pickle.HIGHEST_PROTOCOL)
+        if len(buf) > G.REDUCE_BUFSIZE:
+            raise ValueError("reduce buffer too large: %s bytes" % len(buf))
+        self.isend([buf, MPI.BYTE], self.parent_rank, T.REDUCE)
 
     def do_periodic_report(self, prefix="Circle report"):
         delta = self.work_processed - self.report_processed
@@ -687,6 +957,9 @@ class Circle:
             len(self.workq), "|", "work processed:", self.work_processed)
         s += "\t{:<20}{:<10,}{:5}{:<20}{:<10}\n".format("work delta:", delta,
                 "|", "rate:", "%s /s" % rate)
+        s += "\t{:<20}{:<10}{:5}{:<20}{:<10}\n".format("idle strategy:", self.idler.name,
+                "|", "work/comm/idle:", "%.2fs / %.2fs / %.2fs" % (self.state_time["work"],
+                self.state_time["comm"], self.state_time["idle"]))
         print(s)
 
     @staticmethod
@@ -0,0 +1,133 @@
+from __future__ import absolute_import
+
+import errno
+import os
+import threading
+
+from pcircle.cio import copy_range
+from pcircle.pipeline import Pipeline
+
+__author__ = 'Feiyi Wang'
+
+"""
+How FCP moves the bytes of a chunk, fcp --copy-engine.
+
+    kernel      copy_file_range(), or sendfile() before Python 3.8: the
+                kernel moves the data from file to file, nothing goes
+                through Python, and file systems that can copy on the
+                server side (NFS 4.2, CIFS, XFS and Btrfs reflinks) do.
+    readwrite   pread() into a buffer, pwrite() it back out (cio.py),
+                every byte through user space. Only this one has the bytes
+                to feed the --verify hash on the way, FCP takes it then.
+                With a depth of 2 or more it reads, writes and hashes
+                in a pipeline, see pipeline.py.
+
+A kernel call that the kernel or the file systems don't do fails with
+EXDEV, ENOSYS, EOPNOTSUPP or EINVAL. The engine drops it for the rest of
+the run and carries on where it was with the next one, read/write last.
+
+    engine.copy(rfd, wfd, offset, length, m=None)
+        copy "length" bytes at "offset", fewer at the end of rfd, update
+        the hash "m" with them if there is one. Returns the bytes copied,
+        raises OSError or IOError.
+    engine.close()
+        stop the threads of the engine, if it has any
+"""
+
+ENGINES = ["kernel", "readwrite"]
+
+UNSUPPORTED = frozenset(getattr(errno, name) for name in
+                        ("EXDEV", "ENOSYS", "EOPNOTSUPP", "ENOTSUP", "EINVAL")
+                        if hasattr(errno, name))
+
+
+def copy_file_range(rfd, wfd, offset, count):
+    return os.copy_file_range(rfd, wfd, count, offset, offset)
+
+
+def sendfile(rfd, wfd, offset, count):
+    # reads at "offset", writes where wfd is
+    os.lseek(wfd, offset, os.SEEK_SET)
+    return os.sendfile(wfd, rfd, offset, count)
+
+
+class ReadWrite(object):
+    name = "readwrite"
+
+    def __init__(self, blocksize=1024 * 1024, depth=0):
+        self.blocksize = blocksize
+        self.depth = depth
+        self.pipeline = None
+        self.lock = threading.Lock()
+
+    def describe(self):
+        if self.depth > 1:
+            return "read/write, depth %s" % self.depth
+        return "read/write"
+
+    def copy(self, rfd, wfd, offset, length, m=None):
+        if self.depth < 2:
+            return copy_range(rfd, wfd, offset, length, m, self.blocksize)
+        with self.lock:
+            # the threads start with the first chunk that needs them
+            if self.pipeline is None:
+                self.pipeline = Pipeline(self.blocksize, self.depth)
+        return self.pipeline.copy(rfd, wfd, offset, length, m)
+
+    def close(self):
+        if self.pipeline:
+            self.pipeline.close()
+            self.pipeline = None
+
+
+class Kernel(ReadWrite):
+    name = "kernel"
+
+    def __init__(self, blocksize=1024 * 1024, depth=0):
+        ReadWrite.__init__(self, blocksize, depth)
+        self.calls = []
+        if hasattr(os, "copy_file_range"):
+            self.calls.append(copy_file_range)
+        if hasattr(os, "sendfile"):
+            self.calls.append(sendfile)
+
+    def describe(self):
+        calls = self.calls
+        return calls[0].__name__ if calls else ReadWrite.describe(self)
+
+    def drop(self, call):
+        # I/O threads share the engine, replace the list, don't edit it
+        self.calls = [c for c in self.calls if c is not call]
+
+    def copy(self, rfd, wfd, offset, length, m=None):
+        if m:
+            return ReadWrite.copy(self, rfd, wfd, offset, length, m)
+
+        done = 0
+        while done < length and self.calls:
+            call = self.calls[0]
+            try:
+                n = call(rfd, wfd, offset + done, length - done)
+            except OSError as e:
+                if e.errno not in UNSUPPORTED:
+                    raise
+                self.drop(call)
+                continue
+            if n == 0:
+                # the end of rfd, or a file the kernel can't tell the size
+                # of (procfs and friends): read() knows
+                break
+            done += n
+
+        if done < length:
+            done += ReadWrite.copy(self, rfd, wfd, offset + done, length - done)
+        return done
+
+
+def make_engine(name, blocksize=1024 * 1024, depth=0):
+    if name == "kernel":
+        return Kernel(blocksize, depth)
+    elif name == "readwrite":
+        return ReadWrite(blocksize, depth)
+    else:
+        raise NotImplementedError("Unknown copy engine: %s" % name)
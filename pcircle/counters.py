@@ -0,0 +1,96 @@
+from __future__ import absolute_import
+from __future__ import division
+
+import json
+import math
+from collections import OrderedDict
+
+__author__ = 'Feiyi Wang'
+
+"""
+Circle runtime counters, and the end-of-run load balance report.
+
+Every Circle keeps a Counters; Circle.finalize() gathers them on rank 0
+and, with --counters FILE, appends the phase to a JSON report:
+
+    {"phases": [{"name": "fwalk", "ranks": 64, "elapsed": 12.3,
+                 "counters": {"items_processed": {"total": ..., "min": ...,
+                              "max": ..., "mean": ..., "max_mean": ...,
+                              "cv": ..., "per_rank": [...]}, ...}}, ...]}
+
+max_mean is max / mean, cv the coefficient of variation (stddev / mean),
+both 0 when nothing was counted. The file is rewritten after every phase,
+so a tool that dies halfway still leaves the phases it finished.
+"""
+
+NAMES = (
+    "items_processed",
+    "steal_requests_sent",      # work requests we sent
+    "steal_requests_received",  # work requests others sent us
+    "steals_ok",                # replies to our requests that carried work
+    "steals_empty",             # ... that didn't
+    "items_stolen",             # items received in work replies
+    "bytes_stolen",             # wire bytes of those replies
+    "items_given",              # items sent to thieves
+    "bytes_given",
+    "spills",                   # work queue batches spilled to the DbStore
+    "items_spilled",
+    "time_work",                # seconds, see Circle.loop()
+    "time_comm",
+    "time_idle",
+    "time_term",
+)
+
+# phases reported so far by this process, rank 0 only
+phases = []
+
+
+class Counters(OrderedDict):
+
+    def __init__(self):
+        OrderedDict.__init__(self, ((name, 0) for name in NAMES))
+
+
+def imbalance(values):
+    """ summary statistics of a per-rank list of values """
+    n = len(values)
+    total = sum(values)
+    mean = total / n if n else 0
+    if mean:
+        var = sum((v - mean) ** 2 for v in values) / n
+        max_mean = max(values) / mean
+        cv = math.sqrt(var) / mean
+    else:
+        max_mean = cv = 0.0
+    if isinstance(total, float):
+        total = round(total, 6)
+    return OrderedDict([
+        ("total", total),
+        ("min", min(values) if n else 0),
+        ("max", max(values) if n else 0),
+        ("mean", round(mean, 6)),
+        ("max_mean", round(max_mean, 4)),
+        ("cv", round(cv, 4)),
+        ("per_rank", values),
+    ])
+
+
+def phase_report(name, elapsed, all_counters):
+    """ report of one Circle, from the list of per-rank Counters """
+    out = OrderedDict()
+    for key in NAMES:
+        out[key] = imbalance([c[key] for c in all_counters])
+    return OrderedDict([
+        ("name", name),
+        ("ranks", len(all_counters)),
+        ("elapsed", round(elapsed, 6)),
+        ("counters", out),
+    ])
+
+
+def write_report(path, phase):
+    """ add the phase, rewrite the whole report """
+    phases.append(phase)
+    with open(path, "w") as f:
+        json.dump({"phases": phases}, f, indent=2)
+        f.write("\n")
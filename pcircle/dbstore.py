@@ -3,6 +3,7 @@ import os
 import sys
 import os.path
 import sqlite3
+import zlib
 
 try:
     import cPickle as pickle
@@ -10,7 +11,7 @@ except ImportError:
     import pickle
 
 from collections import deque
-from pcircle.fdef import FileItem, FileChunk, ChunkSum
+from pcircle.fdef import FileItem, FileChunk, ChunkSum, ChunkRange
 from pcircle.utils import getLogger
 
 __author__ = 'Feiyi Wang'
@@ -24,17 +25,25 @@ API summary:
     put(self, obj)  - put single object
     mget(self, N) - get multiple objects
     mput(self, objs) - put multiple objects
-    delete(self, obj)  - delete single object
-    mdel(self, objs) - delete multiple objects
+    mdel(self, N) - delete multiple objects
     size()  - length
+    sync() - write qsize/fsize and the WAL into the database file
 
     # these two operations are dangerous
     # and not encouraged
 
     pop(self) - get and remove one object
-    popn(self, N) - get and remove multiple objects
 
+Objects are stored in batches: one workq row holds up to "batch" objects,
+pickled as a list and zlib compressed, with the object count in "cnt".
+Rows are consumed in id order, so the store only keeps the id of the head
+row; mget() reads rows from there and mdel() deletes whole rows with an id
+range, rewriting a partially consumed head row. Rows without a count, as
+written by older versions, hold a single uncompressed object.
 
+The database is scratch data: it runs in WAL mode without fsync. With
+checkpoint=False the checkpoint table is only written by sync(), which fcp
+calls before copying the file.
 
 These are the two sizes we track:
 
@@ -47,7 +56,7 @@ DB_BUFSIZE = 10000
 
 class DbStore(object):
     def __init__(self, dbname,
-                 resume=False):
+                 resume=False, batch=DB_BUFSIZE, checkpoint=True, compress=1):
 
         self.dbname = dbname
         self.conn = None
@@ -60,29 +69,35 @@ class DbStore(object):
 
         try:
             self.conn = sqlite3.connect(dbname)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=OFF")
         except sqlite3.OperationalError as e:
             self.logger.error(e, extra=self.d)
             sys.exit(1)
         self.cur = self.conn.cursor()
         self.resume = resume
+        self.batch = batch
+        self.checkpoint = checkpoint
+        self.compress = compress
         self.count = 0
         self.totalsz = 0
         self.fsize = 0
         self.qsize = 0
-        self.workq = deque()
-        self.workq_cnt = 0
+        self.head_id = 0
+        # decoded rows from the head, [id, objs], see mget()
+        self.rows = deque()
 
         if not resume:
             self.conn.execute("DROP TABLE IF EXISTS workq")
             self.conn.execute("DROP TABLE IF EXISTS backup")
             self.conn.execute("DROP TABLE IF EXISTS checkpoint")
-            self.conn.execute("CREATE TABLE workq (id INTEGER PRIMARY KEY, work BLOB)")
+            self.conn.execute("CREATE TABLE workq (id INTEGER PRIMARY KEY, work BLOB, cnt INTEGER)")
             self.conn.execute("CREATE TABLE backup (id INTEGER PRIMARY KEY, work BLOB)")
             self.conn.execute("CREATE TABLE checkpoint(qsize, fsize)")
             self.conn.execute("INSERT INTO checkpoint values(?, ?)",
                               (self.qsize, self.fsize))
             self.conn.execute("INSERT INTO backup (work) values(?)",
-                              (sqlite3.Binary(str(0)),))
+                              (sqlite3.Binary(pickle.dumps(0)),))
             self.conn.commit()
         else:
             self.recalibrate()
@@ -92,7 +107,7 @@ class DbStore(object):
     def _restore_from_backup(self):
         self.cur.execute("SELECT work FROM backup WHERE id=1")
         pdata = self.cur.fetchone()[0]
-        obj = pickle.loads(str(pdata))
+        obj = pickle.loads(bytes(pdata))
         self.cur.execute("INSERT INTO workq (work) VALUES (?)", (pdata,))
         self.tracksize(self.cur, obj)
 
@@ -111,6 +126,14 @@ class DbStore(object):
         except sqlite3.OperationalError as e:
             self.qsize = 0
 
+        # older databases have one object per row, and no count
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(workq)")]
+        if columns and "cnt" not in columns:
+            with self.conn:
+                self.conn.execute("ALTER TABLE workq ADD COLUMN cnt INTEGER")
+        self.cur.execute("SELECT MIN(id) FROM workq")
+        self.head_id = self.cur.fetchone()[0] or 0
+
         # we do restore_db() after looking up the checkpoint table
         # as _restore_from_backup() will try to update checkpoint table
         # with qsize and fsize since we don't have that information at this point
@@ -131,14 +154,28 @@ class DbStore(object):
 
         #cur.execute("UPDATE checkpoint SET qsize=?, fsize=?", (self.qsize, self.fsize))
 
-    def put(self, obj):
-        # should it be a transaction?
-        pdata = sqlite3.Binary(pickle.dumps(obj, pickle.HIGHEST_PROTOCOL))
-        with self.conn:
-            self.conn.execute("INSERT INTO workq (work) VALUES (?)", (pdata,))
-            self.tracksize(self.conn, obj)
+    def _encode(self, objs):
+        data = pickle.dumps(list(objs), pickle.HIGHEST_PROTOCOL)
+        if self.compress:
+            data = zlib.compress(data, self.compress)
+        return sqlite3.Binary(data)
+
+    @staticmethod
+    def _decode(work, cnt):
+        data = bytes(work)
+        if cnt is None:
+            return [pickle.loads(data)]
+        if data[:1] == b"x":    # zlib header
+            data = zlib.decompress(data)
+        return pickle.loads(data)
+
+    def _update_checkpoint(self, cur, force=False):
+        if self.checkpoint or force:
             cur.execute("UPDATE checkpoint SET qsize=?, fsize=?", (self.qsize, self.fsize))
 
+    def put(self, obj):
+        self.mput([obj])
+
     # alias append to match list
     append = put
 
@@ -148,13 +185,16 @@ class DbStore(object):
             self.circle.exit(0)
 
     def mput(self, objs):
+        objs = list(objs)
+        rows = []
+        for i in range(0, len(objs), self.batch):
+            chunk = objs[i:i + self.batch]
+            rows.append((self._encode(chunk), len(chunk)))
         with self.conn:
-            for obj in objs:
-                pdata = sqlite3.Binary(pickle.dumps(obj, pickle.HIGHEST_PROTOCOL))
-                self.conn.execute("INSERT INTO workq (work) VALUES (?)", (pdata,))
-                self.tracksize(self.conn, obj)
-
-            self.cur.execute("UPDATE checkpoint SET qsize=?, fsize=?", (self.qsize, self.fsize))
+            self.conn.executemany("INSERT INTO workq (work, cnt) VALUES (?, ?)", rows)
+            self.qsize += len(objs)
+            self.fsize += self._objs_size(objs)
+            self._update_checkpoint(self.conn)
         self.logger.debug("%s objs inserted to %s" % (len(objs), self.dbname), extra=self.d)
 
     # alias extend to match list
@@ -164,7 +204,7 @@ class DbStore(object):
     def _obj_size(obj):
         if isinstance(obj, FileItem):
             return 0
-        elif isinstance(obj, FileChunk) or isinstance(obj, ChunkSum):
+        elif isinstance(obj, (FileChunk, ChunkSum, ChunkRange)):
             return obj.length
         else:
             return 0
@@ -181,56 +221,100 @@ class DbStore(object):
 
     get = first
 
+    def _load(self, n):
+        """ decode rows from the head until self.rows holds n objects """
+        have = sum(len(objs) for _, objs in self.rows)
+        if have >= n:
+            return
+        after = self.rows[-1][0] if self.rows else self.head_id - 1
+        cur = self.conn.execute("SELECT id, work, cnt FROM workq WHERE id > ? ORDER BY id", (after,))
+        for rowid, work, cnt in cur:
+            objs = self._decode(work, cnt)
+            self.rows.append([rowid, objs])
+            have += len(objs)
+            if have >= n:
+                break
+        cur.close()
+
     def mget(self, n):
-        objs = []
-        size = 0
         if n > self.qsize:
             n = self.qsize
-        with self.conn:
-            for row in self.conn.execute("SELECT work FROM workq LIMIT (?) OFFSET 0", (n,)):
-                obj = pickle.loads(str(row[0]))
-                objs.append(obj)
-                size += self._obj_size(obj)
+        self._load(n)
+        objs = []
+        for _, row in self.rows:
+            if len(objs) >= n:
+                break
+            objs.extend(row[:n - len(objs)])
+        size = self._objs_size(objs)
 
         return objs, size
 
     def mdel(self, n, size=0):
         if n > self.qsize:
             n = self.qsize
+        self._load(n)
+        left = n
+        last_full = None
+        partial = None
+        while left and self.rows:
+            rowid, objs = self.rows[0]
+            if len(objs) > left:
+                partial = self.rows[0]
+                partial[1] = objs[left:]
+                break
+            left -= len(objs)
+            last_full = rowid
+            self.rows.popleft()
         with self.conn:
             cur = self.conn.cursor()
-            cur.execute("DELETE FROM workq WHERE id in (SELECT id FROM workq LIMIT (?) OFFSET 0)",
-                        (n,))
+            if last_full is not None:
+                cur.execute("DELETE FROM workq WHERE id <= ?", (last_full,))
+                self.head_id = last_full + 1
+            if partial is not None:
+                rowid, objs = partial
+                cur.execute("UPDATE workq SET work=?, cnt=? WHERE id=?",
+                            (self._encode(objs), len(objs), rowid))
+                self.head_id = rowid
             self.qsize -= n
             self.fsize -= size
+            if self.qsize == 0:
+                # SQLite reuses row ids once the table is empty
+                self.head_id = 0
             # update checkpoint table
-            cur.execute("UPDATE checkpoint SET qsize=?, fsize=?", (self.qsize, self.fsize))
+            self._update_checkpoint(cur)
 
     def __getitem__(self, idx):
-        if idx > self.qsize:
+        if idx >= self.qsize:
             return None
-        self.cur.execute("SELECT work FROM workq LIMIT 1 OFFSET ?", (idx,))
-        data = str(self.cur.fetchone()[0])
-        return pickle.loads(data)
+        self._load(idx + 1)
+        for _, objs in self.rows:
+            if idx < len(objs):
+                return objs[idx]
+            idx -= len(objs)
+
+    def sync(self):
+        """ make the database file self contained, before copying it """
+        with self.conn:
+            self._update_checkpoint(self.conn, force=True)
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
 
     def cleanup(self):
         if os.path.exists(self.dbname):
             self.conn.close()
             os.remove(self.dbname)
+            for ext in ("-wal", "-shm"):
+                if os.path.exists(self.dbname + ext):
+                    os.remove(self.dbname + ext)
 
     def pop(self):
-        obj = None
-        rawobj = None
         if self.qsize == 0:
             return None
+        objs, size = self.mget(1)
+        obj = objs[0]
+        self.mdel(1, size)
         with self.conn:
-            self.cur.execute("SELECT work FROM workq LIMIT 1 OFFSET 0")
-            rawobj = self.cur.fetchone()[0]
-            obj = pickle.loads(str(rawobj))
-            self.cur.execute("DELETE FROM workq WHERE id = (SELECT id FROM workq LIMIT 1 OFFSET 0)")
-            self.cur.execute("UPDATE backup SET work=? WHERE id=1", (rawobj,))
-            self.tracksize(self.cur, obj, op="minus")
-            self.cur.execute("UPDATE checkpoint SET qsize=?, fsize=?", (self.qsize, self.fsize))
+            self.conn.execute("UPDATE backup SET work=? WHERE id=1",
+                              (sqlite3.Binary(pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)),))
         return obj
 
     def __len__(self):
@@ -0,0 +1,117 @@
+from __future__ import absolute_import
+
+import os
+import threading
+
+from pcircle.globals import G
+from pcircle.lru import LRU
+
+__author__ = 'Feiyi Wang'
+
+"""
+Directory relative metadata calls, the --dirfd walk mode.
+
+os.lstat("/a/b/c/d/file") makes the kernel (and Lustre or NFS) resolve
+every component from "/" again, for every file. With --dirfd the walkers
+keep the directories they work in open instead, and call
+
+    lstat(path)     fstatat(fd of dirname(path), basename(path))
+    scandir(path)   fdopendir() on the fd of path
+
+A directory is opened relative to its parent when the parent is open,
+so a directory read and then the lstat() of its entries, which usually
+follow on the same rank, resolve one name each. Work items stay plain
+paths: a rank that steals them opens the directories it needs once.
+
+Every thread has its own cache of at most G.dirfd_cache open directories,
+least recently used closed first. Needs Python 3 (dir_fd, scandir(fd)).
+"""
+
+_local = threading.local()
+_caches = []            # of all the threads, for close_all()
+_lock = threading.Lock()
+
+O_DIR = os.O_RDONLY | getattr(os, "O_DIRECTORY", 0) | getattr(os, "O_CLOEXEC", 0)
+
+
+def available():
+    return os.stat in getattr(os, "supports_dir_fd", ()) and \
+        os.scandir in getattr(os, "supports_fd", ())
+
+
+class DirCache(object):
+    """ open directory fds by path """
+
+    def __init__(self, capacity=64):
+        self.fds = LRU(max(2, capacity), callback=self._close)
+        self.opens = 0
+
+    @staticmethod
+    def _close(path, fd):
+        os.close(fd)
+
+    def fd(self, path):
+        fd = self.fds.get(path)
+        if fd != -1:
+            return fd
+        parent, name = os.path.split(path)
+        pfd = self.fds.get(parent) if name else -1
+        if pfd != -1:
+            fd = os.open(name, O_DIR, dir_fd=pfd)
+        else:
+            fd = os.open(path, O_DIR)
+        self.opens += 1
+        self.fds.set(path, fd)
+        return fd
+
+    def lstat(self, path):
+        parent, name = os.path.split(path)
+        if not name:
+            return os.lstat(path)
+        return os.stat(name, dir_fd=self.fd(parent), follow_symlinks=False)
+
+    def scandir(self, path):
+        """ entries of "path", their "path" is only the name, use
+        os.path.join(path, entry.name) """
+        # entries stat() relative to the fd they were read from, and a
+        # directory read in batches outlives its place in the cache
+        fd = os.dup(self.fd(path))
+        try:
+            it = os.scandir(fd)
+            try:
+                for entry in it:
+                    yield entry
+            finally:
+                it.close()
+        finally:
+            os.close(fd)
+
+    def close(self):
+        self.fds.clear()
+
+
+def cache():
+    """ the DirCache of this thread """
+    c = getattr(_local, "cache", None)
+    if c is None:
+        c = _local.cache = DirCache(G.dirfd_cache)
+        with _lock:
+            _caches.append(c)
+    return c
+
+
+def lstat(path):
+    return cache().lstat(path)
+
+
+def scandir(path):
+    return cache().scandir(path)
+
+
+def close_all():
+    """ close the directories of every thread, once the walk is over """
+    with _lock:
+        for c in _caches:
+            c.close()
+        del _caches[:]
+    _local.__dict__.clear()
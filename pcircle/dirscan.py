@@ -0,0 +1,94 @@
+from __future__ import absolute_import
+
+import itertools
+
+__author__ = 'Feiyi Wang'
+
+"""
+Huge directories, read in batches.
+
+FWalk and ProfileWalk used to read a directory in one go, within one
+process() call: a directory of 20 million entries kept its rank busy for
+an hour, while the other ranks waited for entries they couldn't steal
+before the read was over. With --dir-batch N (G.dir_batch), a directory is
+read N entries at a time instead. The entries of a batch go to the work
+queue, where other ranks can steal them, and a DirScan work item for the
+rest of the directory goes on top of them, so that the same rank reads on
+after Circle.loop() has served the steal requests.
+
+The open scandir() iterator stays with the rank, in Scanner.open. Should
+a DirScan be stolen after all (a short queue may be given away whole),
+the thief reads the directory from the start again, skipping the entries
+read already: the order is the same as long as the directory doesn't
+change. The iterator left behind is closed at the end of the walk.
+"""
+
+
+def _close(it):
+    close = getattr(it, "close", None)
+    if close:
+        close()
+
+
+class Scanner(object):
+    """ reads directories "batch" entries at a time, all at once for 0.
+    entry(path, DirEntry) makes the entries """
+
+    def __init__(self, scandir, entry, batch=0):
+        self.scandir = scandir
+        self.entry = entry
+        self.batch = batch
+        self.open = {}      # path -> (offset, iterator, entry read ahead)
+
+    def all(self, path):
+        """ all entries of "path" """
+        return [self.entry(path, e) for e in self.scandir(path)]
+
+    def read(self, path, offset=0):
+        """ the entries of "path" from "offset" on, at most "batch" of
+        them. Returns (entries, offset of the rest), the offset is None
+        when there is no rest """
+        if not self.batch:
+            return self.all(path), None
+
+        it = ahead = None
+        if offset:
+            saved = self.open.pop(path, None)
+            if saved is not None and saved[0] == offset:
+                _, it, ahead = saved
+            elif saved is not None:
+                _close(saved[1])
+        skip = 0
+        if it is None:
+            it = iter(self.scandir(path))
+            skip = offset
+        try:
+            if skip:
+                for _ in itertools.islice(it, skip):
+                    pass
+
+            # entries are made as they are read: a DirEntry may stat()
+            # relative to a directory fd that is gone by the next batch
+            entries = [ahead] if ahead is not None else []
+            entries.extend(self.entry(path, e) for e in
+                           itertools.islice(it, self.batch - len(entries)))
+            ahead = None
+            if len(entries) == self.batch:
+                e = next(it, None)
+                if e is not None:
+                    ahead = self.entry(path, e)
+        except BaseException:
+            # out of self.open already, nobody else closes it
+            _close(it)
+            raise
+        if ahead is None:
+            _close(it)
+            return entries, None
+        offset += len(entries)
+        self.open[path] = (offset, it, ahead)
+        return entries, offset
+
+    def close(self):
+        for _, it, _ in self.open.values():
+            _close(it)
+        self.open.clear()
@@ -0,0 +1,103 @@
+from __future__ import absolute_import
+
+import threading
+import sys
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+__author__ = 'Feiyi Wang'
+
+"""
+Per-rank I/O thread pool for Circle tasks.
+
+In executor mode Circle.loop() keeps up to "depth" work items in flight on
+"nthreads" worker threads, instead of calling task.process() on one item at
+a time. A task opts in by providing two methods:
+
+    io(work)              - runs on a worker thread, does the syscalls
+                            (lstat, read, write ...) and returns a result.
+                            Must not touch the Circle, its queue or any
+                            counter, the GIL is released in the syscalls
+                            and nowhere else we care about.
+    io_done(work, result) - runs on the main thread, updates counters,
+                            enq()s new work, as process() would.
+
+All MPI communication stays on the main thread.
+"""
+
+
+class IOExecutor(object):
+
+    def __init__(self, func, nthreads, depth=0):
+        self.func = func
+        self.nthreads = nthreads
+        self.depth = depth if depth > 0 else 2 * nthreads
+        self.inq = queue.Queue()
+        self.outq = queue.Queue()
+        self.pending = {}   # seq -> work, main thread only
+        self.seq = 0
+        self.threads = []
+        for i in range(nthreads):
+            t = threading.Thread(target=self.worker, name="io-%s" % i)
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def worker(self):
+        while True:
+            job = self.inq.get()
+            if job is None:
+                break
+            seq, work = job
+            try:
+                result = self.func(work)
+            except Exception:
+                # re-raised on the main thread, see completed()
+                self.outq.put((seq, None, sys.exc_info()[1]))
+            else:
+                self.outq.put((seq, result, None))
+
+    def inflight(self):
+        return len(self.pending)
+
+    def full(self):
+        return len(self.pending) >= self.depth
+
+    def items(self):
+        """ work items submitted but not completed yet """
+        return list(self.pending.values())
+
+    def submit(self, work):
+        self.seq += 1
+        self.pending[self.seq] = work
+        self.inq.put((self.seq, work))
+
+    def completed(self, timeout=None):
+        """ (work, result) of all finished items, waiting up to "timeout"
+        seconds for the first one if there is none yet """
+        done = []
+        try:
+            if timeout and self.pending:
+                done.append(self.outq.get(timeout=timeout))
+            while True:
+                done.append(self.outq.get_nowait())
+        except queue.Empty:
+            pass
+
+        results = []
+        for seq, result, exc in done:
+            work = self.pending.pop(seq)
+            if exc is not None:
+                raise exc
+            results.append((work, result))
+        return results
+
+    def shutdown(self):
+        for t in self.threads:
+            self.inq.put(None)
+        for t in self.threads:
+            t.join()
+        self.threads = []
@@ -9,6 +9,7 @@ from __future__ import print_function, division
 
 import time
 import stat
+import errno
 import os
 import shutil
 import os.path
@@ -19,7 +20,7 @@ import resource
 import sqlite3
 import math
 import cPickle as pickle
-from collections import Counter
+from collections import Counter, deque
 from threading import Thread
 from mpi4py import MPI
 
@@ -28,10 +29,9 @@ from utils import bytes_fmt, destpath
 from task import BaseTask
 from verify import PVerify
 from circle import Circle
-from cio import readn, writen
 from fwalk import FWalk
 from checkpoint import Checkpoint
-from fdef import FileChunk, ChunkSum
+from fdef import FileChunk, ChunkSum, ChunkRange
 from globals import G
 from globals import Tally as T
 from dbstore import DbStore
@@ -39,9 +39,15 @@ from dbsum import MemSum
 from fsum import export_checksum2
 from fdef import FileItem
 from _version import get_versions
-from mpihelper import ThrowingArgumentParser, parse_and_bcast
+from mpihelper import ThrowingArgumentParser, parse_and_bcast, add_circle_args, set_circle_args
+from mpihelper import add_walk_args, set_walk_args
 from bfsignature import BFsignature
 from pcircle.lru import LRU
+from pcircle.segstore import SegStore
+from pcircle import trace
+from pcircle import filetable
+from pcircle import windex
+from pcircle import copyengine
 
 __version__ = get_versions()['version']
 del get_versions
@@ -76,6 +82,11 @@ def gen_parser():
     parser.add_argument("--reduce-interval", metavar="s", type=int, default=10, help="interval, default 10s")
     parser.add_argument("--no-fixopt", action="store_true", help="skip fixing ownership, permssion, timestamp")
     parser.add_argument("--verify", action="store_true", help="verify after copy, default: off")
+    parser.add_argument("--copy-engine", choices=copyengine.ENGINES, default=G.copy_engine,
+                        help="how to move the data, readwrite with --verify, default: %s" % G.copy_engine)
+    parser.add_argument("--pipeline-depth", metavar="N", type=int, default=G.pipeline_depth,
+                        help="overlap reads, writes and hashing with N blocks in flight "
+                             "per rank, 2 or more, default: %s (off)" % G.pipeline_depth)
     parser.add_argument("-s", "--signature", action="store_true", help="aggregate checksum for signature, default: off")
     parser.add_argument("-p", "--preserve", action="store_true", help="Preserving meta, default: off")
     # using bloom filter for signature genearation, all chunksums info not available at root process anymore
@@ -86,9 +97,13 @@ def gen_parser():
     parser.add_argument("-r", "--rid", dest="rid", metavar="ID", help="resume ID, required in resume mode")
     parser.add_argument("--pause", metavar="s", type=int, help="pause a delay (seconds) after copy, test only")
     parser.add_argument("--item", type=int, default=100000, help="number of items stored in memory, default: 100000")
+    parser.add_argument("--from-index", metavar="DIR", help="take the source tree from the walk index in DIR (fwalk --index)")
     parser.add_argument("src", nargs='+', help="copy from")
     parser.add_argument("dest", help="copy to")
 
+    add_circle_args(parser)
+    add_walk_args(parser)
+
     return parser
 
 
@@ -99,6 +114,9 @@ def sig_handler(signal, frame):
 
 
 class FCP(BaseTask):
+    # progress report, see vreduce.py
+    reduce_fields = [("cnt_filesize", "sum"), ("mem_snapshot", "sum")]
+
     def __init__(self, circle, src, dest,
                  treewalk=None,
                  totalsize=0,
@@ -143,6 +161,9 @@ class FCP(BaseTask):
         # verify
         self.verify = verify
         self.use_store = False
+        # the --verify hash needs the bytes, see copyengine.py
+        self.engine = copyengine.make_engine("readwrite" if verify else G.copy_engine,
+                                             self.blocksize, G.pipeline_depth)
         if self.verify:
             self.chunksums_mem = []
             self.chunksums_buf = []
@@ -170,6 +191,7 @@ class FCP(BaseTask):
 
     def cleanup(self):
 
+        self.engine.close()
         self.rfd_cache.clear()
         self.wfd_cache.clear()
 
@@ -199,42 +221,26 @@ class FCP(BaseTask):
             os.remove(fwalk)
         """
 
-    def new_fchunk(self, fitem):
-        fchunk = FileChunk()  # default cmd = copy
-        fchunk.src = fitem.path
-        fchunk.dest = destpath(fitem, self.dest)
-        return fchunk
+    def new_fchunk(self, fid, offset, length):
+        return FileChunk(fid=fid, offset=offset, length=length)  # cmd = copy
 
     def enq_file(self, fi):
         """ Process a single file, represented by "fi" - FileItem
-        It involves chunking this file and equeue all chunks. """
+        It is one ChunkRange, Circle.deq() hands out its chunks one by one
+        and splits it when others ask for work. """
 
         chunks = fi.st_size // self.chunksize
         remaining = fi.st_size % self.chunksize
 
-        workcnt = 0
+        # paths go to the file table once, the chunks only carry its id
+        fid = filetable.table.add(fi.path, destpath(fi, self.dest), fi.st_size, fi.st_mode)
 
         if fi.st_size == 0:  # empty file
-            fchunk = self.new_fchunk(fi)
-            fchunk.offset = 0
-            fchunk.length = 0
-            self.enq(fchunk)
-            workcnt += 1
+            self.enq(self.new_fchunk(fid, 0, 0))
+            workcnt = 1
         else:
-            for i in range(chunks):
-                fchunk = self.new_fchunk(fi)
-                fchunk.offset = i * self.chunksize
-                fchunk.length = self.chunksize
-                self.enq(fchunk)
-            workcnt += chunks
-
-        if remaining > 0:
-            # send remainder
-            fchunk = self.new_fchunk(fi)
-            fchunk.offset = chunks * self.chunksize
-            fchunk.length = remaining
-            self.enq(fchunk)
-            workcnt += 1
+            self.enq(ChunkRange(fid, 0, fi.st_size, self.chunksize, ChunkRange.COPY))
+            workcnt = chunks + (1 if remaining > 0 else 0)
 
         # save work cnt
         self.workcnt += workcnt
@@ -243,7 +249,7 @@ class FCP(BaseTask):
                      extra=self.d)
 
     def handle_fitem(self, fi):
-        if os.path.islink(fi.path):
+        if stat.S_ISLNK(fi.st_mode):
             dest = destpath(fi, self.dest)
             linkto = os.readlink(fi.path)
             try:
@@ -354,7 +360,14 @@ class FCP(BaseTask):
                 return False
 
         # do the actual copy
-        self.write_bytes(rfd, wfd, work)
+        try:
+            self.write_bytes(rfd, wfd, work)
+        except (OSError, IOError) as e:
+            if getattr(e, "errno", None) == errno.ENOSPC:
+                log.error("Critical error: %s, exit!" % e, extra=self.d)
+                self.circle.exit(0)  # should abort
+            log.error("Failed to copy %s: %s" % (src, e), extra=self.d)
+            return False
 
         # update tally
         self.cnt_filesize += work.length
@@ -373,11 +386,18 @@ class FCP(BaseTask):
             print("Checkpoint: %s" % self.checkpoint_file)
 
     def do_checkpoint(self):
+        t0 = MPI.Wtime()
         tmp_file = self.checkpoint_file + ".part"
         with open(tmp_file, "wb") as f:
             self.circle.workq.extend(self.circle.workq_buf)
             self.circle.workq_buf.clear()
-            cobj = Checkpoint(self.src, self.dest, self.get_workq(), self.totalsize)
+            workq = self.get_workq()
+            inflight = self.circle.io_pending()
+            if inflight:
+                # not done yet, copy them again on resume
+                workq = deque(inflight) + workq
+            cobj = Checkpoint(self.src, self.dest, workq, self.totalsize,
+                              filetable.table.snapshot())
             pickle.dump(cobj, f, pickle.HIGHEST_PROTOCOL)
         # POSIX requires rename to be atomic
         os.rename(tmp_file, self.checkpoint_file)
@@ -385,19 +405,25 @@ class FCP(BaseTask):
         # copy workq_db database file
         if hasattr(self.circle, "workq_db") and len(self.circle.workq_db) > 0:
             self.checkpoint_db = self.checkpoint_file + ".db"
-            if not G.resume:
+            if isinstance(self.circle.workq_db, SegStore):
+                # segments don't survive a restart, resume reads a DbStore
+                cpdb = DbStore(self.checkpoint_db)
+                self.circle.workq_db.export(cpdb)
+                cpdb.conn.close()
+            elif not G.resume:
+                self.circle.workq_db.sync()
                 shutil.copy2(self.circle.dbname, self.checkpoint_db)
             else:
                 # in resume mode, make a copy of current workq db file, which is provided checkpoint db file
+                self.circle.workq_db.sync()
                 self.workdir = os.getcwd()
                 existingCheckpoint = os.path.join(self.workdir,".pcp_workq.%s.%s.db" % (G.rid, self.circle.rank))
                 shutil.copy2(existingCheckpoint,self.checkpoint_db)
 
-    def process(self):
-        """
-        The only work is "copy"
-        TODO: clean up other actions such as mkdir/fini_check
-        """
+        if self.circle.tracer:
+            self.circle.tracer.span(trace.CHECKPOINT, t0, MPI.Wtime())
+
+    def check_checkpoint(self):
         if not G.use_store:
             curtime = MPI.Wtime()
             if curtime - self.checkpoint_last > self.checkpoint_interval:
@@ -405,6 +431,13 @@ class FCP(BaseTask):
                 log.info("Checkpointing done ...", extra=self.d)
                 self.checkpoint_last = curtime
 
+    def process(self):
+        """
+        The only work is "copy"
+        TODO: clean up other actions such as mkdir/fini_check
+        """
+        self.check_checkpoint()
+
         work = self.deq()
         self.reduce_items += 1
         if isinstance(work, FileChunk):
@@ -413,6 +446,59 @@ class FCP(BaseTask):
             log.warn("Unknown work object: %s" % work, extra=self.d)
             err_and_exit("Not a correct workq format")
 
+    def io(self, work):
+        """ copy one chunk on an I/O thread, with its own file descriptors:
+        the fd caches and the lseek() offsets are not shared with anyone.
+        Returns the digest (None without --verify), or the OSError/IOError.
+        """
+        if not isinstance(work, FileChunk):
+            return work
+
+        basedir = os.path.dirname(work.dest)
+        try:
+            if not os.path.exists(basedir):
+                os.makedirs(basedir)
+        except OSError as e:
+            # another thread may have just created it
+            if e.errno != errno.EEXIST:
+                return e
+
+        rfd = wfd = -1
+        try:
+            rfd = os.open(work.src, os.O_RDONLY)
+            try:
+                wfd = os.open(work.dest, os.O_WRONLY | os.O_CREAT)
+            except OSError:
+                if not args.force:
+                    raise
+                os.unlink(work.dest)
+                wfd = os.open(work.dest, os.O_WRONLY | os.O_CREAT)
+            return self.copy_bytes(rfd, wfd, work)
+        except (OSError, IOError) as e:
+            return e
+        finally:
+            for fd in (rfd, wfd):
+                if fd >= 0:
+                    os.close(fd)
+
+    def io_done(self, work, result):
+        self.reduce_items += 1
+        if not isinstance(work, FileChunk):
+            log.warn("Unknown work object: %s" % work, extra=self.d)
+            err_and_exit("Not a correct workq format")
+
+        if isinstance(result, (OSError, IOError)):
+            if getattr(result, "errno", None) == errno.ENOSPC:
+                log.error("Critical error: %s, exit!" % result, extra=self.d)
+                self.circle.exit(0)  # should abort
+            log.error("Failed to copy %s: %s" % (work.src, result), extra=self.d)
+        else:
+            if self.verify:
+                self.add_chunksum(work, result)
+            self.cnt_filesize += work.length
+
+        self.check_checkpoint()
+
     def reduce_init(self, buf):
         buf['cnt_filesize'] = self.cnt_filesize
         if sys.platform == 'darwin':
@@ -448,6 +534,9 @@ class FCP(BaseTask):
         global taskloads
         self.wtime_ended = MPI.Wtime()
         taskloads = self.circle.comm.gather(self.reduce_items)
+        engines = self.circle.comm.gather(self.engine.describe())
+        steals = self.circle.steal_summary()
+        states = self.circle.state_summary()
         if self.circle.rank == 0:
             if self.totalsize == 0:
                 print("\nZero filesize detected, done.\n")
@@ -458,69 +547,46 @@ class FCP(BaseTask):
             print("\t{:<20}{:<20}".format("Ending at:", utils.current_time()))
             print("\t{:<20}{:<20}".format("Completed in:", utils.conv_time(tlapse)))
             print("\t{:<20}{:<20}".format("Transfer Rate:", "%s/s" % bytes_fmt(rate)))
+            print("\t{:<20}{:<20}".format("Copy engine:", ", ".join(sorted(set(engines)))))
             print("\t{:<20}{:<20}".format("Use store chunksums:", "%s" % self.use_store))
             print("\t{:<20}{:<20}".format("Use store workq:", "%s" % self.circle.use_store))
             print("\t{:<20}{:<20}".format("FCP Loads:", "%s" % taskloads))
-
-    def read_then_write(self, rfd, wfd, work, num_of_bytes, m):
-        """ core entry point for copy action: first read then write.
-
-        @param num_of_bytes: the exact amount of bytes we will copy
-        @return: False if unsuccessful.
-
-        """
-        buf = None
-        try:
-            buf = readn(rfd, num_of_bytes)
-        except IOError:
-            self.logger.error("Failed to read %s", work.src, extra=self.d)
-            return False
-
-        try:
-            writen(wfd, buf)
-        except IOError:
-            self.logger.error("Failed to write %s", work.dest, extra=self.d)
-            return False
-
-        if m:
-            m.update(buf)
-
-        return True
+            print("\t{:<20}{:<20}".format("FCP Steals:", "%s" % steals))
+            print("\t{:<20}{:<20}".format("FCP work/comm/idle:", "%s" % states))
 
     def write_bytes(self, rfd, wfd, work):
-        os.lseek(rfd, work.offset, os.SEEK_SET)
-        os.lseek(wfd, work.offset, os.SEEK_SET)
+        digest = self.copy_bytes(rfd, wfd, work)
+        if self.verify:
+            self.add_chunksum(work, digest)
 
+    def copy_bytes(self, rfd, wfd, work):
+        """ copy the chunk, return its sha1 digest with --verify """
         m = None
         if self.verify:
             m = hashlib.sha1()
 
-        remaining = work.length
-        while remaining != 0:
-            if remaining >= self.blocksize:
-                self.read_then_write(rfd, wfd, work, self.blocksize, m)
-                remaining -= self.blocksize
-            else:
-                self.read_then_write(rfd, wfd, work, remaining, m)
-                remaining = 0
+        self.engine.copy(rfd, wfd, work.offset, work.length, m)
 
-        if self.verify:
-            # use src path here
-            ck = ChunkSum(work.dest, offset=work.offset, length=work.length,
-                          digest=m.hexdigest())
+        if m:
+            return m.hexdigest()
 
-            if len(self.chunksums_mem) < G.memitem_threshold:
-                self.chunksums_mem.append(ck)
-            else:
-                self.chunksums_buf.append(ck)
-                if len(self.chunksums_buf) == G.DB_BUFSIZE:
-                    if self.use_store == False:
-                        self.workdir = os.getcwd()
-                        self.chunksums_dbname = "%s/chunksums.%s" % (G.tempdir, self.circle.rank)
-                        self.chunksums_db = DbStore(dbname=self.chunksums_dbname)
-                        self.use_store = True
-                    self.chunksums_db.mput(self.chunksums_buf)
-                    del self.chunksums_buf[:]
+    def add_chunksum(self, work, digest):
+        # the sum is of the destination, the file entry has its path
+        ck = ChunkSum(fid=work.fid, offset=work.offset, length=work.length,
+                      digest=digest, side=ChunkSum.DEST)
+
+        if len(self.chunksums_mem) < G.memitem_threshold:
+            self.chunksums_mem.append(ck)
+        else:
+            self.chunksums_buf.append(ck)
+            if len(self.chunksums_buf) == G.DB_BUFSIZE:
+                if self.use_store == False:
+                    self.workdir = os.getcwd()
+                    self.chunksums_dbname = "%s/chunksums.%s" % (G.tempdir, self.circle.rank)
+                    self.chunksums_db = DbStore(dbname=self.chunksums_dbname)
+                    self.use_store = True
+                self.chunksums_db.mput(self.chunksums_buf)
+                del self.chunksums_buf[:]
 
 
 def check_dbstore_resume_condition(rid):
@@ -657,6 +723,8 @@ def prep_recovery():
         with open(chk_file, "rb") as f:
             try:
                 cobj = pickle.load(f)
+                if getattr(cobj, "files", None):
+                    filetable.table.restore(cobj.files)
                 sz = get_workq_size(cobj.workq)
                 src = cobj.src
                 dest = cobj.dest
@@ -708,13 +776,20 @@ def fcp_start():
 
     if not args.rid: # if not in recovery
         treewalk = FWalk(circle, G.src, G.dest, force=args.force)
-        circle.begin(treewalk)
+        if args.from_index:
+            try:
+                manifest = windex.read_manifest(args.from_index, [fi.path for fi in G.src])
+            except ValueError as e:
+                err_and_exit("Error: %s" % e)
+            treewalk.load_index(manifest)
+        else:
+            circle.begin(treewalk)
         circle.finalize()
         treewalk.epilogue()
     else:  # okay, let's do checkpoint recovery
         workq = prep_recovery()
 
-    circle = Circle(dbname="fcp")
+    circle = Circle(name="fcp", dbname="fcp")
     fcp = FCP(circle, G.src, G.dest,
               treewalk=treewalk,
               totalsize=T.total_filesize,
@@ -915,6 +990,8 @@ def main():
     # This might be an overkill function
     signal.signal(signal.SIGINT, sig_handler)
     args = parse_and_bcast(comm, gen_parser)
+    set_circle_args(args)
+    set_walk_args(args)
     tally_hosts()
     G.loglevel = args.loglevel
     G.fix_opt = False if args.no_fixopt else True
@@ -924,6 +1001,8 @@ def main():
     G.verbosity = args.verbosity
     G.am_root = True if os.geteuid() == 0 else False
     G.memitem_threshold = args.item
+    G.copy_engine = args.copy_engine
+    G.pipeline_depth = args.pipeline_depth
 
     if args.signature:  # with signature implies doing verify as well
         args.verify = True
@@ -948,7 +1027,7 @@ def main():
     G.src, G.dest = check_source_and_target(args.src, args.dest)
     dbname = get_workq_name()
 
-    circle = Circle(dbname="fwalk")
+    circle = Circle(name="fwalk", dbname="fwalk")
     #circle.dbname = dbname
 
     global oflimit
@@ -971,6 +1050,7 @@ def main():
             "Num of Processes:", comm.size))
         print("\t{:<25}{:<10}{:5}{:<25}{:<10}".format("Overwrite:", "%r" % args.force, "|",
             "Copy Verification:", "%r" % args.verify))
+        print("\t{:<25}{:<20}".format("Copy engine:", "readwrite" if args.verify else G.copy_engine))
         print("\t{:<25}{:<10}{:5}{:<25}{:<10}".format("Dataset signature:", "%r" % args.signature, "|",
             "Stripe Preserve:", "%r" % G.preserve))
         print("\t{:<25}{:<10}{:5}{:<25}{:<10}".format("Checkpoint interval:", "%s" % utils.conv_time(args.cptime), "|",
@@ -994,7 +1074,7 @@ def main():
 
     # do checksum verification
     if args.verify:
-        circle = Circle(dbname="verify")
+        circle = Circle(name="verify", dbname="verify")
         pcheck = PVerify(circle, fcp, G.total_chunks, T.total_filesize, args.signature)
         circle.begin(pcheck)
         circle.finalize()
@@ -1,7 +1,11 @@
 __author__ = 'f7b'
 
+import binascii
 import collections
 
+from pcircle.filetable import table
+
+
 class CommonEqualityMixin(object):
     def __eq__(self, other):
         return (isinstance(other, self.__class__)
@@ -43,15 +47,59 @@ class FileItem(CommonEqualityMixin):
         return self.path
 
 
-class FileChunk(CommonEqualityMixin):
+class DirScan(object):
+    """ the rest of the directory "path", from its "offset"-th entry on,
+    see dirscan.py. "dirname" is that of the directory's FileItem """
+    __slots__ = ('path', 'offset', 'dirname')
+
+    def __init__(self, path, offset, dirname=None):
+        self.path = path
+        self.offset = offset
+        self.dirname = dirname
+
+    def __repr__(self):
+        return "DirScan:%s,%s" % (self.path, self.offset)
+
+
+class FileChunk(object):
+    """ a chunk of the file "fid" in the file table, see filetable.py """
+    __slots__ = ('fid', 'offset', 'length')
+
+    cmd = "copy"
+
     def __init__(self, cmd="copy",
-                 src="", dest="", offset=0, length=0):
-        self.cmd = cmd
-        self.src = src
-        self.dest = dest
+                 src="", dest="", offset=0, length=0, fid=None):
+        if fid is None:
+            fid = table.add(src, dest)
+        self.fid = fid
         self.offset = offset
         self.length = length
 
+    @property
+    def src(self):
+        return table.get(self.fid).src
+
+    @property
+    def dest(self):
+        return table.get(self.fid).dest
+
+    def __getstate__(self):
+        return (self.fid, self.offset, self.length)
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):
+            # pickled before the file table
+            state = (table.add(state["src"], state["dest"]),
+                     state["offset"], state["length"])
+        self.fid, self.offset, self.length = state
+
+    def __eq__(self, other):
+        return (isinstance(other, FileChunk) and
+                (self.fid, self.offset, self.length) == (other.fid, other.offset, other.length))
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
     def key(self):
         return "%s::%s" % (self.src, self.offset)
 
@@ -62,15 +110,120 @@ class FileChunk(CommonEqualityMixin):
         return ",".join([self.src, str(self.offset), str(self.length)])
 
 
-class ChunkSum:
+class ChunkRange(object):
+    """ chunks [start, end) of the file "fid", "chunksize" bytes each.
+
+    Circle.deq() hands them out one at a time with take(), and a victim
+    split()s ranges when thieves ask, so a file is one work item until
+    it needs to be shared. "kind" tells the chunks to make: COPY for
+    FileChunk, SUM for ChunkSum.
+    """
+    __slots__ = ('fid', 'start', 'end', 'chunksize', 'kind')
+
+    COPY = 0
+    SUM = 1
+
+    def __init__(self, fid, start, end, chunksize, kind=0):
+        self.fid = fid
+        self.start = start
+        self.end = end
+        self.chunksize = chunksize
+        self.kind = kind
+
+    @property
+    def length(self):
+        return self.end - self.start
+
+    def chunks(self):
+        return -(-(self.end - self.start) // self.chunksize)
+
+    def take(self):
+        """ the next chunk, the range shrinks from the start """
+        length = min(self.chunksize, self.end - self.start)
+        if self.kind == self.COPY:
+            item = FileChunk(fid=self.fid, offset=self.start, length=length)
+        else:
+            item = ChunkSum(fid=self.fid, offset=self.start, length=length)
+        self.start += length
+        return item
+
+    def split(self):
+        """ cut off and return the upper half, None for a single chunk """
+        n = self.chunks()
+        if n < 2:
+            return None
+        mid = self.start + (n // 2) * self.chunksize
+        upper = ChunkRange(self.fid, mid, self.end, self.chunksize, self.kind)
+        self.end = mid
+        return upper
+
+    def __getstate__(self):
+        return (self.fid, self.start, self.end, self.chunksize, self.kind)
+
+    def __setstate__(self, state):
+        self.fid, self.start, self.end, self.chunksize, self.kind = state
+
+    def __eq__(self, other):
+        return isinstance(other, ChunkRange) and self.__getstate__() == other.__getstate__()
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return "ChunkRange: %s,%s,%s" % (table.get(self.fid).src, self.start, self.end)
+
+
+class ChunkSum(object):
     """ make __cmp__ part of the mixin so it can be reused
+
+    The digest is kept binary, "digest" reads and writes it in hex.
+    "side" tells which path of the file entry the chunk is of, fcp sums
+    the DEST of the entry it copied from instead of adding one for it.
     """
+    __slots__ = ('fid', 'offset', 'length', 'bdigest', 'side')
+
+    SRC = 0
+    DEST = 1
 
-    def __init__(self, filename, offset=0, length=0, digest=""):
-        self.filename = filename
+    def __init__(self, filename=None, offset=0, length=0, digest="", fid=None, side=0):
+        if fid is None:
+            fid = table.add(filename)
+        self.fid = fid
         self.offset = offset
         self.length = length
         self.digest = digest
+        self.side = side
+
+    @property
+    def filename(self):
+        entry = table.get(self.fid)
+        return entry.dest if self.side == ChunkSum.DEST else entry.src
+
+    @filename.setter
+    def filename(self, path):
+        self.fid = table.add(path)
+        self.side = ChunkSum.SRC
+
+    @property
+    def digest(self):
+        h = binascii.hexlify(self.bdigest)
+        return h if str is bytes else h.decode("ascii")
+
+    @digest.setter
+    def digest(self, hexdigest):
+        self.bdigest = binascii.unhexlify(hexdigest) if hexdigest else b""
+
+    def __getstate__(self):
+        return (self.fid, self.offset, self.length, self.bdigest, self.side)
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):
+            self.fid = table.add(state["filename"])
+            self.offset, self.length = state["offset"], state["length"]
+            self.digest = state["digest"]
+            self.side = ChunkSum.SRC
+            return
+        self.fid, self.offset, self.length, self.bdigest, self.side = state
 
     def __cmp__(self, other):
         assert isinstance(other, ChunkSum)
@@ -0,0 +1,179 @@
+from __future__ import absolute_import
+
+import os
+import numpy as np
+
+from pcircle.fdef import FileItem
+
+__author__ = 'Feiyi Wang'
+
+"""
+Columnar file list for the tree walk results (FWalk.flist).
+
+A list of FileItem costs a Python object, a path string and four ints per
+file. FileList keeps the same information in columns instead:
+
+    st_mode, st_uid, st_gid  uint32 arrays
+    st_size                  int64 array
+    dir                      uint32 index into the directory table
+    name_off                 int64 offsets of the file names in one arena
+    root                     int32 index of FileItem.dirname, -1 for None
+
+A path is split into its directory, stored once in the directory table no
+matter how many files it holds, and its name, appended to a single
+bytearray. FileItem.dirname (the copy root of file2dir copies) shares the
+directory table.
+
+    flist.append(fitem)      - add a FileItem (or append_stat() the fields)
+    for fi in flist          - FileItems, made on the fly
+    flist[i], flist[i:j]     - a FileItem, a FileList
+    flist.largest(n)         - FileItems of the n largest files
+    flist.st_size            - column views, e.g. for histograms
+    flist.nbytes()           - memory held by the columns and tables
+"""
+
+_PY2 = str is bytes
+
+
+def _to_bytes(s):
+    if _PY2 or isinstance(s, bytes):
+        return s
+    return s.encode("utf-8", "surrogateescape")
+
+
+def _from_bytes(b):
+    if _PY2:
+        return b
+    return b.decode("utf-8", "surrogateescape")
+
+
+class FileList(object):
+
+    COLUMNS = (("st_mode", np.uint32), ("st_size", np.int64), ("st_uid", np.uint32),
+               ("st_gid", np.uint32), ("dir", np.uint32), ("root", np.int32))
+
+    def __init__(self, capacity=1024):
+        self.n = 0
+        self.capacity = 0
+        self.cols = {}
+        self.name_off = np.zeros(1, dtype=np.int64)
+        self.arena = bytearray()
+        self.dirs = []          # directory table
+        self.dir_index = {}     # directory -> index in self.dirs
+        self._grow(max(1, capacity))
+
+    def _grow(self, capacity):
+        for name, dtype in self.COLUMNS:
+            col = np.zeros(capacity, dtype=dtype)
+            if name in self.cols:
+                col[:self.n] = self.cols[name][:self.n]
+            self.cols[name] = col
+        off = np.zeros(capacity + 1, dtype=np.int64)
+        off[:self.n + 1] = self.name_off[:self.n + 1]
+        self.name_off = off
+        self.capacity = capacity
+
+    def _dir(self, d):
+        idx = self.dir_index.get(d)
+        if idx is None:
+            idx = len(self.dirs)
+            self.dirs.append(d)
+            self.dir_index[d] = idx
+        return idx
+
+    def append_stat(self, path, st_mode=0, st_size=0, st_uid=0, st_gid=0, dirname=None):
+        if self.n == self.capacity:
+            self._grow(2 * self.capacity)
+        i = self.n
+        head, name = os.path.split(path)
+        cols = self.cols
+        cols["st_mode"][i] = st_mode
+        cols["st_size"][i] = st_size
+        cols["st_uid"][i] = st_uid
+        cols["st_gid"][i] = st_gid
+        cols["dir"][i] = self._dir(head)
+        cols["root"][i] = -1 if dirname is None else self._dir(dirname)
+        self.arena += _to_bytes(name)
+        self.name_off[i + 1] = len(self.arena)
+        self.n += 1
+
+    def append(self, fitem):
+        self.append_stat(fitem.path, fitem.st_mode, fitem.st_size,
+                         fitem.st_uid, fitem.st_gid, fitem.dirname)
+
+    def extend(self, fitems):
+        for fitem in fitems:
+            self.append(fitem)
+
+    def __len__(self):
+        return self.n
+
+    def path(self, i):
+        name = _from_bytes(bytes(self.arena[self.name_off[i]:self.name_off[i + 1]]))
+        return os.path.join(self.dirs[self.cols["dir"][i]], name)
+
+    def item(self, i):
+        cols = self.cols
+        fi = FileItem(self.path(i), int(cols["st_mode"][i]), int(cols["st_size"][i]),
+                      int(cols["st_uid"][i]), int(cols["st_gid"][i]))
+        root = cols["root"][i]
+        if root >= 0:
+            fi.dirname = self.dirs[root]
+        return fi
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            out = FileList(capacity=max(1, len(range(*idx.indices(self.n)))))
+            for i in range(*idx.indices(self.n)):
+                out.append(self.item(i))
+            return out
+        if idx < 0:
+            idx += self.n
+        if not 0 <= idx < self.n:
+            raise IndexError("FileList index out of range")
+        return self.item(idx)
+
+    def __iter__(self, block=4096):
+        # columns to Python lists a block at a time, indexing numpy arrays
+        # one element at a time is much slower
+        dirs = self.dirs
+        for start in range(0, self.n, block):
+            end = min(start + block, self.n)
+            cols = [self.cols[name][start:end].tolist() for name, _ in self.COLUMNS]
+            offs = self.name_off[start:end + 1].tolist()
+            arena = bytes(self.arena[offs[0]:offs[-1]])
+            base = offs[0]
+            for j, (mode, size, uid, gid, d, root) in enumerate(zip(*cols)):
+                name = _from_bytes(arena[offs[j] - base:offs[j + 1] - base])
+                fi = FileItem(os.path.join(dirs[d], name), mode, size, uid, gid)
+                if root >= 0:
+                    fi.dirname = dirs[root]
+                yield fi
+
+    def largest(self, n, name="st_size"):
+        """ FileItems of the "n" largest values of a column, largest first """
+        col = self.column(name)
+        idx = np.argsort(col, kind="mergesort")[::-1][:n]
+        return [self.item(i) for i in idx.tolist()]
+
+    def column(self, name):
+        """ a view of the first len(self) entries of a column """
+        return self.cols[name][:self.n]
+
+    @property
+    def st_size(self):
+        return self.column("st_size")
+
+    @property
+    def st_mode(self):
+        return self.column("st_mode")
+
+    def nbytes(self):
+        """ bytes used, counting the allocated capacity """
+        total = sum(col.nbytes for col in self.cols.values())
+        total += self.name_off.nbytes + len(self.arena)
+        total += sum(len(_to_bytes(d)) for d in self.dirs)
+        return total
+
+    def __repr__(self):
+        return "FileList: %s files, %s directories" % (self.n, len(self.dirs))
@@ -0,0 +1,123 @@
+from __future__ import absolute_import
+
+from mpi4py import MPI
+
+__author__ = 'Feiyi Wang'
+
+"""
+Per-job file table, shared by the chunks of a file.
+
+A FileChunk or ChunkSum used to carry its own src/dest path strings, for
+every chunk of a file. Now they only hold a file id, and the paths, size
+and mode of the file live here, once:
+
+    fid = table.add(src, dest, size, mode)
+    table.get(fid).src
+
+File ids are (rank << 40 | n), unique across ranks without talking to
+each other. When chunks move to a thief, wire.py ships the entries the
+thief hasn't seen yet, and remembers it sent them; the rank a file id came
+from always has the entry and never gets it back.
+
+Entries are never dropped during a job, checkpoints save the whole table
+(snapshot/restore) as spilled and checkpointed chunks may refer to any of
+them.
+"""
+
+FID_SHIFT = 40
+
+
+class FileEntry(object):
+    __slots__ = ("src", "dest", "size", "mode")
+
+    def __init__(self, src, dest=None, size=0, mode=0):
+        self.src = src
+        self.dest = dest
+        self.size = size
+        self.mode = mode
+
+    def __repr__(self):
+        return "FileEntry:" + ",".join([str(self.src), str(self.dest), str(self.size)])
+
+
+class FileTable(object):
+
+    def __init__(self):
+        self.entries = {}   # fid -> FileEntry
+        self.index = {}     # src -> fid
+        self.known = {}     # peer rank -> fids it has from us
+        self.rank = None
+        self.next = 0
+
+    def add(self, src, dest=None, size=0, mode=0):
+        """ file id of "src", a new entry if we haven't seen it """
+        fid = self.index.get(src)
+        if fid is not None:
+            entry = self.entries[fid]
+            if dest is not None and entry.dest is None:
+                entry.dest = dest
+            return fid
+        if self.rank is None:
+            self.rank = MPI.COMM_WORLD.Get_rank()
+        fid = (self.rank << FID_SHIFT) | self.next
+        self.next += 1
+        self.entries[fid] = FileEntry(src, dest, size, mode)
+        self.index[src] = fid
+        return fid
+
+    def get(self, fid):
+        return self.entries[fid]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def unseen(self, fids, peer=None):
+        """ (fid, entry) of the distinct "fids" that "peer" doesn't have,
+        all of them for peer None """
+        known = self.known.get(peer, ())
+        out = []
+        seen = set()
+        for fid in fids:
+            if fid in seen or fid in known or (fid >> FID_SHIFT) == peer:
+                continue
+            seen.add(fid)
+            out.append((fid, self.entries[fid]))
+        return out
+
+    def mark(self, fids, peer):
+        """ "peer" now has the entries of "fids" """
+        known = self.known.setdefault(peer, set())
+        known.update(fids)
+
+    def merge(self, records, peer=None):
+        """ entries received from "peer", (fid, src, dest, size, mode) each """
+        records = list(records)
+        for fid, src, dest, size, mode in records:
+            if fid not in self.entries:
+                self.entries[fid] = FileEntry(src, dest, size, mode)
+                self.index.setdefault(src, fid)
+        if peer is not None:
+            self.mark([r[0] for r in records], peer)
+
+    def snapshot(self):
+        return [(fid, e.src, e.dest, e.size, e.mode) for fid, e in self.entries.items()]
+
+    def restore(self, records):
+        """ load a snapshot, new ids continue after our own """
+        self.merge(records)
+        if self.rank is None:
+            self.rank = MPI.COMM_WORLD.Get_rank()
+        mine = [fid & ((1 << FID_SHIFT) - 1) for fid, _, _, _, _ in records
+                if (fid >> FID_SHIFT) == self.rank]
+        if mine:
+            self.next = max(self.next, max(mine) + 1)
+
+    def clear(self):
+        self.entries.clear()
+        self.index.clear()
+        self.known.clear()
+        self.next = 0
+
+
+# the table of this process
+table = FileTable()
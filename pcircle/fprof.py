@@ -34,12 +34,19 @@ import heapq
 from pcircle import utils
 from pcircle import fpipe
 from pcircle import lfs
+from pcircle import windex
+from pcircle import dirfd
 
 from pcircle.timeout import timeout, TimeoutError
+from pcircle.dirscan import Scanner
+from pcircle.fdef import DirScan
 from pcircle.circle import Circle
+from pcircle.task import BaseTask
 from pcircle.globals import G, Tally
 from pcircle.utils import getLogger, bytes_fmt, destpath, py_version
 from pcircle.mpihelper import ThrowingArgumentParser, tally_hosts, parse_and_bcast
+from pcircle.mpihelper import add_circle_args, set_circle_args
+from pcircle.mpihelper import add_walk_args, set_walk_args
 
 from pcircle._version import get_versions
 __version__ = get_versions()['version']
@@ -141,6 +148,11 @@ def gen_parser():
     # parser.add_argument("--histogram", action="store_true", help="Generate block histogram")
     parser.add_argument("--progress", action="store_true",
                         help="Enable periodoic progress report")
+    parser.add_argument("--from-index", metavar="DIR", default=None,
+                        help="Profile the walk index in DIR (fwalk --index) instead of walking")
+
+    add_circle_args(parser)
+    add_walk_args(parser)
 
     return parser
 
@@ -243,9 +255,16 @@ def gather_gpfs_blocks():
     return gpfs_blocks
 
 
-class ProfileWalk:
+class ProfileWalk(BaseTask):
+    # progress report, see vreduce.py
+    reduce_fields = [("cnt_files", "sum"), ("cnt_dirs", "sum"),
+                     ("cnt_filesize", "sum"), ("reduce_items", "sum"),
+                     ("work_qsize", "sum"), ("mem_snapshot", "sum")]
+    # an lstat a work item, see BaseTask.process_batch()
+    batchable = True
 
     def __init__(self, circle, src, perfile=True):
+        BaseTask.__init__(self, circle)
 
         self.logger = utils.getLogger(__name__)
 
@@ -292,56 +311,69 @@ class ProfileWalk:
         self.time_started = MPI.Wtime()
         self.time_ended = None
 
+        if G.dirfd:
+            self.lstat, self.scandir = dirfd.lstat, dirfd.scandir
+        else:
+            self.lstat, self.scandir = os.lstat, scandir
+        self.scanner = Scanner(self.scandir, self.dir_entry, G.dir_batch)
+        self.split_dirs = 0     # read in more than one batch
+
     def create(self):
         if self.circle.rank == 0:
             for ele in self.src:
                 self.circle.enq(ele)
             print("\nStart profiling ...")
 
-    def process_dir(self, path, st):
+    def process_dir(self, path, st, entries, rest=None):
         """ i_dir should be absolute path
         st is the stat object associated with the directory
+        entries is [(path, kind)] from read_dir(), or the error reading it,
+        rest the DirScan for what is left of the directory
         """
-        last_report = MPI.Wtime()
-        count = 0
-
-        try:
-            with timeout(seconds=10):
-                entries = scandir(path)
-        except OSError as e:
-            self.logger.warn(e, extra=self.d)
-            self.skipped += 1
-        except TimeoutError as e:
-            self.logger.error("%s when scandir() on %s" %
-                              (e, path), extra=self.d)
+        if isinstance(entries, OSError):
+            self.logger.warn(entries, extra=self.d)
             self.skipped += 1
+            self.dir_done(path, 0)
         else:
-            for entry in entries:
-                try:
-                    if entry.is_symlink():
-                        self.sym_links += 1
-                    elif entry.stat().st_mode & 0o170000 == S_IFIFO:
-                        self.pipes += 1
-                    elif entry.stat().st_mode & 0o170000 == S_IFSOCK:
-                        self.sockets += 1
-                    elif entry.is_file():
-                        self.circle.enq(entry.path)
-                    elif entry.is_dir():
-                        self.circle.preq(entry.path)
-                    else:
-                        self.logger.warn("Unknown scan entry: %s" %
-                                        entry.path, extra=self.d)
-                except OSError as e:
-                    self.logger.warn(e, extra=self.d)
+            if rest:
+                self.split_dirs += 1
+            self.enq_entries(path, 0, entries, rest)
 
-                count += 1
-                if (MPI.Wtime() - last_report) > self.interval:
-                    print("Rank %s : Scanning [%s] at %s" % (
-                        self.circle.rank, path, count))
-                    last_report = MPI.Wtime()
+    def enq_entries(self, path, count, entries, rest):
+        """ queue the entries of directory "path", "count" of them were
+        queued already, then "rest" on top of them to read on """
+        last_report = MPI.Wtime()
+        for epath, kind in entries:
+            if kind == "link":
+                self.sym_links += 1
+            elif kind == "fifo":
+                self.pipes += 1
+            elif kind == "sock":
+                self.sockets += 1
+            elif kind == "file":
+                self.circle.enq(epath)
+            elif kind == "dir":
+                self.circle.preq(epath)
+            elif isinstance(kind, OSError):
+                self.logger.warn(kind, extra=self.d)
+            else:
+                self.logger.warn("Unknown scan entry: %s" %
+                                epath, extra=self.d)
+
+            count += 1
+            if (MPI.Wtime() - last_report) > self.interval:
+                print("Rank %s : Scanning [%s] at %s" % (
+                    self.circle.rank, path, count))
+                last_report = MPI.Wtime()
+        if rest:
+            self.circle.enq(rest)
+        else:
             self.logger.debug("Finish scan of [%s], count=%s" % (
                 path, count), extra=self.d)
+            self.dir_done(path, count)
 
+    def dir_done(self, path, count):
+        """ account for a directory of "count" entries """
         if count > self.maxfiles:
             self.maxfiles = count
             self.maxfiles_dir = path
@@ -352,6 +384,60 @@ class ProfileWalk:
         if args.topn_dirs:
             update_topn_dirs(TopDir(count, path))
 
+    def load_index(self, manifest):
+        """ collective, take the tree from a walk index (windex.py) instead
+        of walking it: this rank's share of the entries goes through
+        io_done() as if it had just lstat() them.
+
+        The index has no directory listings, the entry count of a directory
+        is added up from its entries by the rank windex.owner() picks.
+        """
+        comm = self.circle.comm
+        self.time_started = MPI.Wtime()
+        dircounts = [{} for _ in range(comm.size)]   # per owner, path -> [is dir, count]
+
+        def count(path, isdir, n):
+            entry = dircounts[windex.owner(path, comm.size)].setdefault(path, [False, 0])
+            entry[0] = entry[0] or isdir
+            entry[1] += n
+
+        for path, st in windex.load(manifest, comm.rank, comm.size):
+            if EXCLUDE and self.under_excluded(path):
+                continue
+            if path not in self.src:
+                count(os.path.dirname(path), False, 1)
+
+            if stat.S_ISDIR(st.st_mode) and path not in EXCLUDE:
+                self.reduce_items += 1
+                self.cnt_dirs += 1
+                count(path, True, 0)
+            elif stat.S_ISFIFO(st.st_mode):
+                self.pipes += 1
+            elif stat.S_ISSOCK(st.st_mode):
+                self.sockets += 1
+            else:
+                self.io_done(path, (st, None, None))
+
+        merged = {}
+        for counts in comm.alltoall(dircounts):
+            for path, (isdir, n) in counts.items():
+                entry = merged.setdefault(path, [False, 0])
+                entry[0] = entry[0] or isdir
+                entry[1] += n
+        for path, (isdir, n) in merged.items():
+            if isdir:
+                self.dir_done(path, n)
+
+    @staticmethod
+    def under_excluded(path):
+        """ True if "path" is in an excluded directory """
+        parent = os.path.dirname(path)
+        while parent and parent != path:
+            if parent in EXCLUDE:
+                return True
+            path, parent = parent, os.path.dirname(parent)
+        return False
+
     def process(self):
         """ process a work unit, spath, dpath refers to
             source and destination respectively """
@@ -359,46 +445,126 @@ class ProfileWalk:
         spath = self.circle.deq()
         self.logger.debug("BEGIN process object: %s" % spath, extra=self.d)
 
-        if spath:
-            if spath in EXCLUDE:
-                self.logger.warn("Skip excluded path: %s" %
-                                 spath, extra=self.d)
-                self.skipped += 1
-                return
+        try:
+            result = self.io(spath, self.timed_lstat)
+        except TimeoutError as e:
+            self.logger.error("%s when stat() on %s" %
+                              (e, spath), extra=self.d)
+            self.skipped += 1
+            return None
+        except Exception as e:
+            self.logger.error("Unknown: %s on %s" %
+                              (e, spath), extra=self.d)
+            self.skipped += 1
+            return None
 
+        self.io_done(spath, result)
+        self.logger.debug("END process object: %s" % spath, extra=self.d)
+
+    @staticmethod
+    def dir_entry(path, entry):
+        """ (path, kind) of the entry of directory "path", kind is one of
+        link, fifo, sock, file, dir, None for unknown, or the OSError.
+        The type comes from the entry (d_type), only the other kinds of
+        entries need a stat """
+        try:
+            if entry.is_symlink():
+                kind = "link"
+            elif entry.is_file(follow_symlinks=False):
+                kind = "file"
+            elif entry.is_dir(follow_symlinks=False):
+                kind = "dir"
+            else:
+                mode = entry.stat(follow_symlinks=False).st_mode & 0o170000
+                if mode == S_IFIFO:
+                    kind = "fifo"
+                elif mode == S_IFSOCK:
+                    kind = "sock"
+                else:
+                    kind = None
+        except OSError as e:
+            kind = e
+        return os.path.join(path, entry.name), kind
+
+    def scan_dir(self, path):
+        """ [(path, kind)] of all the directory entries, see dir_entry() """
+        return self.scanner.all(path)
+
+    def read_dir(self, path, offset=0):
+        """ the next batch of entries of directory "path", and a DirScan
+        for the rest, None if there is none """
+        entries, offset = self.scanner.read(path, offset)
+        return entries, DirScan(path, offset) if offset else None
+
+    def timed_lstat(self, path):
+        """ lstat() of the main thread, a hung file system raises
+        TimeoutError instead of hanging the rank """
+        with timeout(seconds=5):
+            return self.lstat(path)
+
+    def io(self, spath, lstat=None):
+        """ the syscalls of process(): lstat, and reading the directory.
+        No timeout() here, signals only work on the main thread: process()
+        passes timed_lstat(). Reading the directory has none, a big one
+        takes as long as it takes """
+        if isinstance(spath, DirScan):
             try:
-                with timeout(seconds=5):
-                    st = os.lstat(spath)
+                return (None,) + self.read_dir(spath.path, spath.offset)
             except OSError as e:
-                self.logger.warn(e, extra=self.d)
-                self.skipped += 1
-                return None
-            except TimeoutError as e:
-                self.logger.error("%s when stat() on %s" %
-                                  (e, spath), extra=self.d)
-                self.skipped += 1
-                return None
-            except Exception as e:
-                self.logger.error("Unknown: %s on %s" %
-                                  (e, spath), extra=self.d)
+                return e
+        if not spath or spath in EXCLUDE:
+            return None
+        try:
+            st = (lstat or self.lstat)(spath)
+        except OSError as e:
+            return e
+
+        entries = rest = None
+        if stat.S_ISDIR(st.st_mode):
+            try:
+                entries, rest = self.read_dir(spath)
+            except OSError as e:
+                entries = e
+        return st, entries, rest
+
+    def io_done(self, spath, result):
+        if not spath:
+            return
+
+        if spath in EXCLUDE:
+            self.logger.warn("Skip excluded path: %s" %
+                             spath, extra=self.d)
+            self.skipped += 1
+            return
+
+        if isinstance(spath, DirScan):
+            if isinstance(result, OSError):
+                # the entries read so far still count for the directory
+                self.logger.warn(result, extra=self.d)
                 self.skipped += 1
-                return None
+                result = (None, [], None)
+            self.enq_entries(spath.path, spath.offset, *result[1:])
+            return
 
-            self.reduce_items += 1
+        if isinstance(result, OSError):
+            self.logger.warn(result, extra=self.d)
+            self.skipped += 1
+            return None
 
-            self.logger.debug("FIN lstat object: %s" % spath, extra=self.d)
+        st, entries, rest = result
+        self.reduce_items += 1
 
-            # islink() return True if it is symbolic link
-            if os.path.islink(spath):
-                self.sym_links += 1
-                # NOT TO FOLLOW SYM LINKS SHOULD BE THE DEFAULT
-                return None
+        self.logger.debug("FIN lstat object: %s" % spath, extra=self.d)
 
-            self.handle_file_or_dir(spath, st)
+        # islink() return True if it is symbolic link
+        if stat.S_ISLNK(st.st_mode):
+            self.sym_links += 1
+            # NOT TO FOLLOW SYM LINKS SHOULD BE THE DEFAULT
+            return None
 
-            self.logger.debug("END process object: %s" % spath, extra=self.d)
+        self.handle_file_or_dir(spath, st, entries, rest)
 
-    def handle_file_or_dir(self, spath, st):
+    def handle_file_or_dir(self, spath, st, entries, rest=None):
         if stat.S_ISREG(st.st_mode):
 
             # check sparse file
@@ -485,7 +651,7 @@ class ProfileWalk:
 
         elif stat.S_ISDIR(st.st_mode):
             self.cnt_dirs += 1
-            self.process_dir(spath, st)
+            self.process_dir(spath, st, entries, rest)
 
     def tally(self, t):
         """ t is a tuple element of flist """
@@ -554,7 +720,10 @@ class ProfileWalk:
         Tally.total_pipes = self.circle.comm.reduce(self.pipes, op=MPI.SUM)
         Tally.total_sockets = self.circle.comm.reduce(self.sockets, op=MPI.SUM)
         Tally.total_skipped = self.circle.comm.reduce(self.skipped, op=MPI.SUM)
+        Tally.split_dirs = self.circle.comm.reduce(self.split_dirs, op=MPI.SUM)
         Tally.taskloads = self.circle.comm.gather(self.reduce_items)
+        Tally.steals = self.circle.steal_summary()
+        Tally.states = self.circle.state_summary()
         Tally.max_files = self.circle.comm.reduce(self.maxfiles, op=MPI.MAX)
         Tally.total_nlinks = self.circle.comm.reduce(self.nlinks, op=MPI.SUM)
         Tally.total_nlinked_files = self.circle.comm.reduce(
@@ -575,6 +744,8 @@ class ProfileWalk:
                 self.cnt_blocks, op=MPI.SUM)
 
     def epilogue(self):
+        self.scanner.close()
+        dirfd.close_all()
         self.total_tally()
         self.time_ended = MPI.Wtime()
 
@@ -616,6 +787,7 @@ class ProfileWalk:
                 print(fmt_msg2.format("Avg file size:",
                                       bytes_fmt(Tally.total_filesize/float(Tally.total_files))))
             print(fmt_msg1.format("Max files within dir:", Tally.max_files))
+            print(fmt_msg1.format("Split directories:", Tally.split_dirs))
             elapsed_time = self.time_ended - self.time_started
             processing_rate = int((Tally.total_files + Tally.total_dirs +
                                    Tally.total_symlinks + Tally.total_skipped) / elapsed_time)
@@ -623,6 +795,8 @@ class ProfileWalk:
                                   utils.conv_time(elapsed_time)))
             print(fmt_msg2.format("Scanning rate:", str(processing_rate) + "/s"))
             print(fmt_msg2.format("Fprof loads:", str(Tally.taskloads)))
+            print(fmt_msg2.format("Fprof steals:", str(Tally.steals)))
+            print(fmt_msg2.format("Fprof work/comm/idle:", str(Tally.states)))
             print("")
 
             if args.syslog:
@@ -675,6 +849,8 @@ def main():
     fpipe.listen()
 
     args = parse_and_bcast(comm, gen_parser)
+    set_circle_args(args)
+    set_walk_args(args)
 
     try:
         G.src = utils.check_src2(args.path)
@@ -747,7 +923,7 @@ def main():
             for ele in EXCLUDE:
                 print("\t %s" % ele)
 
-    circle = Circle()
+    circle = Circle(name="fprof")
     if args.perprocess:
         circle.report_enabled = True
     else:
@@ -758,7 +934,14 @@ def main():
         circle.reduce_enabled = True
 
     treewalk = ProfileWalk(circle, G.src, perfile=args.perfile)
-    circle.begin(treewalk)
+    if args.from_index:
+        try:
+            manifest = windex.read_manifest(args.from_index, G.src)
+        except ValueError as e:
+            err_and_exit("Error: %s" % e)
+        treewalk.load_index(manifest)
+    else:
+        circle.begin(treewalk)
 
     # we need the total file size to calculate GPFS efficiency
     total_file_size = treewalk.epilogue()
@@ -860,6 +1043,10 @@ def gen_directory_histogram():
                              DIR_HIST[idx],
                              "%0.2f%%" % pct))
 
+        if G.dir_batch:
+            print("")
+            print("\tRead in batches of %s: %s directories" % (G.dir_batch, Tally.split_dirs))
+
 
 def gen_dist_file(bins, hist, file_name):
     import re
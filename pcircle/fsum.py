@@ -22,13 +22,17 @@ from _version import get_versions
 from task import BaseTask
 from utils import bytes_fmt, timestamp2, conv_unit
 from fwalk import FWalk
-from cio import readn
-from fdef import ChunkSum
+from cio import hash_range
+from fdef import ChunkSum, ChunkRange
 from globals import G
 from globals import Tally as T
 import utils
 from pcircle.mpihelper import tally_hosts, parse_and_bcast, ThrowingArgumentParser
+from pcircle.mpihelper import add_circle_args, set_circle_args
+from pcircle.mpihelper import add_walk_args, set_walk_args
 from bfsignature import BFsignature
+from pcircle import filetable
+from pcircle import windex
 
 __version__ = get_versions()['version']
 args = None
@@ -56,13 +60,20 @@ def gen_parser():
     parser.add_argument("-o", "--output", default="sha1-%s.sig" % timestamp2(), help="sha1 output file")
     parser.add_argument("--chunksize", help="chunk size (K, M, G, T)")
     parser.add_argument("--item", type=int, default="3000000", help="number of items stored in memory, default: 3000000")
+    parser.add_argument("--from-index", metavar="DIR", help="take the tree from the walk index in DIR (fwalk --index)")
     #parser.add_argument("--use-store", action="store_true", help="Use persistent store")
     #parser.add_argument("--export-block-signatures", action="store_true", help="export block-level signatures")
 
+    add_circle_args(parser)
+    add_walk_args(parser)
+
     return parser
 
 
 class Checksum(BaseTask):
+    # progress report, see vreduce.py
+    reduce_fields = [("vsize", "sum")]
+
     def __init__(self, circle, treewalk, chunksize, totalsize=0, totalfiles=0):
         BaseTask.__init__(self, circle)
         self.circle = circle
@@ -92,12 +103,12 @@ class Checksum(BaseTask):
 
 
         for fi in self.treewalk.flist:
-            if not os.path.islink(fi.path) and stat.S_ISREG(fi.st_mode):
+            if stat.S_ISREG(fi.st_mode):
                 self.enq_file(fi)
 
         if len(self.treewalk.flist_buf) > 0:
            for fi in self.treewalk.flist_buf:
-               if not os.path.islink(fi.path) and stat.S_ISREG(fi.st_mode):
+               if stat.S_ISREG(fi.st_mode):
                    self.enq_file(fi)
 
                     # right after this, we do first checkpoint
@@ -130,30 +141,20 @@ class Checksum(BaseTask):
         chunks = f.st_size / self.chunksize
         remaining = f.st_size % self.chunksize
 
-        workcnt = 0
+        # the path goes to the file table once, the chunks only carry its id
+        fid = filetable.table.add(f.path, size=f.st_size, mode=f.st_mode)
 
         if f.st_size == 0:  # empty file
-            ck = ChunkSum(f.path)
+            ck = ChunkSum(fid=fid)
             self.enq(ck)
             self.logger.debug("%s" % ck, extra=self.d)
-            workcnt += 1
+            workcnt = 1
         else:
-            for i in range(chunks):
-                ck = ChunkSum(f.path)
-                ck.offset = i * self.chunksize
-                ck.length = self.chunksize
-                self.enq(ck)
-                self.logger.debug("%s" % ck, extra=self.d)
-            workcnt += chunks
-
-        if remaining > 0:
-            # send remainder
-            ck = ChunkSum(f.path)
-            ck.offset = chunks * self.chunksize
-            ck.length = remaining
-            self.enq(ck)
-            self.logger.debug("%s" % ck, extra=self.d)
-            workcnt += 1
+            # one range, Circle.deq() hands out its chunks one by one
+            rng = ChunkRange(fid, 0, f.st_size, self.chunksize, ChunkRange.SUM)
+            self.enq(rng)
+            self.logger.debug("%s" % rng, extra=self.d)
+            workcnt = chunks + (1 if remaining > 0 else 0)
 
         # tally work cnt
         self.workcnt += workcnt
@@ -191,26 +192,33 @@ class Checksum(BaseTask):
 
     def process(self):
         ck = self.deq()
+        self.io_done(ck, self.io(ck))
+
+    def io(self, ck):
+        """ read and hash the chunk, safe to run on an I/O thread """
         try:
             fd = os.open(ck.filename, os.O_RDONLY)
         except OSError as e:
-            self.logger.warn("%s, Skipping ... " % e, extra=self.d)
-            return
+            return e
 
-        os.lseek(fd, ck.offset, os.SEEK_SET)
         digest = hashlib.sha1()
-        blocksize = 4*1024*1024 # 4MiB block
-        blockcount = ck.length / blocksize
-        remaining = ck.length % blocksize
-        for _ in xrange(blockcount):
-            digest.update(readn(fd, blocksize))
-        if remaining > 0:
-            digest.update(readn(fd, remaining))
         try:
-            os.close(fd)
-        except Exception as e:
-            self.logger.warn(e, extra=self.d)
-        ck.digest = digest.hexdigest()
+            hash_range(fd, ck.offset, ck.length, digest)
+        except IOError as e:
+            return e
+        finally:
+            try:
+                os.close(fd)
+            except Exception as e:
+                self.logger.warn(e, extra=self.d)
+        return digest.hexdigest()
+
+    def io_done(self, ck, result):
+        if isinstance(result, (OSError, IOError)):
+            self.logger.warn("%s, Skipping ... " % result, extra=self.d)
+            return
+
+        ck.digest = result
         #self.chunkq.append(ck)
         self.vsize += ck.length
 
@@ -241,6 +249,8 @@ class Checksum(BaseTask):
 
     def epilogue(self):
         self.wtime_ended = MPI.Wtime()
+        steals = self.circle.steal_summary()
+        states = self.circle.state_summary()
         if self.circle.rank == 0:
             print("")
             if self.totalsize == 0:
@@ -248,7 +258,9 @@ class Checksum(BaseTask):
             time = self.wtime_ended - self.wtime_started
             rate = float(self.totalsize) / time
             print("Checksumming Completed In: %.2f seconds" % time)
-            print("Average Rate: %s/s\n" % bytes_fmt(rate))
+            print("Average Rate: %s/s" % bytes_fmt(rate))
+            print("Steals: %s" % steals)
+            print("Work/comm/idle: %s\n" % states)
 
 
 def _read_in_blocks(chunks, chunksize=26214):
@@ -313,6 +325,8 @@ def main():
     global args, comm
     signal.signal(signal.SIGINT, sig_handler)
     args = parse_and_bcast(comm, gen_parser)
+    set_circle_args(args)
+    set_walk_args(args)
 
     try:
         G.src = utils.check_src(args.path)
@@ -325,7 +339,7 @@ def main():
     G.memitem_threshold = args.item
 
     hosts_cnt = tally_hosts()
-    circle = Circle()
+    circle = Circle(name="fwalk")
 
     if circle.rank == 0:
         print("Running Parameters:\n")
@@ -336,7 +350,14 @@ def main():
         print("\t{:<20}{:<20}".format("Items in memory:", G.memitem_threshold))
 
     fwalk = FWalk(circle, G.src)
-    circle.begin(fwalk)
+    if args.from_index:
+        try:
+            manifest = windex.read_manifest(args.from_index, [fi.path for fi in G.src])
+        except ValueError as e:
+            err_and_exit("Error: %s" % e)
+        fwalk.load_index(manifest)
+    else:
+        circle.begin(fwalk)
     if G.use_store:
         fwalk.flushdb()
 
@@ -352,7 +373,7 @@ def main():
     if circle.rank == 0:
         print("Chunksize = ", chunksize)
 
-    circle = Circle()
+    circle = Circle(name="fsum")
     fcheck = Checksum(circle, fwalk, chunksize, T.total_filesize, T.total_files)
 
     circle.begin(fcheck)
@@ -22,8 +22,14 @@ from globals import G
 from globals import Tally as T
 from utils import getLogger, bytes_fmt, destpath
 from dbstore import DbStore
-from fdef import FileItem
-from mpihelper import ThrowingArgumentParser, tally_hosts, parse_and_bcast
+from pcircle.filelist import FileList
+from pcircle import windex
+from pcircle import dirfd
+from pcircle.rewalk import ReWalk
+from pcircle.dirscan import Scanner
+from fdef import FileItem, DirScan
+from mpihelper import ThrowingArgumentParser, tally_hosts, parse_and_bcast, add_circle_args, set_circle_args
+from mpihelper import add_walk_args, set_walk_args
 
 import utils
 
@@ -52,12 +58,18 @@ def gen_parser():
     parser.add_argument("--use-store", action="store_true", help="Use persistent store")
     parser.add_argument("-s", "--stats", action="store_true", help="collects stats")
     parser.add_argument("-t", "--top", type=int, default=10, help="Top files (10)")
+    parser.add_argument("--index", metavar="DIR", help="save a walk index in DIR, for --from-index")
+    parser.add_argument("--incremental", metavar="PREV", help="only read the directories changed since the walk index PREV")
+    parser.add_argument("--restat", action="store_true", help="with --incremental, lstat the files of unchanged directories")
+
+    add_circle_args(parser)
+    add_walk_args(parser)
 
     return parser
 
 
 def local_histogram(flist):
-    """ A list FileItems, build np array  """
+    """ A FileList, histogram of its st_size column """
     global bins
     b4k = 4 * 1024
     b64k = 64 * 1024
@@ -71,9 +83,7 @@ def local_histogram(flist):
     b512g = 512 * b1g
     b1tb = 1024 * b1g
     bins = [ 0, b4k, b64k,b512k, b1m, b4m, b16m, b512m, b1g, b512g, b1tb]
-    fsizes = [f.st_size for f in flist]
-    arr = np.array(fsizes)
-    hist, _ = np.histogram(arr, bins)
+    hist, _ = np.histogram(flist.st_size, bins)
     return hist
 
 
@@ -87,8 +97,13 @@ def global_histogram(treewalk):
 
 
 class FWalk(BaseTask):
+    # progress report, see vreduce.py
+    reduce_fields = [("cnt_files", "sum"), ("cnt_dirs", "sum"),
+                     ("cnt_filesize", "sum"), ("reduce_items", "sum")]
+    # an lstat a work item, see BaseTask.process_batch()
+    batchable = True
 
-    def __init__(self, circle, src, dest=None, preserve=False, force=False):
+    def __init__(self, circle, src, dest=None, preserve=False, force=False, index=None):
         BaseTask.__init__(self, circle)
 
         self.d = {"rank": "rank %s" % circle.rank}
@@ -111,9 +126,20 @@ class FWalk(BaseTask):
         self.sym_links = 0
         self.follow_sym_links = False
 
-        self.flist = []
+        self.flist = FileList()
         self.flist_buf = []
 
+        # walk index writer, see windex.py
+        self.index = windex.IndexWriter(index, circle.rank) if index else None
+        # where every rank starts, instead of src at rank 0 (rewalk.py)
+        self.seeds = None
+
+        if G.dirfd:
+            self.lstat, self.scandir = dirfd.lstat, dirfd.scandir
+        else:
+            self.lstat, self.scandir = os.lstat, scandir
+        self.scanner = Scanner(self.scandir, self.dir_entry, G.dir_batch)
+
         # hold unlinkable dest directories
         # we have to do the --fix-opt at the end
         self.dest_dirs = []
@@ -123,6 +149,7 @@ class FWalk(BaseTask):
         self.cnt_filesize = 0
         self.last_cnt = 0
         self.skipped = 0
+        self.split_dirs = 0     # read in more than one batch
         self.last_reduce_time = MPI.Wtime()
 
         # reduce
@@ -132,9 +159,13 @@ class FWalk(BaseTask):
         self.time_ended = None
 
     def create(self):
-        if self.circle.rank == 0:
+        if self.seeds is not None:
+            for ele in self.seeds:
+                self.circle.enq(ele)
+        elif self.circle.rank == 0:
             for ele in self.src:
                 self.circle.enq(ele)
+        if self.circle.rank == 0:
             print("\nAnalyzing workload ...")
 
     def copy_xattr(self, src, dest):
@@ -150,9 +181,11 @@ class FWalk(BaseTask):
         if len(self.flist_buf) != 0:
             self.flist_db.mput(self.flist_buf)
 
-    def process_dir(self, fitem, st):
+    def process_dir(self, fitem, st, entries, rest=None):
         """ i_dir should be absolute path
         st is the stat object associated with the directory
+        entries is [(path, st_mode)] from read_dir(), or the OSError from
+        reading it, rest the DirScan for what is left of the directory
         """
         i_dir = fitem.path
 
@@ -172,24 +205,33 @@ class FWalk(BaseTask):
             if G.preserve:
                 self.copy_xattr(i_dir, o_dir)
 
-        last_report = MPI.Wtime()
-        count = 0
-        try:
-            entries = scandir(i_dir)
-        except OSError as e:
-            log.warn(e, extra=self.d)
+        if isinstance(entries, OSError):
+            log.warn(entries, extra=self.d)
             self.skipped += 1
         else:
-            for entry in entries:
-                elefi = FileItem(entry.path)
-                if fitem.dirname:
-                    elefi.dirname = fitem.dirname
-                self.circle.enq(elefi)
-
-                count += 1
-                if (MPI.Wtime() - last_report) > self.interval:
-                    print("Rank %s : Scanning [%s] at %s" % (self.circle.rank, i_dir, count))
-                    last_report = MPI.Wtime()
+            if rest:
+                self.split_dirs += 1
+            self.enq_entries(fitem, entries, rest)
+
+    def enq_entries(self, fitem, entries, rest):
+        """ queue the entries of the directory (or DirScan) "fitem", then
+        "rest" on top of them to read on """
+        i_dir = fitem.path
+        last_report = MPI.Wtime()
+        count = getattr(fitem, "offset", 0)
+        for path, mode in entries:
+            elefi = FileItem(path, mode)
+            if fitem.dirname:
+                elefi.dirname = fitem.dirname
+            self.circle.enq(elefi)
+
+            count += 1
+            if (MPI.Wtime() - last_report) > self.interval:
+                print("Rank %s : Scanning [%s] at %s" % (self.circle.rank, i_dir, count))
+                last_report = MPI.Wtime()
+        if rest:
+            self.circle.enq(rest)
+        else:
             log.info("Finish scan of [%s], count=%s" % (i_dir, count), extra=self.d)
 
     def do_metadata_preserve(self, src_file, dest_file, st):
@@ -268,49 +310,166 @@ class FWalk(BaseTask):
             source and destination respectively """
 
         fitem = self.circle.deq()
+        self.io_done(fitem, self.io(fitem))
+
+    @staticmethod
+    def dir_entry(path, entry):
+        """ (path, st_mode) of the entry of directory "path", st_mode only
+        has the file type bits when the entry tells (d_type), 0 when it
+        doesn't """
+        try:
+            if entry.is_symlink():
+                mode = stat.S_IFLNK
+            elif entry.is_dir(follow_symlinks=False):
+                mode = stat.S_IFDIR
+            elif entry.is_file(follow_symlinks=False):
+                mode = stat.S_IFREG
+            else:
+                mode = 0
+        except OSError:
+            mode = 0
+        return os.path.join(path, entry.name), mode
+
+    def scan_dir(self, path):
+        """ [(path, st_mode)] of all the directory entries, see dir_entry() """
+        return self.scanner.all(path)
+
+    def read_dir(self, fitem):
+        """ the next batch of entries of the directory (or DirScan) "fitem",
+        and a DirScan for the rest, None if there is none """
+        entries, offset = self.scanner.read(fitem.path, getattr(fitem, "offset", 0))
+        rest = DirScan(fitem.path, offset, fitem.dirname) if offset else None
+        return entries, rest
+
+    def type_only(self, fitem):
+        """ True if the file type of "fitem" is all we need to know, no
+        lstat(): for a symlink, and a directory we neither copy nor index """
+        if self.index or fitem.st_mode & 0o7777:
+            return False
+        if stat.S_ISLNK(fitem.st_mode):
+            return True
+        return stat.S_ISDIR(fitem.st_mode) and not self.dest
+
+    def io(self, fitem):
+        """ the syscalls of process(), safe to run on an I/O thread:
+        lstat, unless type_only(), and reading the entries of a directory """
+        if isinstance(fitem, DirScan):
+            try:
+                return (None,) + self.read_dir(fitem)
+            except OSError as e:
+                return e
         spath = fitem.path
-        if spath:
+        if not spath:
+            return None
+        if self.type_only(fitem):
+            st = fitem
+        else:
             try:
-                st = os.lstat(spath)
+                st = self.lstat(spath)
             except OSError as e:
-                log.warn(e, extra=self.d)
-                self.skipped += 1
-                return False
+                return e
 
-            fitem.st_mode, fitem.st_size, fitem.st_uid, fitem.st_gid = st.st_mode, st.st_size, st.st_uid, st.st_gid
-            self.reduce_items += 1
+        entries = rest = None
+        if stat.S_ISDIR(st.st_mode):
+            try:
+                entries, rest = self.read_dir(fitem)
+            except OSError as e:
+                entries = e
+        return st, entries, rest
 
-            if os.path.islink(spath):
-                self.append_fitem(fitem)
-                self.sym_links += 1
-                # if not self.follow_sym_links:
-                # NOT TO FOLLOW SYM LINKS SHOULD BE THE DEFAULT
-                return
+    def io_done(self, fitem, result):
+        if result is None:
+            return
+        if isinstance(result, OSError):
+            log.warn(result, extra=self.d)
+            self.skipped += 1
+            return False
 
-            if stat.S_ISREG(st.st_mode):
+        if isinstance(fitem, DirScan):
+            self.enq_entries(fitem, *result[1:])
+            return
 
-                if not self.dest:
-                    # fwalk without destination, simply add to process list
-                    self.append_fitem(fitem)
+        spath = fitem.path
+        st, entries, rest = result
+        if self.index:
+            self.index.add(spath, st)
+        fitem.st_mode, fitem.st_size, fitem.st_uid, fitem.st_gid = st.st_mode, st.st_size, st.st_uid, st.st_gid
+        self.reduce_items += 1
+
+        if stat.S_ISLNK(st.st_mode):
+            self.append_fitem(fitem)
+            self.sym_links += 1
+            # if not self.follow_sym_links:
+            # NOT TO FOLLOW SYM LINKS SHOULD BE THE DEFAULT
+            return
+
+        if stat.S_ISREG(st.st_mode):
+
+            if not self.dest:
+                # fwalk without destination, simply add to process list
+                self.append_fitem(fitem)
+            else:
+                # self.dest specified, need to check if it is there
+                dpath = destpath(fitem, self.dest)
+                flag = self.check_dest_exists(spath, dpath)
+                if flag:
+                    return
                 else:
-                    # self.dest specified, need to check if it is there
-                    dpath = destpath(fitem, self.dest)
-                    flag = self.check_dest_exists(spath, dpath)
-                    if flag:
-                        return
-                    else:
-                        # if src and dest not the same
-                        # including the case dest is not there
-                        # then we do the following
-                        self.append_fitem(fitem)
-                        self.do_metadata_preserve(spath, dpath, st)
-                self.cnt_files += 1
-                self.cnt_filesize += fitem.st_size
-
-            elif stat.S_ISDIR(st.st_mode):
-                self.cnt_dirs += 1
-                self.process_dir(fitem, st)
-                # END OF if spath
+                    # if src and dest not the same
+                    # including the case dest is not there
+                    # then we do the following
+                    self.append_fitem(fitem)
+                    self.do_metadata_preserve(spath, dpath, st)
+            self.cnt_files += 1
+            self.cnt_filesize += fitem.st_size
+
+        elif stat.S_ISDIR(st.st_mode):
+            self.cnt_dirs += 1
+            self.process_dir(fitem, st, entries, rest)
+
+    def finish_index(self, extra=None):
+        """ collective, complete the walk index """
+        windex.finish(self.index, self.circle.comm, [fi.path for fi in self.src], extra)
+
+    def copy_root(self, path):
+        """ FileItem.dirname of "path", that of the source it is under """
+        for fi in self.src:
+            if path == fi.path or path.startswith(fi.path.rstrip(os.sep) + os.sep):
+                return fi.dirname
+        return None
+
+    def replay(self, path, st):
+        fitem = FileItem(path)
+        fitem.dirname = self.copy_root(path)
+        self.io_done(fitem, (st, [], None))
+
+    def load_index(self, manifest):
+        """ collective, take the walk results from a walk index instead of
+        walking: this rank's share of the entries goes through io_done() as
+        if it had just lstat() them.
+
+        With a destination, the directories are made first, a depth at a
+        time with a barrier in between, so that a directory is there before
+        its entries whichever rank has them.
+        """
+        comm = self.circle.comm
+        self.time_started = MPI.Wtime()
+        if self.dest:
+            dirs = sorted(windex.load(manifest, comm.rank, comm.size, kinds=(stat.S_IFDIR,)),
+                          key=lambda d: d[0].count(os.sep))
+            levels = set(path.count(os.sep) for path, _ in dirs)
+            levels = sorted(set().union(*comm.allgather(levels)))
+            i = 0
+            for level in levels:
+                while i < len(dirs) and dirs[i][0].count(os.sep) == level:
+                    self.replay(*dirs[i])
+                    i += 1
+                comm.Barrier()
+
+        for path, st in windex.load(manifest, comm.rank, comm.size):
+            if self.dest and stat.S_ISDIR(st.st_mode):
+                continue
+            self.replay(path, st)
 
     def tally(self, t):
         """ t is a tuple element of flist """
@@ -358,9 +517,14 @@ class FWalk(BaseTask):
         T.total_filesize = self.circle.comm.allreduce(self.cnt_filesize, op=MPI.SUM)
         T.total_symlinks = self.circle.comm.allreduce(self.sym_links, op=MPI.SUM)
         T.total_skipped = self.circle.comm.allreduce(self.skipped, op=MPI.SUM)
+        T.split_dirs = self.circle.comm.allreduce(self.split_dirs, op=MPI.SUM)
         taskloads = self.circle.comm.gather(self.reduce_items)
+        T.steals = self.circle.steal_summary()
+        T.states = self.circle.state_summary()
 
     def epilogue(self):
+        self.scanner.close()
+        dirfd.close_all()
         self.total_tally()
         self.time_ended = MPI.Wtime()
 
@@ -370,6 +534,8 @@ class FWalk(BaseTask):
             print("\t{:<20}{:<20}".format("Sym Links count:", T.total_symlinks))
             print("\t{:<20}{:<20}".format("File count:", T.total_files))
             print("\t{:<20}{:<20}".format("Skipped count:", T.total_skipped))
+            if T.split_dirs:
+                print("\t{:<20}{:<20}".format("Split dir count:", T.split_dirs))
             print("\t{:<20}{:<20}".format("Total file size:", bytes_fmt(T.total_filesize)))
             if T.total_files != 0:
                 print("\t{:<20}{:<20}".format("Avg file size:", bytes_fmt(T.total_filesize/float(T.total_files))))
@@ -377,6 +543,8 @@ class FWalk(BaseTask):
             print("\t{:<20}{:<20}".format("Use store flist:", "%s" % self.use_store))
             print("\t{:<20}{:<20}".format("Use store workq:", "%s" % self.circle.use_store))
             print("\tFWALK Loads: %s" % taskloads)
+            print("\tFWALK Steals: %s" % T.steals)
+            print("\tFWALK work/comm/idle: %s" % T.states)
             print("")
 
 
@@ -388,6 +556,8 @@ class FWalk(BaseTask):
 def main():
     global comm, args
     args = parse_and_bcast(comm, gen_parser)
+    set_circle_args(args)
+    set_walk_args(args)
 
     try:
         G.src = utils.check_src(args.path)
@@ -406,9 +576,41 @@ def main():
         print("\t{:<20}{:<20}".format("Num of processes:", MPI.COMM_WORLD.Get_size()))
         print("\t{:<20}{:<20}".format("Root path:", utils.choplist(G.src)))
 
-    circle = Circle()
-    treewalk = FWalk(circle, G.src)
-    circle.begin(treewalk)
+    prev = None
+    if args.incremental:
+        if not args.index:
+            err_and_exit("Error: --incremental needs --index for the new walk index")
+        if os.path.realpath(args.incremental) == os.path.realpath(args.index):
+            err_and_exit("Error: --index can't overwrite the --incremental index")
+        try:
+            prev = windex.read_manifest(args.incremental, [fi.path for fi in G.src])
+        except ValueError as e:
+            err_and_exit("Error: %s" % e)
+
+    circle = Circle(name="fwalk")
+    treewalk = FWalk(circle, G.src, index=args.index)
+    if prev:
+        rewalk = ReWalk(treewalk, prev, restat=args.restat)
+        rewalk.run()
+        delta = rewalk.summary()
+        treewalk.finish_index(delta)
+        if comm.rank == 0:
+            delta = delta["delta"]
+            print("\nIncremental walk, from %s:\n" % args.incremental)
+            print("\t{:<20}{:<20}".format("Dirs unchanged:", delta["dirs_same"]))
+            print("\t{:<20}{:<20}".format("Dirs read again:", delta["dirs_modified"]))
+            print("\t{:<20}{:<20}".format("New subtrees:", delta["dirs_new"]))
+            print("\t{:<20}{:<20}".format("Dirs gone:", delta["dirs_gone"]))
+            print("\t{:<20}{:<20}".format("Added:", delta["added"]))
+            print("\t{:<20}{:<20}".format("Removed:", delta["removed"]))
+            print("\t{:<20}{:<20}".format("Changed:", delta["changed"]))
+    else:
+        circle.begin(treewalk)
+        if args.index:
+            treewalk.finish_index()
+
+    if args.index and comm.rank == 0:
+        print("\nWalk index saved in: %s" % args.index)
 
     if G.use_store:
         treewalk.flushdb()
@@ -427,8 +629,7 @@ def main():
                     "%0.2f%%" % percent, '∎' * star_count))
 
     if args.stats:
-        treewalk.flist.sort(lambda f1, f2: cmp(f1.st_size, f2.st_size), reverse=True)
-        globaltops = comm.gather(treewalk.flist[:args.top])
+        globaltops = comm.gather(treewalk.flist.largest(args.top))
         if comm.rank == 0:
             globaltops = [item for sublist in globaltops for item in sublist]
             globaltops.sort(lambda f1, f2: cmp(f1.st_size, f2.st_size), reverse=True)
@@ -14,6 +14,7 @@ class Tally:
     total_symlinks = 0
     total_skipped = 0
     total_sparse = 0
+    split_dirs = 0              # read in batches, see dirscan.py
     max_files = 0
     total_nlinks = 0
     total_nlinked_files = 0
@@ -26,6 +27,11 @@ class Tally:
     # ZFS
     total_blocks = 0
 
+    # work stealing summary, see Circle.steal_summary()
+    steals = None
+    # per-rank (work, comm, idle) seconds, see Circle.state_summary()
+    states = None
+
 class G:
     ZERO = 0
     ABORT = -1
@@ -55,6 +61,8 @@ class G:
     fix_opt = False
     preserve = False
     DB_BUFSIZE = 10000
+    WIRE_BUFSIZE = 4 * 1024 * 1024   # largest work reply, see wire.py
+    REDUCE_BUFSIZE = 64 * 1024       # largest pickled reduce buffer
     memitem_threshold = 100000
     tempdir = None
     total_chunks = 0
@@ -70,6 +78,29 @@ class G:
     reduce_interval = 30
     reduce_enabled = False
     verbosity = 0
+    term_policy = "token"
+    counters_file = None     # JSON load balance report, see counters.py
+    trace_file = None        # Chrome trace of Circle events, see trace.py
+    trace_events = 65536     # per-rank ring buffer size
+    steal_policy = "random"
+    steal_local_tries = 2
+    steal_requests = 1
+    split_policy = "equal"
+    split_min_items = 2
+    split_min_bytes = 0
+    idle_policy = "wait"
+    idle_min = 0.00005
+    idle_max = 0.001
+    batch_items = 64     # process_batch() limits, see task.py
+    batch_time = 0.005
+    io_threads = 0       # > 0 turns on executor mode, see executor.py
+    io_depth = 0         # work items in flight, 0 for 2 * io_threads
+    spill_backend = "segment"   # work queue overflow store, see segstore.py
+    dirfd = False        # directory relative lstat/scandir, see dirfd.py
+    dirfd_cache = 64     # open directories per thread with dirfd
+    dir_batch = 100000   # directory entries read at a time, see dirscan.py
+    copy_engine = "kernel"      # how fcp moves the bytes, see copyengine.py
+    pipeline_depth = 0          # blocks in flight per rank reading and writing, 0: off, see pipeline.py
     am_root = False
     copytype = 'dir2dir'
 
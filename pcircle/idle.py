@@ -0,0 +1,68 @@
+from __future__ import absolute_import
+from __future__ import division
+
+import time
+
+__author__ = 'Feiyi Wang'
+
+"""
+Idle strategies for the Circle progress loop.
+
+Circle.loop() calls idle() on every pass that found nothing to do (no local
+work, nothing received), and reset() whenever there was progress.
+
+    spin    - return at once, lowest latency, burns a full core
+    backoff - sleep, doubling from min_sleep up to max_sleep
+    wait    - block in Circle.wait_for_message() until something
+              arrives for us or max_sleep passes
+"""
+
+POLICIES = ("spin", "backoff", "wait")
+
+
+class SpinIdle(object):
+    name = "spin"
+
+    def __init__(self, circle, min_sleep=0.00005, max_sleep=0.001):
+        self.circle = circle
+        self.min_sleep = min_sleep
+        self.max_sleep = max_sleep
+
+    def idle(self):
+        pass
+
+    def reset(self):
+        pass
+
+
+class BackoffIdle(SpinIdle):
+    name = "backoff"
+
+    def __init__(self, circle, min_sleep=0.00005, max_sleep=0.001):
+        SpinIdle.__init__(self, circle, min_sleep, max_sleep)
+        self.sleep = min_sleep
+
+    def idle(self):
+        time.sleep(self.sleep)
+        self.sleep = min(self.sleep * 2, self.max_sleep)
+
+    def reset(self):
+        self.sleep = self.min_sleep
+
+
+class WaitIdle(SpinIdle):
+    name = "wait"
+
+    def idle(self):
+        self.circle.wait_for_message(self.max_sleep, self.min_sleep)
+
+
+def make_idle(name, circle, min_sleep=0.00005, max_sleep=0.001):
+    if name == "spin":
+        return SpinIdle(circle, min_sleep, max_sleep)
+    elif name == "backoff":
+        return BackoffIdle(circle, min_sleep, max_sleep)
+    elif name == "wait":
+        return WaitIdle(circle, min_sleep, max_sleep)
+    else:
+        raise ValueError("Unknown idle strategy: %s" % name)
@@ -2,8 +2,18 @@ __author__ = 'f7b'
 
 import argparse
 import sys
+import time
 from mpi4py import MPI
 
+from pcircle.globals import G
+from pcircle import steal
+from pcircle import split
+from pcircle import idle
+from pcircle import token
+from pcircle import segstore
+from pcircle import dirfd
+from pcircle.utils import conv_unit
+
 
 def tally_hosts():
     """ How many physical hosts are there? """
@@ -53,3 +63,180 @@ def parse_and_bcast(comm, func_get_parser):
         print("ARGUMENT DEBUG: %s", args)
 
     return args
+
+
+def add_circle_args(parser):
+    """ Circle (work stealing engine) options shared by all tools """
+    parser.add_argument("--counters", metavar="FILE", default=None,
+                        help="write per-phase Circle counters and load balance as JSON to FILE")
+    parser.add_argument("--trace", metavar="FILE", default=None,
+                        help="record a Chrome/Perfetto trace of Circle events to FILE")
+    parser.add_argument("--trace-events", metavar="N", type=int, default=G.trace_events,
+                        help="per-rank trace ring buffer size, default: %s" % G.trace_events)
+    parser.add_argument("--term", choices=token.POLICIES, default=G.term_policy,
+                        help="termination detection, default: %s" % G.term_policy)
+    parser.add_argument("--steal", choices=steal.POLICIES, default=G.steal_policy,
+                        help="work stealing victim selection, default: %s" % G.steal_policy)
+    parser.add_argument("--steal-local", metavar="N", type=int, default=G.steal_local_tries,
+                        help="intra-node steal attempts before going remote (hier), default: %s"
+                             % G.steal_local_tries)
+    parser.add_argument("--steal-requests", metavar="N", type=int, default=G.steal_requests,
+                        help="concurrent work requests per idle rank, default: %s" % G.steal_requests)
+    parser.add_argument("--split", choices=split.POLICIES, default=G.split_policy,
+                        help="how a victim splits its work queue, default: %s" % G.split_policy)
+    parser.add_argument("--split-min-items", metavar="N", type=int, default=G.split_min_items,
+                        help="don't share a work queue shorter than this, default: %s"
+                             % G.split_min_items)
+    parser.add_argument("--split-min-bytes", metavar="sz", default=None,
+                        help="smallest share worth sending with --split bytes (K, M, G), default: none")
+    parser.add_argument("--batch", metavar="N", type=int, default=G.batch_items,
+                        help="work items processed per loop pass by fwalk and fprof, 1 to disable batching, default: %s"
+                             % G.batch_items)
+    parser.add_argument("--batch-time", metavar="ms", type=float, default=G.batch_time * 1000,
+                        help="time budget of a batch in milliseconds, default: %s" % (G.batch_time * 1000))
+    parser.add_argument("--io-threads", metavar="N", type=int, default=G.io_threads,
+                        help="I/O worker threads per rank, 0 to process in the main thread, default: %s"
+                             % G.io_threads)
+    parser.add_argument("--io-depth", metavar="N", type=int, default=G.io_depth,
+                        help="work items in flight per rank with --io-threads, default: 2 x threads")
+    parser.add_argument("--spill", choices=segstore.POLICIES, default=G.spill_backend,
+                        help="where the work queue overflows to, default: %s" % G.spill_backend)
+    parser.add_argument("--idle", choices=idle.POLICIES, default=G.idle_policy,
+                        help="what an idle rank does between probes, default: %s" % G.idle_policy)
+    parser.add_argument("--idle-max", metavar="ms", type=float, default=G.idle_max * 1000,
+                        help="longest idle sleep/wait in milliseconds, default: %s" % (G.idle_max * 1000))
+
+
+def set_circle_args(args):
+    """ copy the parsed Circle options into G, before any Circle is created """
+    G.counters_file = args.counters
+    G.trace_file = args.trace
+    G.trace_events = max(1, args.trace_events)
+    G.term_policy = args.term
+    G.steal_policy = args.steal
+    G.steal_local_tries = args.steal_local
+    G.steal_requests = max(1, args.steal_requests)
+    G.split_policy = args.split
+    G.split_min_items = args.split_min_items
+    if args.split_min_bytes:
+        G.split_min_bytes = conv_unit(args.split_min_bytes)
+    G.batch_items = max(1, args.batch)
+    G.batch_time = args.batch_time / 1000.0
+    G.io_threads = max(0, args.io_threads)
+    G.io_depth = max(0, args.io_depth)
+    G.spill_backend = args.spill
+    G.idle_policy = args.idle
+    G.idle_max = args.idle_max / 1000.0
+
+
+def add_walk_args(parser):
+    """ tree walk options shared by fwalk, fcp, fsum and fprof """
+    parser.add_argument("--dirfd", action="store_true",
+                        help="lstat and read directories relative to open directory fds (Python 3)")
+    parser.add_argument("--dirfd-cache", metavar="N", type=int, default=G.dirfd_cache,
+                        help="open directories per thread with --dirfd, default: %s" % G.dirfd_cache)
+    parser.add_argument("--dir-batch", metavar="N", type=int, default=G.dir_batch,
+                        help="read directories N entries at a time, so that other ranks "
+                             "can take them meanwhile, 0 for all at once, default: %s" % G.dir_batch)
+
+
+def set_walk_args(args):
+    """ copy the parsed walk options into G """
+    G.dirfd = args.dirfd and dirfd.available()
+    if args.dirfd and not G.dirfd and MPI.COMM_WORLD.Get_rank() == 0:
+        print("Warning: --dirfd needs dir_fd and scandir(fd) support (Python 3), ignored")
+    G.dirfd_cache = args.dirfd_cache
+    G.dir_batch = max(args.dir_batch, 0)
+
+
+class PostedRecv(object):
+    """ A persistent, pre-posted receive into a fixed buffer.
+
+    The request is armed at creation, test() tells if a message landed
+    in self.buf (self.status has source and size), and restart() must be
+    called once the buffer has been consumed to arm it again.
+    """
+
+    def __init__(self, comm, buf, source, tag):
+        self.buf = buf
+        self.source = source
+        self.tag = tag
+        self.status = MPI.Status()
+        self.ready = False
+        self.req = comm.Recv_init(buf, source=source, tag=tag)
+        self.req.Start()
+
+    def test(self):
+        if self.ready:
+            self.ready = False
+            return True
+        return self.req.Test(self.status)
+
+    def count(self, datatype=MPI.BYTE):
+        return self.status.Get_count(datatype)
+
+    def restart(self):
+        self.req.Start()
+
+    def cancel(self):
+        """ cancel and free the request, return False if a message was lost """
+        lost = self.ready
+        if not self.ready:
+            self.req.Cancel()
+            self.req.Wait(self.status)
+            lost = not self.status.Is_cancelled()
+        self.req.Free()
+        return not lost
+
+
+def wait_any(posted, timeout, poll):
+    """ wait until one of the PostedRecv has a message, or timeout seconds.
+
+    MPI has no Waitany with a timeout, so this is Testany with a short
+    sleep in between. The completed receive is marked ready, its next
+    test() returns True without going back to MPI.
+    """
+    for p in posted:
+        if p.ready:
+            return True
+
+    reqs = [p.req for p in posted]
+    status = MPI.Status()
+    deadline = MPI.Wtime() + timeout
+    while True:
+        idx, flag = MPI.Request.Testany(reqs, status)
+        if flag and idx != MPI.UNDEFINED:
+            p = posted[idx]
+            p.status = status
+            p.ready = True
+            return True
+        if MPI.Wtime() >= deadline:
+            return False
+        time.sleep(poll)
+
+
+class SendQueue(object):
+    """ Non-blocking sends that are completed lazily.
+
+    post() keeps the request and its buffer alive, progress() drops the
+    completed ones, so a slow receiver never stalls the sender.
+    """
+
+    def __init__(self):
+        self.pending = []
+
+    def post(self, req, buf):
+        self.pending.append((req, buf))
+
+    def progress(self):
+        if self.pending:
+            self.pending = [(req, buf) for req, buf in self.pending if not req.Test()]
+        return len(self.pending)
+
+    def wait_all(self):
+        for req, _ in self.pending:
+            req.Wait()
+        self.pending = []
+
+    def __len__(self):
+        return len(self.pending)
@@ -0,0 +1,246 @@
+from __future__ import absolute_import
+
+import os
+import stat
+
+from pcircle import windex
+from pcircle.fdef import FileItem
+from pcircle.utils import getLogger
+
+__author__ = 'Feiyi Wang'
+
+"""
+Incremental walk: fwalk --incremental PREV --index DIR.
+
+Creating, removing or renaming an entry of a directory updates its mtime
+and ctime, so a directory whose inode, mtime and ctime are the same as in
+the walk index PREV still has the entries PREV lists for it. Only the
+directories that changed are read again; the entries of the others come
+from PREV, their files lstat()'d again with --restat to catch size and
+mtime changes, taken as they are otherwise. Directories that aren't in
+PREV at all are walked the usual way, by FWalk.
+
+All of it is spread over the ranks by hashing directory paths
+(windex.owner()):
+
+    1. every rank reads its share of PREV, lstat()s the directories in it,
+       and sends each directory to its owner, and each entry to the owner
+       of its parent
+    2. the owner of a directory now has its old and new stat and its old
+       entries: it keeps them, reads the directory again, or drops them,
+       and sends the subdirectories it found to their owner
+    3. those not in PREV are new, FWalk walks them from where they are
+
+The result is a fresh index DIR, and a delta list per rank,
+DIR/delta.<rank>, of "<added|removed|changed>\\t<path>" lines (paths are
+not escaped). Directories report themselves as added or removed; files,
+links and the rest also as changed, when their size or mtime did.
+
+An existing directory whose path now goes through a symlink still looks
+the same to lstat(), and is kept.
+"""
+
+ADDED = "added"
+REMOVED = "removed"
+CHANGED = "changed"
+
+SAME, MODIFIED, GONE = 0, 1, 2
+
+log = getLogger(__name__)
+
+
+def delta_name(rank):
+    return "delta.%s" % rank
+
+
+def changed(old, new):
+    return old.st_size != new.st_size or windex.mtime_ns(old) != windex.mtime_ns(new)
+
+
+class Delta(object):
+    """ the delta list of one rank """
+
+    def __init__(self, index_dir, rank):
+        self.f = open(os.path.join(index_dir, delta_name(rank)), "w")
+        self.counts = {ADDED: 0, REMOVED: 0, CHANGED: 0}
+
+    def add(self, kind, path):
+        self.f.write("%s\t%s\n" % (kind, path))
+        self.counts[kind] += 1
+
+    def close(self):
+        self.f.close()
+
+
+class AddedIndex(object):
+    """ stands in for the IndexWriter of FWalk while it walks new
+    directories, everything it finds is added """
+
+    def __init__(self, writer, delta):
+        self.writer = writer
+        self.delta = delta
+
+    def add(self, path, st):
+        self.writer.add(path, st)
+        self.delta.add(ADDED, path)
+
+
+class ReWalk(object):
+
+    def __init__(self, treewalk, manifest, restat=False):
+        self.treewalk = treewalk
+        self.circle = treewalk.circle
+        self.comm = treewalk.circle.comm
+        self.manifest = manifest
+        self.restat = restat
+        self.writer = treewalk.index
+        self.delta = Delta(os.path.dirname(self.writer.path), self.comm.rank)
+        self.d = {"rank": "rank %s" % self.comm.rank}
+
+        # directories: kept, read again, gone, new
+        self.cnt_same = self.cnt_modified = self.cnt_gone = self.cnt_new = 0
+
+    def emit(self, path, st):
+        """ an entry of the new walk """
+        self.treewalk.replay(path, st)
+
+    def keep(self, path, old, restat):
+        """ an entry of an unchanged directory """
+        if not restat:
+            self.emit(path, old)
+            return
+        try:
+            st = os.lstat(path)
+        except OSError:
+            self.delta.add(REMOVED, path)
+            return
+        if changed(old, st):
+            self.delta.add(CHANGED, path)
+        self.emit(path, st)
+
+    def rescan(self, path, children, found):
+        """ read a changed directory again, "children" are its entries in
+        PREV, the subdirectories go to "found" by owner """
+        old = dict(children)
+        try:
+            entries = self.treewalk.scan_dir(path)
+        except OSError as e:
+            log.warn(e, extra=self.d)
+            self.treewalk.skipped += 1
+            entries = []
+
+        for epath, mode in entries:
+            ost = old.pop(epath, None)
+            # subdirectories are lstat()'d by their owner, or by FWalk
+            if stat.S_ISDIR(mode):
+                found[windex.owner(epath, self.comm.size)].append(epath)
+                if ost is not None and not stat.S_ISDIR(ost.st_mode):
+                    self.delta.add(REMOVED, epath)
+                continue
+            try:
+                st = os.lstat(epath)
+            except OSError as e:
+                log.warn(e, extra=self.d)
+                self.treewalk.skipped += 1
+                continue
+            # a directory that is now something else reports its own removal
+            if ost is None or stat.S_ISDIR(ost.st_mode):
+                self.delta.add(ADDED, epath)
+            elif changed(ost, st):
+                self.delta.add(CHANGED, epath)
+            self.emit(epath, st)
+
+        for epath, ost in old.items():
+            if not stat.S_ISDIR(ost.st_mode):
+                self.delta.add(REMOVED, epath)
+
+    def status(self, old, st):
+        if st is None or not stat.S_ISDIR(st.st_mode):
+            return GONE
+        if st.st_ino == old.st_ino and windex.mtime_ns(st) == old.st_mtime_ns and \
+                windex.ctime_ns(st) == old.st_ctime_ns:
+            return SAME
+        return MODIFIED
+
+    def run(self):
+        """ collective, the incremental walk """
+        comm = self.comm
+        size = comm.size
+
+        # 1. directories to their owner, entries to the owner of their parent
+        dirs_out = [[] for _ in range(size)]
+        kids_out = [[] for _ in range(size)]
+        for path, old in windex.load(self.manifest, comm.rank, size):
+            if stat.S_ISDIR(old.st_mode):
+                try:
+                    st = os.lstat(path)
+                except OSError:
+                    st = None
+                dirs_out[windex.owner(path, size)].append((path, old, st))
+            kids_out[windex.owner(os.path.dirname(path), size)].append((path, old))
+
+        dirs = {}
+        for part in comm.alltoall(dirs_out):
+            for path, old, st in part:
+                dirs[path] = (old, st)
+        del dirs_out
+        kids = {}
+        for part in comm.alltoall(kids_out):
+            for path, old in part:
+                kids.setdefault(os.path.dirname(path), []).append((path, old))
+        del kids_out
+
+        # 2. keep, read again or drop the entries of every directory
+        found = [[] for _ in range(size)]
+        for path, (old, st) in dirs.items():
+            children = kids.pop(path, [])
+            status = self.status(old, st)
+            if status == GONE:
+                self.cnt_gone += 1
+                self.delta.add(REMOVED, path)
+                for epath, ost in children:
+                    if not stat.S_ISDIR(ost.st_mode):
+                        self.delta.add(REMOVED, epath)
+                continue
+            self.emit(path, st)
+            if status == SAME:
+                self.cnt_same += 1
+                for epath, ost in children:
+                    if not stat.S_ISDIR(ost.st_mode):
+                        self.keep(epath, ost, self.restat)
+            else:
+                self.cnt_modified += 1
+                self.rescan(path, children, found)
+
+        # what is left are the sources that are files, always lstat() them
+        for children in kids.values():
+            for epath, ost in children:
+                if not stat.S_ISDIR(ost.st_mode):
+                    self.keep(epath, ost, True)
+
+        # 3. walk the new directories
+        seeds = []
+        for part in comm.alltoall(found):
+            for path in part:
+                entry = dirs.get(path)
+                if entry is None or self.status(*entry) == GONE:
+                    fitem = FileItem(path)
+                    fitem.dirname = self.treewalk.copy_root(path)
+                    seeds.append(fitem)
+        self.cnt_new = len(seeds)
+
+        self.treewalk.seeds = seeds
+        self.treewalk.index = AddedIndex(self.writer, self.delta)
+        self.circle.begin(self.treewalk)
+        self.treewalk.index = self.writer
+        self.delta.close()
+
+    def summary(self):
+        """ collective, the totals of all ranks, for the manifest """
+        comm = self.comm
+        out = {"prev": os.path.abspath(self.manifest["dir"])}
+        for kind in (ADDED, REMOVED, CHANGED):
+            out[kind] = comm.allreduce(self.delta.counts[kind])
+        for name in ("same", "modified", "gone", "new"):
+            out["dirs_" + name] = comm.allreduce(getattr(self, "cnt_" + name))
+        return {"delta": out}
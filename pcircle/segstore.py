@@ -0,0 +1,170 @@
+from __future__ import absolute_import
+
+import os
+import sys
+import mmap
+import shutil
+from collections import deque
+from itertools import islice
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from pcircle.dbstore import DbStore
+from pcircle.utils import getLogger
+
+__author__ = 'Feiyi Wang'
+
+"""
+Segmented, append-only spill store for the Circle work queue.
+
+Same API as DbStore for what Circle uses (mput, mget, mdel, __len__,
+cleanup), but the overflow lives in a directory of segment files instead
+of a SQLite table:
+
+    <dbname>.seg/00000000, 00000001, ...
+
+Every segment holds at most "seg_items" objects, pickled as one list.
+Only an in-memory index of (path, count, size) per segment is kept, from
+head (oldest) to tail (newest). mget() maps the head segments and unpickles
+them whole into a decoded buffer; mdel() drops objects from that buffer
+and removes a segment file once all of its objects are gone.
+
+The work queue is FIFO across spills, like DbStore: mget() returns the
+oldest objects first.
+
+SegStore doesn't survive a restart, a checkpoint exports its content into
+a DbStore (see export()), and resume always reads that DbStore back.
+"""
+
+POLICIES = ("segment", "db")
+
+PY3 = sys.version_info[0] >= 3
+
+
+class SegStore(object):
+    def __init__(self, dbname, seg_items=10000):
+        self.dbname = dbname
+        self.segdir = dbname + ".seg"
+        self.seg_items = seg_items
+        self.logger = getLogger(__name__)
+        self.d = {"rank": ''}
+
+        # under G.tempdir, which another rank may have removed already
+        shutil.rmtree(self.segdir, ignore_errors=True)
+        os.makedirs(self.segdir)
+
+        self.segs = deque()      # [path, count, size] not yet decoded, head first
+        self.loaded = deque()    # [path, remaining] decoded into self.head
+        self.head = deque()      # decoded objects
+        self.head_size = deque()  # ... and their sizes
+        self.nextseg = 0
+        self.qsize = 0
+        self.fsize = 0
+
+    def size(self):
+        return self.qsize
+
+    def __len__(self):
+        return self.qsize
+
+    def _write_segment(self, objs):
+        path = os.path.join(self.segdir, "%08d" % self.nextseg)
+        self.nextseg += 1
+        size = sum(DbStore._obj_size(obj) for obj in objs)
+        with open(path, "wb") as f:
+            pickle.dump(objs, f, pickle.HIGHEST_PROTOCOL)
+        self.segs.append([path, len(objs), size])
+        self.qsize += len(objs)
+        self.fsize += size
+
+    def _load_segment(self):
+        path, count, _ = self.segs.popleft()
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                # Python 2 cPickle wants a str, Python 3 reads the map in place
+                objs = pickle.loads(mm if PY3 else mm[:])
+            finally:
+                mm.close()
+        self.head.extend(objs)
+        self.head_size.extend(DbStore._obj_size(obj) for obj in objs)
+        self.loaded.append([path, count])
+
+    def put(self, obj):
+        self._write_segment([obj])
+
+    append = put
+
+    def mput(self, objs):
+        objs = list(objs)
+        for i in range(0, len(objs), self.seg_items):
+            self._write_segment(objs[i:i + self.seg_items])
+        self.logger.debug("%s objs spilled to %s" % (len(objs), self.segdir), extra=self.d)
+
+    extend = mput
+
+    def mget(self, n):
+        if n > self.qsize:
+            n = self.qsize
+        while len(self.head) < n and self.segs:
+            self._load_segment()
+        objs = list(islice(self.head, n))
+        size = sum(islice(self.head_size, n))
+        return objs, size
+
+    def first(self):
+        return self.mget(1)
+
+    get = first
+
+    def mdel(self, n, size=0):
+        if n > self.qsize:
+            n = self.qsize
+        while len(self.head) < n and self.segs:
+            self._load_segment()
+        for _ in range(n):
+            self.head.popleft()
+            self.fsize -= self.head_size.popleft()
+            seg = self.loaded[0]
+            seg[1] -= 1
+            if seg[1] == 0:
+                os.remove(seg[0])
+                self.loaded.popleft()
+        self.qsize -= n
+
+    def pop(self):
+        if self.qsize == 0:
+            return None
+        objs, size = self.mget(1)
+        self.mdel(1, size)
+        return objs[0]
+
+    def export(self, dbstore):
+        """ copy the content, oldest first, into "dbstore", segment by segment """
+        if self.head:
+            dbstore.mput(list(self.head))
+        for path, _, _ in self.segs:
+            with open(path, "rb") as f:
+                dbstore.mput(pickle.load(f))
+
+    def cleanup(self):
+        self.segs.clear()
+        self.loaded.clear()
+        self.head.clear()
+        self.head_size.clear()
+        self.qsize = self.fsize = 0
+        # under G.tempdir, which another rank may have removed already
+        shutil.rmtree(self.segdir, ignore_errors=True)
+
+
+def make_store(name, dbname, resume=False):
+    """ the spill store of the work queue, resume always uses a DbStore,
+    fcp syncs its checkpoint table before copying it """
+    if name == "segment" and not resume:
+        return SegStore(dbname)
+    if name not in POLICIES:
+        raise ValueError("Unknown spill backend: %s" % name)
+    return DbStore(dbname, resume=resume, checkpoint=False)
@@ -0,0 +1,147 @@
+from __future__ import absolute_import
+from __future__ import division
+
+import itertools
+
+from pcircle.fdef import ChunkRange
+
+__author__ = 'Feiyi Wang'
+
+"""
+Split policies for Circle.spread_counts().
+
+When a victim has "rcount" pending requestors, a policy decides how many
+items each of them gets. Circle.send_work() takes items from the left end of
+the work queue, requestor by requestor, so the returned sizes map to
+consecutive slices of the queue starting at the left.
+
+    equal - same item count for every requestor and the victim itself
+    half  - give away half of the queue, shared among the requestors
+    bytes - balance FileChunk/ChunkSum lengths instead of item counts
+
+All of them refuse to share a queue shorter than "min_items", so that the
+last item or two don't bounce between idle ranks.
+
+A queue of a few ChunkRanges (see fdef.py) is first cut into more items
+with split_ranges(), so a single large file can still be shared.
+"""
+
+POLICIES = ("equal", "half", "bytes")
+
+
+def distribute(total, rcount):
+    """ spread "total" items over rcount requestors, extras go first """
+    base = total // rcount
+    extra = total - base * rcount
+    sizes = [base] * rcount
+    for i in range(extra):
+        sizes[i] += 1
+    return sizes
+
+
+class EqualSplit(object):
+    name = "equal"
+
+    def __init__(self, min_items=2, min_bytes=0):
+        self.min_items = min_items
+        self.min_bytes = min_bytes
+
+    def spread(self, workq, rcount, wcount=None):
+        if wcount is None:
+            wcount = len(workq)
+        if wcount < self.min_items:
+            return [0] * rcount
+        return self.shares(workq, rcount, wcount)
+
+    def shares(self, workq, rcount, wcount):
+        # leave self a base number of works
+        base = wcount // (rcount + 1)
+        extra = wcount - base * (rcount + 1)
+        assert extra <= rcount
+        sizes = [base] * rcount
+        for i in range(extra):
+            sizes[i] += 1
+        return sizes
+
+
+class HalfSplit(EqualSplit):
+    name = "half"
+
+    def shares(self, workq, rcount, wcount):
+        return distribute(wcount // 2, rcount)
+
+
+def weight(item):
+    """ bytes of work an item represents, 1 for items without a length """
+    length = getattr(item, "length", None)
+    if length is None:
+        return 1
+    return max(length, 1)
+
+
+class ByteSplit(EqualSplit):
+    name = "bytes"
+
+    def shares(self, workq, rcount, wcount):
+        weights = [weight(item) for item in itertools.islice(workq, 0, wcount)]
+        total = sum(weights)
+        if total <= wcount:
+            # nothing carries a length (FileItem, paths ...), count items
+            return EqualSplit.shares(self, workq, rcount, wcount)
+
+        share = total / (rcount + 1)
+        if share < self.min_bytes:
+            # not worth the trip, keep it all
+            return [0] * rcount
+
+        # cut the queue at every multiple of "share", the victim
+        # keeps whatever is left after the last requestor
+        sizes = [0] * rcount
+        idx = 0
+        acc = 0
+        for i in range(rcount):
+            bound = share * (i + 1)
+            start = idx
+            while idx < wcount and acc + weights[idx] / 2.0 <= bound:
+                acc += weights[idx]
+                idx += 1
+            sizes[i] = idx - start
+
+        if idx == wcount and wcount > 0:
+            # never give away the whole queue
+            for i in reversed(range(rcount)):
+                if sizes[i] > 0:
+                    sizes[i] -= 1
+                    break
+        return sizes
+
+
+def split_ranges(workq, target):
+    """ split the largest ChunkRanges of a short queue in two until it
+    has "target" items or nothing is left to split. The upper halves go to
+    the left end, where send_work() takes from. Returns the number of splits.
+    """
+    splits = 0
+    while len(workq) < target:
+        largest = None
+        for item in workq:
+            if isinstance(item, ChunkRange) and \
+                    (largest is None or item.length > largest.length):
+                largest = item
+        upper = largest.split() if largest is not None else None
+        if upper is None:
+            break
+        workq.appendleft(upper)
+        splits += 1
+    return splits
+
+
+def make_split(name, min_items=2, min_bytes=0):
+    if name == "equal":
+        return EqualSplit(min_items, min_bytes)
+    elif name == "half":
+        return HalfSplit(min_items, min_bytes)
+    elif name == "bytes":
+        return ByteSplit(min_items, min_bytes)
+    else:
+        raise NotImplementedError("Unknown split policy: %s" % name)
@@ -0,0 +1,130 @@
+from __future__ import absolute_import
+from __future__ import division
+
+import random
+from mpi4py import MPI
+
+__author__ = 'Feiyi Wang'
+
+"""
+Victim selection for Circle work stealing.
+
+A policy hands out the next rank to ask for work, and is told whether the
+steal was successful, so it can keep per-class success rates:
+
+    next()                - rank to send the next work request to
+    record(rank, success) - outcome of a steal from "rank"
+    stats()               - {class: [attempts, successes]}
+    free()                - release communicators, if any
+
+"random" is the original uniform pick over the whole communicator. "hier"
+splits the communicator by shared-memory node, asks up to "local_tries"
+ranks on the same node first, then falls back to remote ranks until a steal
+succeeds again.
+"""
+
+POLICIES = ("random", "hier")
+
+
+class RandomVictim(object):
+    name = "random"
+
+    def __init__(self, comm):
+        self.rank = comm.Get_rank()
+        self.size = comm.Get_size()
+        self.counts = {"random": [0, 0]}
+
+    def next(self):
+        """ Note next proc could return rank of itself """
+        if self.size == 1:
+            return MPI.PROC_NULL
+        else:
+            return random.randint(0, self.size - 1)
+
+    def klass(self, rank):
+        return "random"
+
+    def record(self, rank, success):
+        cnt = self.counts[self.klass(rank)]
+        cnt[0] += 1
+        if success:
+            cnt[1] += 1
+
+    def stats(self):
+        return self.counts
+
+    def free(self):
+        pass
+
+
+class HierVictim(RandomVictim):
+    name = "hier"
+
+    def __init__(self, comm, local_tries=2):
+        RandomVictim.__init__(self, comm)
+        self.local_tries = local_tries
+        self.tries = 0
+        self.counts = {"local": [0, 0], "remote": [0, 0]}
+
+        try:
+            self.node_comm = comm.Split_type(MPI.COMM_TYPE_SHARED, key=self.rank)
+        except (NotImplementedError, AttributeError):
+            # no MPI-3, fall back on processor name
+            hosts = comm.allgather(MPI.Get_processor_name())
+            color = sorted(set(hosts)).index(hosts[self.rank])
+            self.node_comm = comm.Split(color, self.rank)
+
+        peers = self.node_comm.allgather(self.rank)
+        self.local = [r for r in peers if r != self.rank]
+        self.local_set = set(peers)
+        self.remote_cnt = self.size - len(peers)
+
+    def next(self):
+        if self.size == 1:
+            return MPI.PROC_NULL
+
+        if self.local and (self.tries < self.local_tries or self.remote_cnt == 0):
+            self.tries += 1
+            return random.choice(self.local)
+
+        if self.remote_cnt == 0:
+            return MPI.PROC_NULL
+
+        # pick uniformly among ranks not on this node
+        while True:
+            rank = random.randint(0, self.size - 1)
+            if rank not in self.local_set:
+                return rank
+
+    def klass(self, rank):
+        return "local" if rank in self.local_set else "remote"
+
+    def record(self, rank, success):
+        RandomVictim.record(self, rank, success)
+        if success:
+            # start over with our neighbours
+            self.tries = 0
+
+    def free(self):
+        if self.node_comm != MPI.COMM_NULL:
+            self.node_comm.Free()
+        self.node_comm = MPI.COMM_NULL
+
+
+def make_policy(name, comm, local_tries=2):
+    if name == "random":
+        return RandomVictim(comm)
+    elif name == "hier":
+        return HierVictim(comm, local_tries)
+    else:
+        raise ValueError("Unknown steal policy: %s" % name)
+
+
+def fmt_stats(counts):
+    """ {class: [attempts, successes]} to a one line summary """
+    out = []
+    for k in sorted(counts):
+        attempts, successes = counts[k]
+        rate = 100.0 * successes / attempts if attempts else 0.0
+        out.append("%s %s/%s (%.1f%%)" % (k, successes, attempts, rate))
+    return ", ".join(out)
@@ -1,9 +1,14 @@
 from abc import ABCMeta, abstractmethod
+import time
 
 
 class BaseTask:
     __metaclass__ = ABCMeta
 
+    # Circle calls process_batch() instead of process() for tasks that
+    # set this, the ones with many small work items
+    batchable = False
+
     def __init__(self, circle):
         self.circle = circle
         self.rank = circle.rank
@@ -16,6 +21,22 @@ class BaseTask:
     def process(self):
         pass
 
+    def process_batch(self, max_items, max_seconds):
+        """ process() up to max_items in a row, or until max_seconds
+        passed, without going back to the Circle loop in between.
+        Processes at least one item, returns how many were processed.
+        """
+        circle = self.circle
+        deadline = time.time() + max_seconds
+        n = 0
+        while True:
+            self.process()
+            n += 1
+            # only the in-memory queue, qsize() is too expensive here
+            if n >= max_items or not circle.workq or circle.abort or \
+                    time.time() >= deadline:
+                return n
+
     @abstractmethod
     def reduce_init(self, buf):
         pass
@@ -1,12 +1,18 @@
 __author__ = 'f7b'
 
+import numpy as np
 from mpi4py import MPI
 from pcircle.globals import G, T
 from pcircle.utils import getLogger
+from pcircle import mpihelper
+from pcircle import trace
 
 # module variables
 log = getLogger(__name__)
 
+# termination detectors, see make_term()
+POLICIES = ("token", "wave")
+
 
 def colorstr(c):
     if c == G.BLACK:
@@ -27,7 +33,8 @@ class Token:
         dest: which rank to send token to next
         color: current token color
         proc: current color of process (black, white, terminate)
-        send_req: request associating with pending receive
+        send_req: request associating with pending send
+        recv_req: pre-posted receive for the token from src
         """
         self.circle = circle
 
@@ -44,17 +51,35 @@ class Token:
             self.color = G.WHITE
             self.proc = G.WHITE
         self.send_req = MPI.REQUEST_NULL
+        self.send_buf = np.zeros(1, dtype=np.int64)
+        self.recv_req = mpihelper.PostedRecv(self.comm, np.zeros(1, dtype=np.int64), self.src, T.TOKEN)
 
         self.d = {"rank": "rank %s" % self.rank}
 
+    def work_sent(self, rank):
+        """ we just gave work to "rank" """
+        # for termination detection
+        if (rank < self.rank) or (rank == self.src):
+            self.proc = G.BLACK
+
+    def work_received(self, rank):
+        pass
+
+    def posted(self):
+        """ pre-posted receives an idle rank may wait on """
+        return [self.recv_req]
+
     def check_and_recv(self):
         """ check for token, and receive it if arrived """
 
-        status = MPI.Status()
-        flag = self.comm.Iprobe(self.src, T.TOKEN, status)
-        if flag:
+        if self.recv_req.test():
             self.recv()
 
+    def free(self):
+        """ cancel the pre-posted receive, once the circle is done """
+        if not self.recv_req.cancel():
+            log.warn("token message lost at cancel", extra=self.d)
+
     def issend(self):
         """ send token -- it's important that we use issend here,
         because this way the send won't complete until a matching
@@ -67,7 +92,10 @@ class Token:
         log.debug("token send to rank %s: token_color = %s" %
                           (self.dest, colorstr(self.color)), extra=self.d)
 
-        self.send_req = self.comm.issend(self.color, self.dest, tag=T.TOKEN)
+        self.send_buf[0] = self.color
+        self.send_req = self.comm.Issend(self.send_buf, self.dest, tag=T.TOKEN)
+        if self.circle.tracer:
+            self.circle.tracer.instant(trace.TOKEN_SEND, self.color)
 
         # now we don't have the token
         self.is_local = False
@@ -77,8 +105,11 @@ class Token:
         if self.is_local:
             raise RuntimeError("token_is_local True")
 
-        # this won't block as token is waiting
-        buf = self.comm.recv(source=self.src, tag=T.TOKEN)
+        # the token has landed in the pre-posted buffer
+        buf = int(self.recv_req.buf[0])
+        self.recv_req.restart()
+        if self.circle.tracer:
+            self.circle.tracer.instant(trace.TOKEN_RECV, buf)
 
         # record token is local
         self.is_local = True
@@ -88,7 +119,7 @@ class Token:
         # sent the token to ourself, we just replied above
         # so the send should now complete
         #
-        if self.send_req != MPI.PROC_NULL:
+        if self.send_req != MPI.REQUEST_NULL:
             self.send_req.Wait()
 
         # now send is complete, we can overwrite
@@ -157,3 +188,101 @@ class Token:
         else:
             buf += "send_req: Not NULL"
         return buf
+
+
+class WaveTerm:
+
+    def __init__(self, circle):
+        """ Counting termination, in waves of non-blocking allreduce.
+
+        Every rank counts the work replies it sent with items in them, and
+        the ones it received. An idle rank adds its (sent, received) to
+        the current wave, an MPI Iallreduce on a private communicator,
+        and keeps serving steal requests until the wave completes. The
+        job is done when two waves in a row add up to the same counts
+        with sent == received: nothing was in flight, and no rank got
+        any work between its two contributions.
+
+        A wave costs one allreduce, O(log P), instead of a lap around
+        the ring, and every rank sees the same sums, so all of them
+        decide to terminate on the same wave.
+
+        send_req is kept for the Circle.cleanup() interface, it is
+        always MPI.REQUEST_NULL.
+        """
+        self.circle = circle
+        self.rank = circle.rank
+        self.size = circle.size
+        self.comm = circle.comm.Dup()
+        self.proc = G.WHITE
+        self.sent = 0
+        self.received = 0
+        self.waves = 0
+        self.last = None
+        self.req = MPI.REQUEST_NULL
+        self.wave_start = 0
+        self.send_req = MPI.REQUEST_NULL
+        self.sendbuf = np.zeros(2, dtype=np.int64)
+        self.recvbuf = np.zeros(2, dtype=np.int64)
+
+        self.d = {"rank": "rank %s" % self.rank}
+
+    def work_sent(self, rank):
+        self.sent += 1
+
+    def work_received(self, rank):
+        self.received += 1
+
+    def posted(self):
+        return []
+
+    def check_and_recv(self):
+        pass
+
+    def free(self):
+        if self.req != MPI.REQUEST_NULL:
+            # a collective can't be cancelled, but every rank joins every
+            # wave, so this one completes
+            self.req.Wait()
+        self.comm.Free()
+
+    def check_for_term(self):
+        """ only called when we are idle """
+        if self.proc == G.TERMINATE:
+            return G.TERMINATE
+
+        if self.size == 1:
+            self.proc = G.TERMINATE
+            return G.TERMINATE
+
+        if self.req == MPI.REQUEST_NULL:
+            # join the next wave
+            self.sendbuf[0] = self.sent
+            self.sendbuf[1] = self.received
+            self.req = self.comm.Iallreduce(self.sendbuf, self.recvbuf, op=MPI.SUM)
+            self.wave_start = MPI.Wtime()
+
+        if self.req.Test():
+            self.waves += 1
+            if self.circle.tracer:
+                self.circle.tracer.span(trace.WAVE, self.wave_start, MPI.Wtime(), self.waves)
+            counts = (int(self.recvbuf[0]), int(self.recvbuf[1]))
+            log.debug("wave %s: sent/received = %s" % (self.waves, counts), extra=self.d)
+            if counts[0] == counts[1] and counts == self.last:
+                self.proc = G.TERMINATE
+            self.last = counts
+
+        return self.proc
+
+    def __repr__(self):
+        return "WaveTerm@Rank %s: proc: %s / waves: %s / sent: %s / received: %s" % \
+            (self.rank, colorstr(self.proc), self.waves, self.sent, self.received)
+
+
+def make_term(name, circle):
+    if name == "token":
+        return Token(circle)
+    elif name == "wave":
+        return WaveTerm(circle)
+    else:
+        raise ValueError("Unknown termination detector: %s" % name)
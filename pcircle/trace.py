@@ -0,0 +1,133 @@
+from __future__ import absolute_import
+from __future__ import division
+
+import json
+import numpy as np
+from mpi4py import MPI
+
+__author__ = 'Feiyi Wang'
+
+"""
+Cross-rank event timeline, in Chrome trace format.
+
+With --trace FILE every Circle gets a Tracer: a preallocated per-rank ring
+buffer of (timestamp, duration, event, argument) records. When the ring is
+full the oldest records are overwritten. Circle.finalize() gathers the
+buffers on rank 0, which adds them to FILE; load it in chrome://tracing or
+https://ui.perfetto.dev, one row per rank.
+
+Without --trace, Circle.tracer is None and every call site is a single
+"if self.tracer" test.
+
+Timestamps are MPI.Wtime() relative to a barrier taken when the first
+Tracer was created, good to a few microseconds within a node and to the
+barrier skew across nodes.
+"""
+
+WORK = 0            # task.process / process_batch / I/O completions, arg: items
+IDLE = 1
+STEAL_REQUEST = 2   # arg: victim
+STEAL_REPLY = 3     # arg: items received, 0 for none
+STEAL_SERVED = 4    # arg: items given, 0 for none
+REDUCE = 5
+BARRIER = 6
+TOKEN_SEND = 7      # arg: token color
+TOKEN_RECV = 8
+WAVE = 9            # arg: wave number
+CHECKPOINT = 10
+
+NAMES = ("work", "idle", "steal request", "steal reply", "steal served",
+         "reduce", "barrier", "token send", "token recv", "wave", "checkpoint")
+
+# time zero of the whole run, set by the first Tracer
+_base = None
+
+# trace events gathered so far, rank 0 only
+events = []
+
+
+class Tracer(object):
+
+    def __init__(self, comm, capacity=65536):
+        global _base
+        if _base is None:
+            comm.Barrier()
+            _base = MPI.Wtime()
+        self.comm = comm
+        self.capacity = capacity
+        self.ts = np.zeros(capacity, dtype=np.float64)
+        self.dur = np.zeros(capacity, dtype=np.float64)
+        self.ev = np.zeros(capacity, dtype=np.int16)
+        self.arg = np.zeros(capacity, dtype=np.int64)
+        self.n = 0
+        self.idle_since = None
+
+    def span(self, ev, t0, t1, arg=0):
+        i = self.n % self.capacity
+        self.ts[i] = t0
+        self.dur[i] = t1 - t0
+        self.ev[i] = ev
+        self.arg[i] = arg
+        self.n += 1
+
+    def instant(self, ev, arg=0):
+        self.span(ev, MPI.Wtime(), -1.0, arg)
+
+    def idle(self, t):
+        if self.idle_since is None:
+            self.idle_since = t
+
+    def busy(self, t):
+        """ close the idle span, if any """
+        if self.idle_since is not None:
+            self.span(IDLE, self.idle_since, t)
+            self.idle_since = None
+
+    def records(self):
+        """ (ts, dur, ev, arg) arrays of what is left in the ring, oldest first """
+        if self.n <= self.capacity:
+            idx = np.arange(self.n)
+        else:
+            start = self.n % self.capacity
+            idx = np.concatenate([np.arange(start, self.capacity), np.arange(start)])
+        return self.ts[idx], self.dur[idx], self.ev[idx], self.arg[idx]
+
+    def dropped(self):
+        return max(0, self.n - self.capacity)
+
+
+def chrome_events(phase, rank, host, records, dropped=0):
+    """ Chrome trace events of one rank """
+    out = [{"name": "process_name", "ph": "M", "pid": rank, "tid": 0,
+            "args": {"name": "rank %s (%s)" % (rank, host)}},
+           {"name": "process_sort_index", "ph": "M", "pid": rank, "tid": 0,
+            "args": {"sort_index": rank}}]
+    ts, dur, ev, arg = records
+    for i in range(len(ts)):
+        e = {"name": NAMES[ev[i]], "cat": phase, "pid": rank, "tid": 0,
+             "ts": round((ts[i] - _base) * 1e6, 3), "args": {"n": int(arg[i])}}
+        if dur[i] < 0:
+            e["ph"] = "i"
+            e["s"] = "t"
+        else:
+            e["ph"] = "X"
+            e["dur"] = round(dur[i] * 1e6, 3)
+        out.append(e)
+    if dropped:
+        out.append({"name": "dropped %s events" % dropped, "ph": "i", "s": "p",
+                    "cat": phase, "pid": rank, "tid": 0,
+                    "ts": round((ts[0] - _base) * 1e6, 3) if len(ts) else 0})
+    return out
+
+
+def write_trace(path, phase, tracer, comm):
+    """ collective, gather every rank's ring on rank 0 and rewrite "path"
+    with all the phases traced so far """
+    mine = (MPI.Get_processor_name(), tracer.records(), tracer.dropped())
+    gathered = comm.gather(mine)
+    if comm.Get_rank() != 0:
+        return
+    for rank, (host, records, dropped) in enumerate(gathered):
+        events.extend(chrome_events(phase, rank, host, records, dropped))
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
@@ -1,5 +1,7 @@
+import os
 from task import BaseTask
 from utils import bytes_fmt
+from cio import hash_range
 import hashlib
 from mpi4py import MPI
 import utils
@@ -9,6 +11,9 @@ from globals import G
 from bfsignature import BFsignature
 
 class PVerify(BaseTask):
+    # progress report, see vreduce.py
+    reduce_fields = [("vsize", "sum")]
+
     def __init__(self, circle, fcp, total_chunks, totalsize=0,signature=False):
         BaseTask.__init__(self, circle)
         self.circle = circle
@@ -79,8 +84,8 @@ class PVerify(BaseTask):
         #     self.fd_cache[chunk.filename] = fd
 
         try:
-            fd = open(chunk.filename, "rb")
-        except IOError as e:
+            fd = os.open(chunk.filename, os.O_RDONLY)
+        except OSError as e:
             self.logger.error(e, extra=self.d)
             self.failcnt += 1
             return
@@ -91,8 +96,16 @@ class PVerify(BaseTask):
             #self.circle.Abort(1)
             return
 
-        fd.seek(chunk.offset)
-        digest = hashlib.sha1(fd.read(chunk.length)).hexdigest()
+        m = hashlib.sha1()
+        try:
+            hash_range(fd, chunk.offset, chunk.length, m)
+        except IOError as e:
+            self.logger.error(e, extra=self.d)
+            self.failcnt += 1
+            return
+        finally:
+            os.close(fd)
+        digest = m.hexdigest()
         if digest != chunk.digest:
             self.logger.error("Verification failed for %s \n src-digest: %s\n dst-digest: %s \n"
                               % (chunk.filename, chunk.digest, digest), extra=self.d)
@@ -0,0 +1,65 @@
+from __future__ import absolute_import
+
+from collections import OrderedDict
+import numpy as np
+from mpi4py import MPI
+
+__author__ = 'Feiyi Wang'
+
+"""
+Fixed-schema numeric reductions for Circle progress reports.
+
+A task that sets
+
+    reduce_fields = [("cnt_files", "sum"), ("mem_snapshot", "max"),
+                     ("elapsed", "max", "float64"), ...]
+
+gets its reduce_init() buffer packed into NumPy vectors, one per
+(op, dtype) pair, and reduced with MPI Ireduce to rank 0 while the ranks
+keep working. reduce() is never called, reduce_report() and
+reduce_finish() see a plain dict with the reduced values.
+
+Fields missing from the reduce_init() buffer count as 0.
+"""
+
+OPS = {"sum": MPI.SUM, "max": MPI.MAX, "min": MPI.MIN}
+DTYPES = {"int64": np.int64, "float64": np.float64}
+
+
+class ReduceSchema(object):
+
+    def __init__(self, fields):
+        self.groups = OrderedDict()    # (op, dtype) -> [field names]
+        for field in fields:
+            name, op = field[0], field[1]
+            dtype = field[2] if len(field) > 2 else "int64"
+            if op not in OPS:
+                raise ValueError("Unknown reduce op for %s: %s" % (name, op))
+            if dtype not in DTYPES:
+                raise ValueError("Unknown reduce dtype for %s: %s" % (name, dtype))
+            self.groups.setdefault((op, dtype), []).append(name)
+
+        self.sendbufs = []
+        self.recvbufs = []
+        for (op, dtype), names in self.groups.items():
+            self.sendbufs.append(np.zeros(len(names), dtype=DTYPES[dtype]))
+            self.recvbufs.append(np.zeros(len(names), dtype=DTYPES[dtype]))
+
+    def start(self, comm, buf, root=0):
+        """ pack "buf" and start the reductions, return the requests """
+        reqs = []
+        for idx, ((op, dtype), names) in enumerate(self.groups.items()):
+            send = self.sendbufs[idx]
+            for i, name in enumerate(names):
+                send[i] = buf.get(name, 0)
+            reqs.append(comm.Ireduce(send, self.recvbufs[idx], op=OPS[op], root=root))
+        return reqs
+
+    def result(self):
+        """ the reduced values, meaningful at the root only """
+        out = {}
+        for idx, names in enumerate(self.groups.values()):
+            recv = self.recvbufs[idx]
+            for i, name in enumerate(names):
+                out[name] = recv[i].item()
+        return out
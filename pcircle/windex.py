@@ -0,0 +1,306 @@
+from __future__ import absolute_import
+
+import os
+import json
+import struct
+import time
+import zlib
+import numpy as np
+
+__author__ = 'Feiyi Wang'
+
+"""
+Persistent walk index: what a tree walk found, written so that the next
+fcp, fsum or fprof (--from-index DIR) can start from it instead of walking
+the tree again. fwalk --index DIR writes one.
+
+DIR holds a shard per rank of the walk and a manifest:
+
+    DIR/shard.<rank>      blocks of records, appended as the walk goes
+    DIR/manifest.json     written by rank 0 once every shard is complete
+
+A block is a little-endian header followed by columns of "nrec" entries,
+every section starting on an 8 byte boundary:
+
+    header      "<4sIQ"   magic b"PCIB", nrec, paths_len
+    st_mode     uint32    file type (S_IFMT bits) and permissions
+    st_uid      uint32
+    st_gid      uint32
+    st_nlink    uint32
+    st_size     int64
+    st_blocks   int64     512 byte blocks, for the sparse file checks
+    st_mtime    int64     nanoseconds
+    st_ctime    int64     nanoseconds
+    st_ino      uint64
+    path_end    uint64    end offset of every path in the paths section
+    paths       paths_len bytes of UTF-8 (surrogateescape), zero padded
+
+The manifest (JSON) names the shards and where their blocks start:
+
+    {"format": "pcircle-walk-index", "version": 2, "created": ...,
+     "src": [root paths], "ranks": N,
+     "records": ..., "files": ..., "dirs": ..., "bytes": ...,
+     "shards": [{"file": "shard.0", "records": n,
+                 "blocks": [[offset, nrec], ...]}, ...]}
+
+The records of all the shards, in manifest order, are spread evenly over
+the ranks of the reading job (assign()), whatever the number of ranks that
+wrote them, each rank reading only the blocks of its share.
+
+Version 2 added st_ctime, for the incremental walk (rewalk.py).
+"""
+
+FORMAT = "pcircle-walk-index"
+VERSION = 2
+MAGIC = b"PCIB"
+HEADER = struct.Struct("<4sIQ")
+MANIFEST = "manifest.json"
+BLOCK_RECORDS = 65536
+
+COLUMNS = (("st_mode", np.uint32), ("st_uid", np.uint32), ("st_gid", np.uint32),
+           ("st_nlink", np.uint32), ("st_size", np.int64), ("st_blocks", np.int64),
+           ("st_mtime", np.int64), ("st_ctime", np.int64), ("st_ino", np.uint64),
+           ("path_end", np.uint64))
+
+_PY2 = str is bytes
+_S_IFMT = 0o170000
+_S_IFREG = 0o100000
+_S_IFDIR = 0o040000
+
+
+def _to_bytes(s):
+    if _PY2 or isinstance(s, bytes):
+        return s
+    return s.encode("utf-8", "surrogateescape")
+
+
+def _from_bytes(b):
+    if _PY2:
+        return b
+    return b.decode("utf-8", "surrogateescape")
+
+
+def _pad(n):
+    return -n % 8
+
+
+def shard_name(rank):
+    return "shard.%s" % rank
+
+
+def mtime_ns(st):
+    ns = getattr(st, "st_mtime_ns", None)
+    return int(st.st_mtime * 1e9) if ns is None else ns
+
+
+def ctime_ns(st):
+    ns = getattr(st, "st_ctime_ns", None)
+    return int(st.st_ctime * 1e9) if ns is None else ns
+
+
+def owner(path, size):
+    """ the rank, out of "size", that adds up what is known about "path",
+    the same in every process (unlike hash()) """
+    return (zlib.crc32(_to_bytes(path)) & 0xffffffff) % size
+
+
+class IndexStat(object):
+    """ the os.stat_result fields kept in the index """
+    __slots__ = ("st_mode", "st_uid", "st_gid", "st_nlink", "st_size",
+                 "st_blocks", "st_mtime_ns", "st_ctime_ns", "st_ino")
+
+    def __init__(self, st_mode, st_uid, st_gid, st_nlink, st_size, st_blocks,
+                 st_mtime_ns, st_ctime_ns, st_ino):
+        self.st_mode = st_mode
+        self.st_uid = st_uid
+        self.st_gid = st_gid
+        self.st_nlink = st_nlink
+        self.st_size = st_size
+        self.st_blocks = st_blocks
+        self.st_mtime_ns = st_mtime_ns
+        self.st_ctime_ns = st_ctime_ns
+        self.st_ino = st_ino
+
+    @property
+    def st_mtime(self):
+        return self.st_mtime_ns / 1e9
+
+    @property
+    def st_ctime(self):
+        return self.st_ctime_ns / 1e9
+
+    def __repr__(self):
+        return "IndexStat(mode=%o, size=%s, ino=%s)" % (self.st_mode, self.st_size, self.st_ino)
+
+
+def encode_block(paths, rows):
+    """ "rows" is a list of tuples, one value per column but path_end.
+    There are four 4 byte columns, so the 8 byte ones stay aligned """
+    blob = b"".join(paths)
+    out = [HEADER.pack(MAGIC, len(paths), len(blob))]
+    for i, (name, dtype) in enumerate(COLUMNS[:-1]):
+        out.append(np.array([r[i] for r in rows], dtype=dtype).tobytes())
+    out.append(np.cumsum([len(p) for p in paths], dtype=np.uint64).tobytes())
+    out.append(blob)
+    out.append(b"\0" * _pad(len(blob)))
+    return b"".join(out)
+
+
+def decode_block(buf, offset=0):
+    """ (columns, paths) of the block at "offset" of "buf", columns is a
+    dict of numpy arrays """
+    magic, nrec, paths_len = HEADER.unpack_from(buf, offset)
+    if magic != MAGIC:
+        raise ValueError("Not a walk index block at %s" % offset)
+    pos = offset + HEADER.size
+    cols = {}
+    for name, dtype in COLUMNS:
+        cols[name] = np.frombuffer(buf, dtype=dtype, count=nrec, offset=pos)
+        pos += nrec * np.dtype(dtype).itemsize
+    blob = bytes(buf[pos:pos + paths_len])
+    ends = cols["path_end"].tolist()
+    starts = [0] + ends[:-1]
+    paths = [_from_bytes(blob[s:e]) for s, e in zip(starts, ends)]
+    return cols, paths
+
+
+def block_size(nrec, paths_len):
+    width = sum(np.dtype(dtype).itemsize for _, dtype in COLUMNS)
+    return HEADER.size + nrec * width + paths_len + _pad(paths_len)
+
+
+class IndexWriter(object):
+    """ the shard of one rank, add() every lstat() result of the walk """
+
+    def __init__(self, index_dir, rank):
+        if not os.path.exists(index_dir):
+            try:
+                os.makedirs(index_dir)
+            except OSError:
+                pass    # another rank made it
+        if rank == 0 and os.path.exists(os.path.join(index_dir, MANIFEST)):
+            # the shards are being rewritten, the old manifest is no good
+            os.remove(os.path.join(index_dir, MANIFEST))
+        self.path = os.path.join(index_dir, shard_name(rank))
+        self.f = open(self.path, "wb")
+        self.paths = []
+        self.rows = []
+        self.blocks = []    # [offset, nrec]
+        self.offset = 0
+        self.records = self.files = self.dirs = self.bytes = 0
+
+    def add(self, path, st):
+        self.paths.append(_to_bytes(path))
+        self.rows.append((st.st_mode, st.st_uid, st.st_gid, st.st_nlink, st.st_size,
+                          getattr(st, "st_blocks", 0), mtime_ns(st), ctime_ns(st), st.st_ino))
+        kind = st.st_mode & _S_IFMT
+        if kind == _S_IFREG:
+            self.files += 1
+            self.bytes += st.st_size
+        elif kind == _S_IFDIR:
+            self.dirs += 1
+        if len(self.paths) >= BLOCK_RECORDS:
+            self.flush()
+
+    def flush(self):
+        if not self.paths:
+            return
+        buf = encode_block(self.paths, self.rows)
+        self.f.write(buf)
+        self.blocks.append([self.offset, len(self.paths)])
+        self.offset += len(buf)
+        self.records += len(self.paths)
+        self.paths = []
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        self.f.close()
+
+    def summary(self):
+        return {"file": os.path.basename(self.path), "records": self.records,
+                "blocks": self.blocks, "files": self.files, "dirs": self.dirs,
+                "bytes": self.bytes}
+
+
+def finish(writer, comm, src, extra=None):
+    """ collective, close every shard and have rank 0 write the manifest
+    of the roots "src", with the items of "extra" (from rank 0) added """
+    writer.close()
+    shards = comm.gather(writer.summary())
+    if comm.Get_rank() == 0:
+        manifest = {"format": FORMAT, "version": VERSION, "created": time.time(),
+                    "src": list(src), "ranks": comm.Get_size(),
+                    "records": sum(s["records"] for s in shards),
+                    "files": sum(s.pop("files") for s in shards),
+                    "dirs": sum(s.pop("dirs") for s in shards),
+                    "bytes": sum(s.pop("bytes") for s in shards),
+                    "shards": shards}
+        manifest.update(extra or {})
+        index_dir = os.path.dirname(writer.path)
+        tmp = os.path.join(index_dir, MANIFEST + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(manifest, f, indent=1)
+            f.write("\n")
+        os.rename(tmp, os.path.join(index_dir, MANIFEST))
+    comm.Barrier()
+
+
+def read_manifest(index_dir, src=None):
+    """ the manifest of "index_dir", ValueError if there is none, or it
+    wasn't written for the roots "src" """
+    path = os.path.join(index_dir, MANIFEST)
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (IOError, OSError, ValueError) as e:
+        raise ValueError("no walk index in %s: %s" % (index_dir, e))
+    if manifest.get("format") != FORMAT or manifest.get("version") != VERSION:
+        raise ValueError("%s: unknown walk index format" % path)
+    if src is not None and sorted(manifest["src"]) != sorted(src):
+        raise ValueError("walk index of %s, not %s" % (
+            ", ".join(manifest["src"]), ", ".join(src)))
+    manifest["dir"] = index_dir
+    return manifest
+
+
+def assign(manifest, rank, size):
+    """ [(shard file, offset, nrec, lo, hi)], the blocks holding the share of
+    "rank" out of "size", records lo to hi of each """
+    total = manifest["records"]
+    lo, hi = total * rank // size, total * (rank + 1) // size
+    out = []
+    base = 0
+    for shard in manifest["shards"]:
+        for offset, nrec in shard["blocks"]:
+            a, b = max(lo, base), min(hi, base + nrec)
+            if a < b:
+                out.append((shard["file"], offset, nrec, a - base, b - base))
+            base += nrec
+    return out
+
+
+def load(manifest, rank, size, kinds=None):
+    """ (path, IndexStat) of the share of "rank", "kinds" keeps only the
+    records whose file type (S_IFMT bits) is in it """
+    index_dir = manifest["dir"]
+    f = None
+    fname = None
+    for name, offset, nrec, lo, hi in assign(manifest, rank, size):
+        if name != fname:
+            if f:
+                f.close()
+            f = open(os.path.join(index_dir, name), "rb")
+            fname = name
+        f.seek(offset)
+        magic, _, paths_len = HEADER.unpack(f.read(HEADER.size))
+        f.seek(offset)
+        buf = f.read(block_size(nrec, paths_len))
+        cols, paths = decode_block(buf)
+        rows = zip(*[cols[name][lo:hi].tolist() for name, _ in COLUMNS[:-1]])
+        for path, row in zip(paths[lo:hi], rows):
+            if kinds is not None and row[0] & _S_IFMT not in kinds:
+                continue
+            yield path, IndexStat(*row)
+    if f:
+        f.close()
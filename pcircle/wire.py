@@ -0,0 +1,296 @@
+from __future__ import absolute_import
+
+import struct
+import numpy as np
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from pcircle.globals import G
+from pcircle.fdef import FileItem, FileChunk, ChunkSum, ChunkRange
+from pcircle.filetable import table
+
+__author__ = 'Feiyi Wang'
+
+"""
+Compact wire format for work-steal replies.
+
+A work reply used to be a pickled {G.KEY: count, G.VAL: [items]} dictionary,
+which carries full src/dest path strings (and the "cmd" string) for every
+single chunk. Here a batch of homogeneous work items is laid out as:
+
+    header  | kind, nitems, nstrings, nfiles, strtab_len (see HEADER below)
+    strtab  | NUL separated unique strings, padded to 8 bytes
+    columns | one numpy array per field, nitems entries each
+    files   | file table entries, one numpy array per FILE_FIELDS, nfiles each
+
+String fields are stored as uint32 indexes into the string table, integer
+fields are packed int64 arrays and digests fixed 20 byte columns.
+
+FileChunk, ChunkSum and ChunkRange only carry a file id (see filetable.py). The file
+table entries the thief hasn't seen yet travel along in the "files"
+section; mark_sent() records that it has them once the reply is sent.
+
+Anything we don't have a schema for (or a batch of mixed types) falls back
+to a pickled (items, files) tuple, and the no-work/abort replies are
+header-only messages.
+
+    encode_work(items, peer) - batch of work items to bytes
+    mark_sent(items, peer)   - "peer" got the file entries of "items"
+    encode_ctrl(code)        - G.ZERO or G.ABORT reply to bytes
+    decode(buf, peer)        - back to {G.KEY: ..., G.VAL: [...]}
+"""
+
+HEADER = struct.Struct("<BxxxIIIQ")
+
+KIND_NOWORK = 0
+KIND_ABORT = 1
+KIND_PICKLE = 2
+KIND_CHUNK = 3
+KIND_CHUNKSUM = 4
+KIND_FILEITEM = 5
+KIND_PATH = 6
+KIND_RANGE = 7
+
+STR = "str"
+I64 = "i64"
+DIGEST = "digest"
+
+DIGEST_LEN = 20     # sha1, an all zero digest decodes as ""
+
+NONE_IDX = 0xFFFFFFFF
+
+# kind -> (class, ((attr, type), ...))
+SCHEMAS = {
+    KIND_CHUNK: (FileChunk, (("fid", I64), ("offset", I64), ("length", I64))),
+    KIND_CHUNKSUM: (ChunkSum, (("fid", I64), ("bdigest", DIGEST),
+                               ("offset", I64), ("length", I64), ("side", I64))),
+    KIND_FILEITEM: (FileItem, (("path", STR), ("dirname", STR),
+                               ("st_mode", I64), ("st_size", I64),
+                               ("st_uid", I64), ("st_gid", I64))),
+    KIND_RANGE: (ChunkRange, (("fid", I64), ("start", I64), ("end", I64),
+                              ("chunksize", I64), ("kind", I64))),
+}
+
+CLASS_KINDS = dict((cls, kind) for kind, (cls, _) in SCHEMAS.items())
+
+# the file table entries that go with items of these classes
+FILE_CLASSES = (FileChunk, ChunkSum, ChunkRange)
+FILE_FIELDS = (("fid", I64), ("size", I64), ("mode", I64), ("src", STR), ("dest", STR))
+
+_PY2 = str is bytes
+
+
+def _to_bytes(s):
+    if isinstance(s, bytes):
+        return s
+    return s.encode("utf-8", "surrogateescape")
+
+
+def _from_bytes(b):
+    if _PY2:
+        return b
+    return b.decode("utf-8", "surrogateescape")
+
+
+def _pad8(n):
+    return (8 - n % 8) % 8
+
+
+class StringTable(object):
+    """ unique strings of a batch, in order of first appearance """
+
+    def __init__(self):
+        self.index = {}
+        self.strings = []
+
+    def add(self, s):
+        if s is None:
+            return NONE_IDX
+        if not isinstance(s, (str, bytes)):
+            raise TypeError("not a string: %r" % s)
+        idx = self.index.get(s)
+        if idx is None:
+            idx = len(self.strings)
+            self.index[s] = idx
+            self.strings.append(s)
+        return idx
+
+    def pack(self):
+        buf = b"\0".join(_to_bytes(s) for s in self.strings)
+        return buf + b"\0" * _pad8(len(buf))
+
+
+def _pack(kind, nitems, strtab, columns, nfiles=0):
+    strbuf = strtab.pack() if strtab else b""
+    nstrings = len(strtab.strings) if strtab else 0
+    parts = [HEADER.pack(kind, nitems, nstrings, nfiles, len(strbuf)), strbuf]
+    parts.extend(col.tobytes() for col in columns)
+    return b"".join(parts)
+
+
+def _batch_kind(items):
+    """ return the schema kind if all items share one, else None """
+    first = type(items[0])
+    if first is str or first is bytes:
+        kind = KIND_PATH
+    else:
+        kind = CLASS_KINDS.get(first)
+    if kind is None:
+        return None
+    for item in items:
+        if type(item) is not first:
+            return None
+    return kind
+
+
+def _item_fids(items):
+    return [item.fid for item in items if isinstance(item, FILE_CLASSES)]
+
+
+def _column(values, ftype, strtab):
+    if ftype == STR:
+        return np.array([strtab.add(v) for v in values], dtype=np.uint32)
+    elif ftype == DIGEST:
+        col = np.zeros((len(values), DIGEST_LEN), dtype=np.uint8)
+        for i, v in enumerate(values):
+            if v:
+                col[i] = np.frombuffer(v, dtype=np.uint8, count=DIGEST_LEN)
+        return col
+    return np.array(values, dtype=np.int64)
+
+
+def _encode_paths(items):
+    strtab = StringTable()
+    idx = np.array([strtab.add(p) for p in items], dtype=np.uint32)
+    return _pack(KIND_PATH, len(items), strtab, [idx])
+
+
+def _encode_schema(kind, items, files):
+    _, fields = SCHEMAS[kind]
+    strtab = StringTable()
+    columns = []
+    for attr, ftype in fields:
+        columns.append(_column([getattr(item, attr) for item in items], ftype, strtab))
+    for attr, ftype in FILE_FIELDS:
+        values = [fid if attr == "fid" else getattr(e, attr) for fid, e in files]
+        columns.append(_column(values, ftype, strtab))
+    return _pack(kind, len(items), strtab, columns, len(files))
+
+
+def encode_pickle(items, files=()):
+    records = [(fid, e.src, e.dest, e.size, e.mode) for fid, e in files]
+    data = pickle.dumps((items, records), pickle.HIGHEST_PROTOCOL)
+    return HEADER.pack(KIND_PICKLE, len(items), 0, len(records), 0) + data
+
+
+def encode_work(items, peer=None):
+    """ encode a list of work items for "peer", fall back to pickle when
+    we can't. The file entries peer hasn't seen go along, all of them for
+    peer None """
+    items = list(items)
+    if not items:
+        return encode_ctrl(G.ZERO)
+
+    files = table.unseen(_item_fids(items), peer)
+    kind = _batch_kind(items)
+    if kind is None:
+        return encode_pickle(items, files)
+
+    try:
+        if kind == KIND_PATH:
+            return _encode_paths(items)
+        return _encode_schema(kind, items, files)
+    except (TypeError, ValueError, OverflowError, AttributeError):
+        # odd field values (non-integer sizes, non-string paths ...)
+        return encode_pickle(items, files)
+
+
+def mark_sent(items, peer):
+    """ the reply encoded for "peer" is on its way """
+    table.mark(_item_fids(items), peer)
+
+
+def encode_ctrl(code):
+    kind = KIND_ABORT if code == G.ABORT else KIND_NOWORK
+    return HEADER.pack(kind, 0, 0, 0, 0)
+
+
+def _unpack_strings(buf, offset, nstrings, strlen):
+    if nstrings == 0:
+        return []
+    raw = bytes(buf[offset:offset + strlen]).rstrip(b"\0")
+    strings = raw.split(b"\0")
+    # an empty string at the tail of the table is eaten by rstrip()
+    strings.extend([b""] * (nstrings - len(strings)))
+    return [_from_bytes(s) for s in strings]
+
+
+def _lookup(strings, idx):
+    return None if idx == NONE_IDX else strings[idx]
+
+
+def _unpack_columns(buf, offset, count, fields, strings):
+    """ return the list of columns, and the offset past them """
+    columns = []
+    for attr, ftype in fields:
+        if ftype == DIGEST:
+            col = np.frombuffer(buf, dtype=np.uint8, count=count * DIGEST_LEN, offset=offset)
+            offset += col.nbytes
+            col = col.reshape(count, DIGEST_LEN)
+            columns.append([row.tobytes() if row.any() else b"" for row in col])
+            continue
+        dtype = np.uint32 if ftype == STR else np.int64
+        col = np.frombuffer(buf, dtype=dtype, count=count, offset=offset)
+        offset += col.nbytes
+        if ftype == STR:
+            columns.append([_lookup(strings, i) for i in col.tolist()])
+        else:
+            columns.append(col.tolist())
+    return columns, offset
+
+
+def decode(buf, peer=None):
+    """ decode a work reply from "peer", return the same dict the pickled
+    reply had. File entries that came along go to the file table """
+    kind, nitems, nstrings, nfiles, strlen = HEADER.unpack_from(buf, 0)
+    offset = HEADER.size
+
+    if kind == KIND_NOWORK:
+        return {G.KEY: G.ZERO}
+    elif kind == KIND_ABORT:
+        return {G.KEY: G.ABORT}
+    elif kind == KIND_PICKLE:
+        items, records = pickle.loads(bytes(buf[offset:]))
+        table.merge(records, peer)
+        return {G.KEY: len(items), G.VAL: items}
+
+    strings = _unpack_strings(buf, offset, nstrings, strlen)
+    offset += strlen
+
+    if kind == KIND_PATH:
+        idx = np.frombuffer(buf, dtype=np.uint32, count=nitems, offset=offset)
+        items = [strings[i] for i in idx.tolist()]
+        return {G.KEY: nitems, G.VAL: items}
+
+    if kind not in SCHEMAS:
+        raise ValueError("Unknown work reply kind: %s" % kind)
+
+    cls, fields = SCHEMAS[kind]
+    columns, offset = _unpack_columns(buf, offset, nitems, fields, strings)
+    if nfiles:
+        files, _ = _unpack_columns(buf, offset, nfiles, FILE_FIELDS, strings)
+        fid, size, mode, src, dest = files
+        table.merge(zip(fid, src, dest, size, mode), peer)
+
+    attrs = [attr for attr, _ in fields]
+    items = []
+    for values in zip(*columns):
+        item = cls.__new__(cls)
+        for attr, value in zip(attrs, values):
+            setattr(item, attr, value)
+        items.append(item)
+
+    return {G.KEY: nitems, G.VAL: items}
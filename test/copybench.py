@@ -0,0 +1,97 @@
+from __future__ import print_function
+
+__author__ = 'f7b'
+
+"""
+The fcp copy engines, GB/s and CPU seconds per GB.
+
+    python test/copybench.py [size MiB] [chunk MiB] [tmpdir] [destdir] [depth]
+
+Writes a file of "size" MiB of random data to tmpdir, and copies it to
+destdir (tmpdir by default) a chunk at a time, the way FCP.copy_bytes()
+does, with every engine of copyengine.py, then read/write with and
+without the sha1 of --verify, in sequence and in a pipeline of "depth"
+blocks (4 by default). Every copy runs twice and the second counts: the
+source is in the page cache then, this is about the cost of moving bytes,
+not that of the disk. CPU is user + system time of this process.
+
+A destdir on another file system shows the fallback when the kernel
+refuses to copy_file_range() across file systems (EXDEV).
+"""
+
+import os
+import sys
+import time
+import hashlib
+import tempfile
+
+from pcircle import copyengine
+
+MiB = 1024 * 1024
+
+
+def make_source(path, size):
+    block = os.urandom(MiB)
+    with open(path, "wb") as f:
+        for _ in range(size):
+            f.write(block)
+
+
+def copy(engine, src, dest, size, chunk, verify):
+    rfd = os.open(src, os.O_RDONLY)
+    wfd = os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+    try:
+        for offset in range(0, size, chunk):
+            m = hashlib.sha1() if verify else None
+            engine.copy(rfd, wfd, offset, min(chunk, size - offset), m)
+    finally:
+        os.close(rfd)
+        os.close(wfd)
+
+
+def measure(engine, src, dest, size, chunk, verify):
+    for _ in range(2):
+        t0, c0 = time.time(), os.times()
+        copy(engine, src, dest, size, chunk, verify)
+        t1, c1 = time.time(), os.times()
+    cpu = (c1[0] - c0[0]) + (c1[1] - c0[1])
+    return t1 - t0, cpu
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1024
+    chunk = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    tmpdir = sys.argv[3] if len(sys.argv) > 3 else None
+    destdir = sys.argv[4] if len(sys.argv) > 4 else tmpdir
+    depth = int(sys.argv[5]) if len(sys.argv) > 5 else 4
+
+    fd, src = tempfile.mkstemp(prefix="copybench.", dir=tmpdir)
+    os.close(fd)
+    fd, dest = tempfile.mkstemp(prefix="copybench.", dir=destdir)
+    os.close(fd)
+    nbytes = size * MiB
+    gb = nbytes / 1e9
+    try:
+        make_source(src, size)
+        print("%s MiB, %s MiB chunks\n" % (size, chunk))
+        print("{:<20}{:<24}{:>10}{:>10}{:>12}".format("engine", "does", "seconds", "GB/s", "CPU s/GB"))
+        runs = [("kernel", 0, False)]
+        runs += [("readwrite", d, v) for v in (False, True) for d in (0, depth)]
+        for name, d, verify in runs:
+            engine = copyengine.make_engine(name, depth=d)
+            try:
+                elapsed, cpu = measure(engine, src, dest, nbytes, chunk * MiB, verify)
+            finally:
+                engine.close()
+            if os.path.getsize(dest) != nbytes:
+                print("%s: copied %s bytes of %s" % (name, os.path.getsize(dest), nbytes))
+            label = name + (" + sha1" if verify else "")
+            print("{:<20}{:<24}{:>10.3f}{:>10.2f}{:>12.3f}".format(
+                label, engine.describe(), elapsed, gb / elapsed, cpu / gb))
+    finally:
+        os.unlink(src)
+        os.unlink(dest)
+
+
+if __name__ == "__main__":
+    main()
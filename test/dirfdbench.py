@@ -0,0 +1,110 @@
+from __future__ import print_function
+
+__author__ = 'f7b'
+
+"""
+The tree walkers with and without --dirfd, timed on a deep tree.
+
+    python test/dirfdbench.py [depth] [width] [files] [tmpdir]
+
+Makes a tree under tmpdir: "width" chains of directories "depth" levels
+deep, with "files" files in every directory. Then walks it with FWalk
+and ProfileWalk in this one process, a plain list standing in for the
+Circle work queue, once with full paths and once with --dirfd, and
+reports the time, the entries per second and the directories --dirfd
+had to open. Run it twice, or on a cold cache (drop_caches), on the
+file system that matters: on a local disk the path lookups are cheap
+and mostly hit the dentry cache, on Lustre and NFS they are not.
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+from mpi4py import MPI
+
+from pcircle import dirfd
+from pcircle import fwalk
+from pcircle import fprof
+from pcircle.globals import G
+from pcircle.utils import check_src
+
+
+class Queue(object):
+    """ stands in for the Circle, rank 0 of 1 """
+    rank = 0
+    size = 1
+    comm = MPI.COMM_WORLD
+
+    def __init__(self):
+        self.q = []
+
+    def enq(self, work):
+        self.q.append(work)
+
+    preq = enq
+
+    def deq(self):
+        return self.q.pop()
+
+
+def make_tree(top, depth, width, files):
+    src = os.path.join(top, "src")
+    os.mkdir(src)
+    for w in range(width):
+        path = src
+        for d in range(depth):
+            path = os.path.join(path, "d%s.%s" % (w, d))
+            os.mkdir(path)
+            for f in range(files):
+                open(os.path.join(path, "f%s" % f), "w").close()
+    return src, 1 + depth * width * (1 + files)
+
+
+def walk(kind, src):
+    circle = Queue()
+    if kind == "fprof":
+        fprof.args = fprof.gen_parser().parse_args([src])
+        task = fprof.ProfileWalk(circle, [src], perfile=False)
+    else:
+        task = fwalk.FWalk(circle, check_src([src]))
+    t = time.time()
+    task.create()
+    while circle.q:
+        task.process()
+    elapsed = time.time() - t
+    opens = sum(c.opens for c in dirfd._caches)
+    dirfd.close_all()
+    return elapsed, opens
+
+
+def main():
+    depth = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    width = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    files = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    tmpdir = sys.argv[4] if len(sys.argv) > 4 else None
+
+    if not dirfd.available():
+        print("--dirfd needs Python 3")
+        sys.exit(1)
+
+    top = tempfile.mkdtemp(prefix="dirfdbench.", dir=tmpdir)
+    try:
+        src, entries = make_tree(top, depth, width, files)
+        print("%s entries, %s directories, %s deep\n" % (entries, depth * width + 1, depth))
+        print("{:<8}{:<8}{:>10}{:>14}{:>10}".format("", "", "seconds", "entries/s", "opens"))
+        for kind in ("fwalk", "fprof"):
+            for mode in (False, True):
+                G.dirfd = mode
+                elapsed, opens = walk(kind, src)
+                print("{:<8}{:<8}{:>10.3f}{:>14.0f}{:>10}".format(
+                    kind, "dirfd" if mode else "paths", elapsed, entries / elapsed,
+                    opens if mode else ""))
+    finally:
+        G.dirfd = False
+        shutil.rmtree(top)
+
+
+if __name__ == "__main__":
+    main()
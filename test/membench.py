@@ -0,0 +1,82 @@
+from __future__ import print_function
+
+__author__ = 'f7b'
+
+"""
+Memory per file of the tree walk results, replaces memtest.py.
+
+    python test/membench.py [list|filelist|all] [files] [files per dir]
+
+"list" is FWalk.flist as it used to be, a list of FileItem, "filelist"
+the columnar FileList (see pcircle/filelist.py). Paths are made up like a
+real tree: a common prefix, a few levels of directories, 16-32 character
+hex names. Reported are bytes per file and the time to build and iterate.
+
+With Python 3 the allocations are traced (tracemalloc), Python 2 reports
+the growth of the peak RSS, so run one representation per process there.
+"""
+
+import random
+import sys
+import time
+import resource
+
+from pcircle.fdef import FileItem
+from pcircle.filelist import FileList
+from pcircle.utils import bytes_fmt
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def paths(n, per_dir):
+    rnd = random.Random(42)
+    for i in range(n):
+        d = i // per_dir
+        size = rnd.randint(16, 32)
+        name = "%0*x" % (size, rnd.getrandbits(4 * size))
+        yield "/the/common/path/we/have/%d/%d/%s" % (d // 100, d, name)
+
+
+def build(kind, n, per_dir):
+    if kind == "list":
+        flist = []
+    else:
+        flist = FileList()
+    for i, path in enumerate(paths(n, per_dir)):
+        flist.append(FileItem(path, 0o100644, i * 4096, 1000, 1000))
+    return flist
+
+
+def measure(kind, n, per_dir):
+    if tracemalloc:
+        tracemalloc.start()
+    rss0 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    t0 = time.time()
+    flist = build(kind, n, per_dir)
+    t1 = time.time()
+    if tracemalloc:
+        used = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+    else:
+        used = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 - rss0
+    total = 0
+    for fi in flist:
+        total += fi.st_size
+    t2 = time.time()
+    print("%-8s: %d files, %s, %.1f bytes/file, build %.2fs, iterate %.2fs" %
+          (kind, n, bytes_fmt(used), used / float(n), t1 - t0, t2 - t1))
+    del flist
+
+
+if len(sys.argv) < 2 or sys.argv[1] not in ("list", "filelist", "all"):
+    print("membench [list|filelist|all] [files] [files per dir]")
+    sys.exit(0)
+
+kinds = ("list", "filelist") if sys.argv[1] == "all" else (sys.argv[1],)
+n = int(sys.argv[2]) if len(sys.argv) > 2 else 10 ** 6
+per_dir = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+for kind in kinds:
+    measure(kind, n, per_dir)
@@ -0,0 +1,125 @@
+from __future__ import print_function
+
+__author__ = 'f7b'
+
+"""
+Message rate micro-benchmark for the Circle work-request / reply pattern.
+
+    mpirun -np 8 python test/msgbench.py [probe|posted] [rounds] [reply bytes]
+
+Every rank sends "rounds" requests to random peers, one outstanding at a
+time, and answers the requests of everyone else with a reply of the
+given size, a stand-in for a work reply:
+
+    probe  - Iprobe + pickled recv/send, how Circle used to do it
+    posted - pre-posted persistent receives + Isend, see mpihelper.PostedRecv
+
+Above the MPI eager limit the probe mode deadlocks as soon as two ranks
+answer each other at the same time; that is expected, it is one of the
+reasons Circle moved to posted receives.
+
+Reports messages (requests + replies) handled per second per rank.
+"""
+
+import random
+import sys
+import numpy as np
+from mpi4py import MPI
+from pcircle.mpihelper import PostedRecv, SendQueue
+
+TAG_REQ = 1
+TAG_REP = 2
+
+comm = MPI.COMM_WORLD
+rank = comm.Get_rank()
+size = comm.Get_size()
+
+if len(sys.argv) < 2 or sys.argv[1] not in ("probe", "posted"):
+    if rank == 0:
+        print("msgbench [probe|posted] [rounds] [reply bytes]")
+    sys.exit(0)
+
+mode = sys.argv[1]
+rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+nbytes = int(sys.argv[3]) if len(sys.argv) > 3 else 1024
+payload = bytearray(nbytes)
+
+
+def peer():
+    dest = random.randint(0, size - 2)
+    return dest + 1 if dest >= rank else dest
+
+
+def run_probe():
+    handled = 0
+    sent = 0
+    outstanding = False
+    barrier = None
+    while True:
+        st = MPI.Status()
+        while comm.Iprobe(source=MPI.ANY_SOURCE, tag=TAG_REQ, status=st):
+            src = st.Get_source()
+            comm.recv(source=src, tag=TAG_REQ)
+            comm.send(bytes(payload), dest=src, tag=TAG_REP)
+            handled += 1
+        if outstanding:
+            if comm.Iprobe(source=MPI.ANY_SOURCE, tag=TAG_REP):
+                comm.recv(source=MPI.ANY_SOURCE, tag=TAG_REP)
+                outstanding = False
+                handled += 1
+        elif sent < rounds:
+            comm.send(rank, dest=peer(), tag=TAG_REQ)
+            outstanding = True
+            sent += 1
+        elif barrier is None:
+            barrier = comm.Ibarrier()
+        elif barrier.Test():
+            return handled
+
+
+def run_posted():
+    handled = 0
+    sent = 0
+    outstanding = False
+    barrier = None
+    sends = SendQueue()
+    req = PostedRecv(comm, np.zeros(1, dtype=np.int64), MPI.ANY_SOURCE, TAG_REQ)
+    rep = PostedRecv(comm, bytearray(nbytes), MPI.ANY_SOURCE, TAG_REP)
+    reqbuf = np.array([rank], dtype=np.int64)
+    while True:
+        sends.progress()
+        while req.test():
+            src = req.status.Get_source()
+            req.restart()
+            sends.post(comm.Isend(payload, dest=src, tag=TAG_REP), payload)
+            handled += 1
+        if outstanding:
+            if rep.test():
+                rep.restart()
+                outstanding = False
+                handled += 1
+        elif sent < rounds:
+            sends.post(comm.Isend(reqbuf, dest=peer(), tag=TAG_REQ), reqbuf)
+            outstanding = True
+            sent += 1
+        elif barrier is None:
+            barrier = comm.Ibarrier()
+        elif barrier.Test():
+            req.cancel()
+            rep.cancel()
+            sends.wait_all()
+            return handled
+
+if size < 2:
+    print("need at least 2 ranks")
+    sys.exit(1)
+
+comm.Barrier()
+t0 = MPI.Wtime()
+handled = run_probe() if mode == "probe" else run_posted()
+elapsed = MPI.Wtime() - t0
+
+rates = comm.gather(handled / elapsed, root=0)
+if rank == 0:
+    print("%s: %d ranks, %d rounds, %d byte replies, %.0f msgs/s per rank (min %.0f, max %.0f)" %
+          (mode, size, rounds, nbytes, sum(rates) / size, min(rates), max(rates)))
@@ -0,0 +1,104 @@
+from __future__ import print_function
+
+__author__ = 'f7b'
+
+"""
+Work queue spill benchmark, DbStore against SegStore.
+
+    python test/spillbench.py [segment|db|all] [items] [tmpdir]
+
+Replays what Circle does when its work queue overflows: "items" FileItems
+are spilled in G.DB_BUFSIZE batches (mput), then drained in
+G.memitem_threshold batches (mget + mdel), first all at once, then
+interleaved with new spills as a tree walk does. Reported are the spill
+and drain rates in items/s and the largest on-disk footprint.
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+from pcircle.globals import G
+from pcircle.fdef import FileItem
+from pcircle.utils import bytes_fmt
+from pcircle import segstore
+
+
+def footprint(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+    return sum(os.path.getsize(f) for f in (path, path + "-wal") if os.path.exists(f))
+
+
+def run(store, items):
+    objs = [FileItem("/the/common/path/we/have/dir%d/file%d" % (i // 1000, i))
+            for i in range(G.DB_BUFSIZE)]
+    spill_t = drain_t = 0.0
+    spilled = drained = 0
+    peak = 0
+    path = store.segdir if hasattr(store, "segdir") else store.dbname
+
+    # all in, all out
+    t0 = time.time()
+    while spilled < items:
+        store.mput(objs)
+        spilled += len(objs)
+    spill_t += time.time() - t0
+    peak = max(peak, footprint(path))
+    t0 = time.time()
+    while len(store) > 0:
+        got, size = store.mget(G.memitem_threshold)
+        store.mdel(G.memitem_threshold, size)
+        drained += len(got)
+    drain_t += time.time() - t0
+
+    # walk pattern: every drained batch spills some of it back
+    t0 = time.time()
+    for _ in range(items // (2 * G.DB_BUFSIZE) or 1):
+        store.mput(objs)
+        spilled += len(objs)
+    spill_t += time.time() - t0
+    while len(store) > 0:
+        t0 = time.time()
+        got, size = store.mget(G.memitem_threshold)
+        store.mdel(G.memitem_threshold, size)
+        drained += len(got)
+        drain_t += time.time() - t0
+        if spilled < 2 * items:
+            t0 = time.time()
+            store.mput(objs)
+            spilled += len(objs)
+            spill_t += time.time() - t0
+        peak = max(peak, footprint(path))
+
+    assert spilled == drained
+    return spilled / spill_t, drained / drain_t, peak
+
+
+if len(sys.argv) < 2 or sys.argv[1] not in segstore.POLICIES + ("all",):
+    print("spillbench [%s|all] [items] [tmpdir]" % "|".join(segstore.POLICIES))
+    sys.exit(0)
+
+backends = segstore.POLICIES if sys.argv[1] == "all" else (sys.argv[1],)
+items = int(sys.argv[2]) if len(sys.argv) > 2 else 10 ** 6
+workdir = tempfile.mkdtemp(dir=sys.argv[3] if len(sys.argv) > 3 else None)
+
+try:
+    for name in backends:
+        try:
+            store = segstore.make_store(name, os.path.join(workdir, "workq-0"))
+        except Exception as e:
+            print("%-8s: unavailable, %s" % (name, e))
+            continue
+        try:
+            spill, drain, peak = run(store, items)
+        except Exception as e:
+            print("%-8s: failed, %s" % (name, e))
+        else:
+            print("%-8s: %d items, spill %.0f items/s, drain %.0f items/s, peak %s on disk" %
+                  (name, items, spill, drain, bytes_fmt(peak)))
+        store.cleanup()
+finally:
+    shutil.rmtree(workdir)
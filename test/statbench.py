@@ -0,0 +1,185 @@
+from __future__ import print_function
+
+__author__ = 'f7b'
+
+"""
+Stat calls per entry of the tree walkers, counted.
+
+    python test/statbench.py [fwalk|fcp|fprof|all] [dirs] [tmpdir]
+
+Makes a tree under tmpdir: "dirs" directories of 20 files and 2 symlinks
+each. Then drives FWalk (fwalk, fsum), FWalk with a destination (fcp) or
+ProfileWalk (fprof) over it in this one process, with a plain list
+standing in for the Circle work queue, counting
+
+    lstat, stat     os.lstat(), os.stat(), os.path.islink() and friends
+                    go through these
+    entry stat      DirEntry.stat() calls that weren't cached yet
+
+and reports them per entry of the tree. For fwalk and fcp, the file list
+then goes through the per file checks of FCP.handle_fitem() and
+Checksum.create(), stat calls there count too.
+
+The file types themselves come from readdir() (d_type), at no cost, on
+most file systems.
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+from mpi4py import MPI
+
+from pcircle import fwalk
+from pcircle import fprof
+from pcircle.fcp import FCP
+from pcircle.fsum import Checksum
+from pcircle.globals import G
+from pcircle.utils import check_src
+
+COUNTS = {"lstat": 0, "stat": 0, "entry stat": 0}
+
+
+def counting(name, func):
+    def wrapper(*args, **kwargs):
+        COUNTS[name] += 1
+        return func(*args, **kwargs)
+    return wrapper
+
+
+class Entry(object):
+    """ a DirEntry that counts the stat() calls it doesn't have cached """
+
+    def __init__(self, entry):
+        self.entry = entry
+        self.path = entry.path
+        self.name = entry.name
+        self.cached = set()
+
+    def stat(self, follow_symlinks=True):
+        if follow_symlinks not in self.cached:
+            self.cached.add(follow_symlinks)
+            COUNTS["entry stat"] += 1
+        return self.entry.stat(follow_symlinks=follow_symlinks)
+
+    def is_dir(self, follow_symlinks=True):
+        return self.entry.is_dir(follow_symlinks=follow_symlinks)
+
+    def is_file(self, follow_symlinks=True):
+        return self.entry.is_file(follow_symlinks=follow_symlinks)
+
+    def is_symlink(self):
+        return self.entry.is_symlink()
+
+
+def counting_scandir(scandir):
+    def wrapper(path):
+        for entry in scandir(path):
+            yield Entry(entry)
+    return wrapper
+
+
+class Queue(object):
+    """ stands in for the Circle, rank 0 of 1 """
+    rank = 0
+    size = 1
+    comm = MPI.COMM_WORLD
+
+    def __init__(self):
+        self.q = []
+
+    def enq(self, work):
+        self.q.append(work)
+
+    preq = enq
+
+    def deq(self):
+        return self.q.pop()
+
+
+def make_tree(top, ndirs):
+    src = os.path.join(top, "src")
+    os.mkdir(src)
+    for d in range(ndirs):
+        path = os.path.join(src, "d%s" % (d % 10), "d%s" % d)
+        os.makedirs(path)
+        for f in range(20):
+            with open(os.path.join(path, "f%s" % f), "w") as fp:
+                fp.write("x" * f)
+        for f in range(2):
+            os.symlink("f%s" % f, os.path.join(path, "l%s" % f))
+    entries = 0
+    for root, dirs, files in os.walk(src):
+        entries += 1 + len(files)
+    return src, entries
+
+
+def per_file_checks(kind, task):
+    """ the file list through FCP.handle_fitem(), or Checksum.create(),
+    queueing nothing """
+    if kind == "fcp":
+        fcp = FCP.__new__(FCP)
+        fcp.dest = task.dest
+        fcp.d = {"rank": "rank 0"}
+        fcp.enq_file = lambda fi: None
+        for fi in task.flist:
+            fcp.handle_fitem(fi)
+    else:
+        checksum = Checksum(Queue(), task, 1 << 20)
+        checksum.enq_file = lambda fi: None
+        checksum.create()
+
+
+def drive(task, circle):
+    task.create()
+    while circle.q:
+        task.process()
+
+
+def run(kind, top, src):
+    circle = Queue()
+    G.src = check_src([src])
+    if kind == "fprof":
+        fprof.args = fprof.gen_parser().parse_args([src])
+        task = fprof.ProfileWalk(circle, [src], perfile=False)
+    elif kind == "fcp":
+        G.copytype = "dir2dir"
+        dest = os.path.join(top, "dest")
+        task = fwalk.FWalk(circle, G.src, dest)
+    else:
+        task = fwalk.FWalk(circle, G.src)
+    drive(task, circle)
+    if kind != "fprof":
+        per_file_checks(kind, task)
+
+
+def main():
+    kind = sys.argv[1] if len(sys.argv) > 1 else "all"
+    ndirs = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    tmpdir = sys.argv[3] if len(sys.argv) > 3 else None
+
+    os.lstat = counting("lstat", os.lstat)
+    os.stat = counting("stat", os.stat)
+    fwalk.scandir = counting_scandir(fwalk.scandir)
+    fprof.scandir = counting_scandir(fprof.scandir)
+
+    top = tempfile.mkdtemp(prefix="statbench.", dir=tmpdir)
+    try:
+        src, entries = make_tree(top, ndirs)
+        print("%s entries, %s directories\n" % (entries, ndirs + 11))
+        print("{:<8}{:>10}{:>10}{:>12}{:>12}".format("", "lstat", "stat", "entry stat", "per entry"))
+        for k in ("fwalk", "fcp", "fprof") if kind == "all" else (kind,):
+            for name in COUNTS:
+                COUNTS[name] = 0
+            run(k, top, src)
+            total = sum(COUNTS.values())
+            print("{:<8}{:>10}{:>10}{:>12}{:>12.2f}".format(
+                k, COUNTS["lstat"], COUNTS["stat"], COUNTS["entry stat"],
+                total / float(entries)))
+            shutil.rmtree(os.path.join(top, "dest"), ignore_errors=True)
+    finally:
+        shutil.rmtree(top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+from __future__ import print_function
+
+__author__ = 'f7b'
+
+"""
+Time-to-terminate benchmark for the Circle termination detectors.
+
+    mpirun -np 64 python test/termbench.py [token|wave] [items] [item ms]
+
+Rank 0 creates "items" work items, each costing "item ms" of sleep, the
+ranks steal them from each other as usual. Reported is the tail: time from
+the last item finished anywhere to the last rank leaving Circle.begin(),
+which is what termination detection costs. Run it at several -np to see
+how it grows with the rank count, e.g.
+
+    for n in 4 16 64 256; do mpirun -np $n python test/termbench.py wave; done
+
+Uses MPI.Wtime() across ranks, so run within a node or where
+MPI.WTIME_IS_GLOBAL holds.
+"""
+
+import sys
+import time
+from mpi4py import MPI
+from pcircle.circle import Circle
+from pcircle.task import BaseTask
+from pcircle.globals import G
+from pcircle import token
+
+
+class Sleeper(BaseTask):
+    def __init__(self, circle, items, cost):
+        BaseTask.__init__(self, circle)
+        self.items = items
+        self.cost = cost
+        self.done = 0
+        self.last = 0
+
+    def create(self):
+        if self.circle.rank == 0:
+            for i in range(self.items):
+                self.enq(i)
+
+    def process(self):
+        self.deq()
+        time.sleep(self.cost)
+        self.done += 1
+        self.last = MPI.Wtime()
+
+    def reduce_init(self, buf):
+        pass
+
+    def reduce(self, buf1, buf2):
+        pass
+
+    def reduce_finish(self, buf):
+        pass
+
+
+if len(sys.argv) < 2 or sys.argv[1] not in token.POLICIES:
+    if MPI.COMM_WORLD.Get_rank() == 0:
+        print("termbench [%s] [items] [item ms]" % "|".join(token.POLICIES))
+    sys.exit(0)
+
+policy = sys.argv[1]
+items = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+cost = float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else 0.001
+
+G.batch_items = 1
+circle = Circle(term=policy)
+task = Sleeper(circle, items, cost)
+t0 = MPI.Wtime()
+circle.begin(task)
+t1 = MPI.Wtime()
+
+comm = circle.comm
+done = comm.reduce(task.done, op=MPI.SUM)
+last = comm.reduce(task.last, op=MPI.MAX)
+end = comm.reduce(t1, op=MPI.MAX)
+if circle.rank == 0:
+    assert done == items
+    print("%s: %d ranks, %d items, total %.3fs, tail %.2f ms" %
+          (policy, circle.size, items, end - t0, (end - last) * 1000))
+circle.finalize()
@@ -0,0 +1,54 @@
+import os
+import hashlib
+import shutil
+import tempfile
+import unittest
+
+from pcircle import cio
+
+
+class Test(unittest.TestCase):
+    """ Unit test for chunk I/O """
+
+    def setUp(self):
+        self.top = tempfile.mkdtemp()
+        self.path = os.path.join(self.top, "data")
+        self.data = os.urandom(100000)
+        with open(self.path, "wb") as f:
+            f.write(self.data)
+        self.fd = os.open(self.path, os.O_RDWR)
+
+    def tearDown(self):
+        os.close(self.fd)
+        shutil.rmtree(self.top)
+
+    def test_pread_pwrite(self):
+        view = memoryview(bytearray(1000))
+        self.assertEqual(cio.preadn(self.fd, view, 5000), 1000)
+        self.assertEqual(view.tobytes(), self.data[5000:6000])
+        # short at the end of the file
+        self.assertEqual(cio.preadn(self.fd, view, 99500), 500)
+
+        self.assertEqual(cio.pwriten(self.fd, view[:500], 200000), 500)
+        self.assertEqual(os.path.getsize(self.path), 200500)
+
+    def test_ranges(self):
+        m = hashlib.sha1()
+        self.assertEqual(cio.hash_range(self.fd, 1000, 50000, m, blocksize=4096), 50000)
+        self.assertEqual(m.hexdigest(), hashlib.sha1(self.data[1000:51000]).hexdigest())
+
+        dest = os.open(os.path.join(self.top, "copy"), os.O_RDWR | os.O_CREAT)
+        try:
+            for offset in (60000, 0, 30000):
+                cio.copy_range(self.fd, dest, offset, 40000, blocksize=4096)
+            with open(os.path.join(self.top, "copy"), "rb") as f:
+                self.assertEqual(f.read(), self.data)
+        finally:
+            os.close(dest)
+
+        # the same buffer every time
+        self.assertEqual(cio.pool(4096).made, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import os
+import errno
+import hashlib
+import shutil
+import tempfile
+import unittest
+
+from pcircle import copyengine
+
+
+class Test(unittest.TestCase):
+    """ Unit test for the fcp copy engines """
+
+    def setUp(self):
+        self.top = tempfile.mkdtemp()
+        self.src = os.path.join(self.top, "src")
+        self.dest = os.path.join(self.top, "dest")
+        self.data = os.urandom(300000)
+        with open(self.src, "wb") as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.top)
+
+    def copy(self, engine, chunk):
+        rfd = os.open(self.src, os.O_RDONLY)
+        wfd = os.open(self.dest, os.O_WRONLY | os.O_CREAT)
+        try:
+            # chunks out of order, the last one past the end
+            offsets = list(range(0, len(self.data), chunk))[::-1]
+            copied = sum(engine.copy(rfd, wfd, off, chunk) for off in offsets)
+        finally:
+            os.close(rfd)
+            os.close(wfd)
+        self.assertEqual(copied, len(self.data))
+        with open(self.dest, "rb") as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_readwrite(self):
+        engine = copyengine.make_engine("readwrite", 4096)
+        self.copy(engine, 65536)
+        m = hashlib.sha1()
+        rfd = os.open(self.src, os.O_RDONLY)
+        wfd = os.open(self.dest, os.O_WRONLY)
+        try:
+            # with --verify, the kernel engine reads and writes as well
+            copyengine.make_engine("kernel").copy(rfd, wfd, 1000, 5000, m)
+        finally:
+            os.close(rfd)
+            os.close(wfd)
+        self.assertEqual(m.hexdigest(), hashlib.sha1(self.data[1000:6000]).hexdigest())
+
+    def test_pipeline(self):
+        engine = copyengine.make_engine("readwrite", 4096, depth=3)
+        try:
+            self.copy(engine, 65536)
+            m = hashlib.sha1()
+            rfd = os.open(self.src, os.O_RDONLY)
+            wfd = os.open(self.dest, os.O_WRONLY)
+            readonly = os.open(self.dest, os.O_RDONLY)
+            try:
+                engine.copy(rfd, wfd, 0, len(self.data), m)
+                self.assertEqual(m.hexdigest(), hashlib.sha1(self.data).hexdigest())
+                # the error of the writer thread comes back to the caller
+                self.assertRaises(IOError, engine.copy, rfd, readonly, 0, 65536, hashlib.sha1())
+            finally:
+                for fd in (rfd, wfd, readonly):
+                    os.close(fd)
+            self.assertEqual(engine.pipeline.ring.qsize(), 3)
+        finally:
+            engine.close()
+
+    @unittest.skipUnless(copyengine.Kernel().calls, "no copy_file_range or sendfile")
+    def test_kernel(self):
+        engine = copyengine.make_engine("kernel", 4096)
+        self.copy(engine, 65536)
+
+    @unittest.skipUnless(hasattr(os, "sendfile"), "no sendfile")
+    def test_fallback(self):
+        """ a call the kernel refuses is dropped, the next one goes on """
+        def refused(rfd, wfd, offset, count):
+            raise OSError(errno.EXDEV, "cross-device")
+
+        engine = copyengine.make_engine("kernel")
+        engine.calls = [refused, copyengine.sendfile]
+        self.copy(engine, 65536)
+        self.assertEqual(engine.calls, [copyengine.sendfile])
+        self.assertEqual(engine.describe(), "sendfile")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+import json
+import os
+import tempfile
+from pcircle import counters
+from pcircle.counters import Counters, imbalance, phase_report
+
+
+class Test(unittest.TestCase):
+    """ Unit test for Circle counters """
+
+    def test_imbalance(self):
+        st = imbalance([2, 2, 2, 6])
+        self.assertEqual(st["total"], 12)
+        self.assertEqual(st["mean"], 3)
+        self.assertEqual(st["max_mean"], 2.0)
+        self.assertAlmostEqual(st["cv"], 0.5774, places=4)
+
+    def test_empty(self):
+        st = imbalance([0, 0])
+        self.assertEqual((st["max_mean"], st["cv"]), (0.0, 0.0))
+
+    def test_report(self):
+        a, b = Counters(), Counters()
+        a["items_processed"] = 10
+        b["items_processed"] = 30
+        phase = phase_report("fwalk", 1.5, [a, b])
+        self.assertEqual(phase["ranks"], 2)
+        self.assertEqual(phase["counters"]["items_processed"]["per_rank"], [10, 30])
+
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            del counters.phases[:]
+            counters.write_report(path, phase)
+            counters.write_report(path, phase)
+            with open(path) as f:
+                report = json.load(f)
+            self.assertEqual([p["name"] for p in report["phases"]], ["fwalk", "fwalk"])
+        finally:
+            del counters.phases[:]
+            os.unlink(path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -46,6 +46,23 @@ class Test(unittest.TestCase):
         self.db.mdel(3)
         self.assertEquals(self.db.size(), 0)
 
+    def test_dbstore_batches(self):
+        db = DbStore("/tmp/test-batch.db", batch=4)
+        db.mput([FileItem("/a/%s" % i) for i in range(10)])
+        objs, _ = db.mget(5)
+        self.assertEqual([o.path for o in objs], ["/a/%s" % i for i in range(5)])
+        db.mdel(5)
+        db.sync()
+
+        # what is left survives a restart, the head row partially consumed
+        db.conn.close()
+        db = DbStore("/tmp/test-batch.db", resume=True)
+        self.assertEqual(db.size(), 5)
+        objs, _ = db.mget(10)
+        self.assertEqual([o.path for o in objs], ["/a/%s" % i for i in range(5, 10)])
+        self.assertEqual(db[1].path, "/a/6")
+        db.cleanup()
+
 
 if __name__ == "__main__":
     unittest.main()
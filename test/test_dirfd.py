@@ -0,0 +1,60 @@
+import os
+import shutil
+import itertools
+import tempfile
+import unittest
+
+from pcircle import dirfd
+
+
+@unittest.skipUnless(dirfd.available(), "needs dir_fd support")
+class Test(unittest.TestCase):
+    """ Unit test for the directory fd cache """
+
+    def setUp(self):
+        self.top = tempfile.mkdtemp()
+        self.dirs = [self.top]
+        for d in range(4):
+            self.dirs.append(os.path.join(self.dirs[-1], "d%s" % d))
+            os.mkdir(self.dirs[-1])
+            open(os.path.join(self.dirs[-1], "f"), "w").close()
+        os.symlink("f", os.path.join(self.dirs[-1], "link"))
+
+    def tearDown(self):
+        shutil.rmtree(self.top)
+
+    def test_same_as_paths(self):
+        cache = dirfd.DirCache(2)
+        for path in self.dirs[1:]:
+            self.assertEqual(sorted(e.name for e in cache.scandir(path)),
+                             sorted(os.listdir(path)))
+            for name in os.listdir(path):
+                self.assertEqual(cache.lstat(os.path.join(path, name)),
+                                 os.lstat(os.path.join(path, name)))
+        self.assertLessEqual(len(cache.fds.cache), 2)
+        cache.close()
+        self.assertEqual(len(cache.fds.cache), 0)
+
+    def test_evicted(self):
+        """ the entries of a directory being read stat() after the cache
+        closed its fd """
+        cache = dirfd.DirCache(2)
+        it = cache.scandir(self.dirs[1])
+        first = next(it)
+        for path in self.dirs[2:]:
+            cache.lstat(os.path.join(path, "f"))
+        self.assertNotIn(self.dirs[1], cache.fds.cache)
+        for e in itertools.chain([first], it):
+            self.assertEqual(e.stat(follow_symlinks=False),
+                             os.lstat(os.path.join(self.dirs[1], e.name)))
+        cache.close()
+
+    def test_missing(self):
+        cache = dirfd.DirCache(2)
+        self.assertRaises(OSError, cache.lstat, os.path.join(self.top, "nope", "f"))
+        self.assertRaises(OSError, cache.lstat, os.path.join(self.top, "nope"))
+        cache.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
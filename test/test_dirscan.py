@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from pcircle.dirscan import Scanner
+
+
+def name(path, entry):
+    return entry
+
+
+class Test(unittest.TestCase):
+    """ Unit test for reading directories in batches """
+
+    def setUp(self):
+        self.top = tempfile.mkdtemp()
+        self.names = ["f%s" % i for i in range(50)]
+        for n in self.names:
+            open(os.path.join(self.top, n), "w").close()
+
+    def tearDown(self):
+        shutil.rmtree(self.top)
+
+    def read(self, scanner, offset=0):
+        got, reads = [], 0
+        while offset is not None:
+            entries, offset = scanner.read(self.top, offset)
+            got.extend(entries)
+            reads += 1
+        return got, reads
+
+    def test_batches(self):
+        for batch, reads in ((0, 1), (7, 8), (10, 5), (50, 1), (49, 2)):
+            got, n = self.read(Scanner(os.listdir, name, batch))
+            self.assertEqual(sorted(got), sorted(self.names))
+            self.assertEqual(n, reads)
+
+    def test_stolen(self):
+        """ another scanner picks up from the offset """
+        first = Scanner(os.listdir, name, 20)
+        entries, offset = first.read(self.top)
+        self.assertEqual(offset, 20)
+        rest, n = self.read(Scanner(os.listdir, name, 20), offset)
+        self.assertEqual(sorted(entries + rest), sorted(self.names))
+        self.assertEqual(n, 2)
+        first.close()
+        self.assertEqual(first.open, {})
+
+    def test_read_ahead(self):
+        """ the entry read ahead is made in the batch that read it """
+        made = []
+        scanner = Scanner(os.listdir, lambda path, e: made.append(e) or e, 20)
+        entries, offset = scanner.read(self.top)
+        self.assertEqual(len(entries), 20)
+        self.assertEqual(len(made), 21)
+        self.assertEqual(scanner.open[self.top][2], made[-1])
+        scanner.close()
+
+    def test_error(self):
+        """ a failed read closes the iterator it took """
+        closed = []
+
+        def scandir(path):
+            try:
+                for n in os.listdir(path)[:25]:
+                    yield n
+                raise OSError("readdir")
+            finally:
+                closed.append(path)
+
+        scanner = Scanner(scandir, name, 10)
+        entries, offset = scanner.read(self.top)
+        entries, offset = scanner.read(self.top, offset)
+        self.assertRaises(OSError, scanner.read, self.top, offset)
+        self.assertEqual(closed, [self.top])
+        self.assertEqual(scanner.open, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
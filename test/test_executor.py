@@ -0,0 +1,41 @@
+import unittest
+import time
+from pcircle.executor import IOExecutor
+
+
+def square(x):
+    time.sleep(0.001)
+    return x * x
+
+
+def fail(x):
+    raise ValueError("bad item %s" % x)
+
+
+class Test(unittest.TestCase):
+    """ Unit test for IOExecutor """
+
+    def test_results(self):
+        ex = IOExecutor(square, 4)
+        self.assertEqual(ex.depth, 8)
+        items = list(range(20)) * 2
+        done = []
+        for item in items:
+            while ex.full():
+                done.extend(ex.completed(0.1))
+            ex.submit(item)
+        while ex.inflight():
+            done.extend(ex.completed(0.1))
+        ex.shutdown()
+        self.assertEqual(sorted(r for _, r in done), sorted(i * i for i in items))
+        self.assertEqual(ex.items(), [])
+
+    def test_exception(self):
+        ex = IOExecutor(fail, 1)
+        ex.submit("x")
+        self.assertRaises(ValueError, ex.completed, 1.0)
+        ex.shutdown()
+
+
+if __name__ == "__main__":
+    unittest.main()
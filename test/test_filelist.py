@@ -0,0 +1,44 @@
+import unittest
+
+from pcircle.filelist import FileList
+from pcircle.fdef import FileItem
+
+
+class Test(unittest.TestCase):
+    """ Unit test for FileList """
+
+    def setUp(self):
+        self.items = []
+        for i in range(3000):
+            fi = FileItem("/a/d%s/f%s" % (i % 7, i), st_mode=0o100644, st_size=i,
+                          st_uid=i % 3, st_gid=i % 5)
+            if i % 2:
+                fi.dirname = "/a"
+            self.items.append(fi)
+        self.items.append(FileItem("/"))
+        self.flist = FileList(capacity=16)
+        self.flist.extend(self.items)
+
+    def check(self, got, want):
+        self.assertEqual([(f.path, f.st_mode, f.st_size, f.st_uid, f.st_gid, f.dirname) for f in got],
+                         [(f.path, f.st_mode, f.st_size, f.st_uid, f.st_gid, f.dirname) for f in want])
+
+    def test_iterate(self):
+        self.assertEqual(len(self.flist), 3001)
+        self.check(list(self.flist.__iter__(block=1000)), self.items)
+        # seven directories, "/a" and "/"
+        self.assertEqual(len(self.flist.dirs), 9)
+
+    def test_index_slice(self):
+        self.check([self.flist[5], self.flist[-1]], [self.items[5], self.items[-1]])
+        self.check(self.flist[10:20], self.items[10:20])
+        self.assertRaises(IndexError, self.flist.__getitem__, 3001)
+
+    def test_columns(self):
+        self.assertEqual(self.flist.st_size.sum(), sum(range(3000)))
+        self.assertLess(self.flist.nbytes(), 3001 * 64)
+        self.assertEqual([f.st_size for f in self.flist.largest(3)], [2999, 2998, 2997])
+
+
+if __name__ == "__main__":
+    unittest.main()
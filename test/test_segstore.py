@@ -0,0 +1,64 @@
+import unittest
+import os.path
+import shutil
+
+from pcircle.segstore import SegStore
+from pcircle.fdef import FileItem, FileChunk
+
+
+class Test(unittest.TestCase):
+    """ Unit test for SegStore """
+
+    def setUp(self):
+        self.db = SegStore("/tmp/test-segstore", seg_items=4)
+        self.db.put(FileItem("/tmp"))
+        self.db.put(FileItem("/tmp/1"))
+        self.db.put(FileItem("/tmp/2"))
+
+    def tearDown(self):
+        self.db.cleanup()
+        self.assertFalse(os.path.exists(self.db.segdir))
+
+    def test_segstore_pop(self):
+        self.assertEqual(self.db.pop().path, "/tmp")
+        self.assertEqual(self.db.size(), 2)
+        self.db.pop()
+        self.db.pop()
+        self.assertEqual(self.db.size(), 0)
+        self.assertEqual(self.db.pop(), None)
+        self.assertEqual(os.listdir(self.db.segdir), [])
+
+    def test_segstore_fifo(self):
+        self.db.mput([FileItem("/a/%s" % i) for i in range(10)])
+        self.assertEqual(len(self.db), 13)
+        self.assertEqual(len(os.listdir(self.db.segdir)), 6)
+
+        objs, _ = self.db.mget(5)
+        self.assertEqual([o.path for o in objs],
+                         ["/tmp", "/tmp/1", "/tmp/2", "/a/0", "/a/1"])
+        self.db.mdel(5)
+        # the three single item segments are gone, the next one is half read
+        self.assertEqual(len(os.listdir(self.db.segdir)), 3)
+
+        objs, _ = self.db.mget(100)
+        self.assertEqual([o.path for o in objs], ["/a/%s" % i for i in range(2, 10)])
+        self.db.mdel(100)
+        self.assertEqual(len(self.db), 0)
+        self.assertEqual(os.listdir(self.db.segdir), [])
+
+    def test_segstore_size(self):
+        chunks = [FileChunk(length=100) for _ in range(6)]
+        self.db.mput(chunks)
+        objs, size = self.db.mget(5)
+        self.assertEqual(size, 200)
+        self.db.mdel(5, size)
+        self.assertEqual(self.db.fsize, 400)
+
+    def test_segstore_cleanup_gone(self):
+        """ another rank removed the temp directory first """
+        shutil.rmtree(self.db.segdir)
+        self.db.cleanup()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+from collections import deque
+
+from pcircle.split import make_split, split_ranges
+from pcircle.fdef import FileChunk, FileItem, ChunkRange
+
+
+def chunks(*lengths):
+    return deque(FileChunk(src="/a", dest="/b", offset=0, length=n) for n in lengths)
+
+
+class Test(unittest.TestCase):
+    """ Unit test for split policies """
+
+    def test_equal(self):
+        sp = make_split("equal")
+        self.assertEqual(sp.spread(deque(range(10)), 2), [4, 3])
+        self.assertEqual(sp.spread(deque(range(3)), 3), [1, 1, 1])
+
+    def test_min_items(self):
+        # a single item stays with the victim
+        self.assertEqual(make_split("equal").spread(deque([1]), 1), [0])
+        self.assertEqual(make_split("half", min_items=1).spread(deque([1, 2]), 1), [1])
+
+    def test_half(self):
+        self.assertEqual(make_split("half").spread(deque(range(10)), 2), [3, 2])
+
+    def test_bytes(self):
+        sp = make_split("bytes")
+        # one big chunk up front: the thief takes it, the victim keeps the tail
+        q = chunks(512, 16, 16, 16)
+        self.assertEqual(sp.spread(q, 1), [1])
+        # big chunk at the end stays with the victim
+        q = chunks(16, 16, 16, 512)
+        self.assertEqual(sp.spread(q, 1), [3])
+
+    def test_bytes_never_empties_victim(self):
+        sizes = make_split("bytes").spread(chunks(100, 100), 3)
+        self.assertTrue(sum(sizes) < 2)
+
+    def test_bytes_min_bytes(self):
+        sp = make_split("bytes", min_bytes=1024)
+        self.assertEqual(sp.spread(chunks(100, 100, 100), 1), [0])
+
+    def test_bytes_without_length(self):
+        q = deque(FileItem("/a/%s" % i) for i in range(6))
+        self.assertEqual(make_split("bytes").spread(q, 2), [2, 2])
+
+    def test_split_ranges(self):
+        rng = ChunkRange(0, 0, 10 * 4096 + 1, 4096)
+        q = deque([rng])
+        self.assertEqual(split_ranges(q, 4), 3)
+        self.assertEqual(sorted(r.chunks() for r in q), [2, 3, 3, 3])
+        self.assertEqual(sum(r.length for r in q), 10 * 4096 + 1)
+        # the halves are contiguous, the original range kept the start
+        self.assertEqual(q[-1].start, 0)
+        spans = sorted((r.start, r.end) for r in q)
+        self.assertTrue(all(a[1] == b[0] for a, b in zip(spans, spans[1:])))
+
+        # single chunks can't be split
+        q = deque([ChunkRange(0, 0, 100, 4096), FileItem("/a")])
+        self.assertEqual(split_ranges(q, 4), 0)
+
+    def test_range_take(self):
+        rng = ChunkRange(FileChunk(src="/a", dest="/b").fid, 0, 2 * 4096 + 10, 4096)
+        out = [rng.take() for _ in range(rng.chunks())]
+        self.assertEqual([(c.offset, c.length) for c in out],
+                         [(0, 4096), (4096, 4096), (8192, 10)])
+        self.assertEqual(out[0].dest, "/b")
+        self.assertEqual(rng.length, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+from mpi4py import MPI
+from pcircle import trace
+from pcircle.trace import Tracer, chrome_events
+
+
+class Test(unittest.TestCase):
+    """ Unit test for the Circle tracer """
+
+    def test_ring(self):
+        tr = Tracer(MPI.COMM_SELF, capacity=4)
+        for i in range(6):
+            tr.span(trace.WORK, i, i + 0.5, i)
+        ts, dur, ev, arg = tr.records()
+        self.assertEqual(list(arg), [2, 3, 4, 5])
+        self.assertEqual(tr.dropped(), 2)
+
+    def test_chrome(self):
+        tr = Tracer(MPI.COMM_SELF, capacity=8)
+        t = MPI.Wtime()
+        tr.idle(t)
+        tr.busy(t + 0.001)
+        tr.instant(trace.STEAL_REQUEST, 3)
+        out = chrome_events("fwalk", 0, "host", tr.records())
+        events = [e for e in out if e["ph"] != "M"]
+        self.assertEqual([e["name"] for e in events], ["idle", "steal request"])
+        self.assertEqual(events[0]["ph"], "X")
+        self.assertAlmostEqual(events[0]["dur"], 1000, places=0)
+        self.assertEqual(events[1]["ph"], "i")
+        self.assertEqual(events[1]["args"], {"n": 3})
+
+
+if __name__ == "__main__":
+    unittest.main()
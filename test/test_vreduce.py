@@ -0,0 +1,25 @@
+import unittest
+from mpi4py import MPI
+from pcircle.vreduce import ReduceSchema
+
+
+class Test(unittest.TestCase):
+    """ Unit test for ReduceSchema """
+
+    def test_groups(self):
+        rs = ReduceSchema([("a", "sum"), ("b", "max"), ("c", "sum"),
+                           ("d", "min", "float64")])
+        self.assertEqual(list(rs.groups.values()), [["a", "c"], ["b"], ["d"]])
+
+    def test_reduce(self):
+        rs = ReduceSchema([("a", "sum"), ("b", "max"), ("d", "min", "float64")])
+        reqs = rs.start(MPI.COMM_SELF, {"a": 3, "d": 1.5})
+        MPI.Request.Waitall(reqs)
+        self.assertEqual(rs.result(), {"a": 3, "b": 0, "d": 1.5})
+
+    def test_bad_op(self):
+        self.assertRaises(ValueError, ReduceSchema, [("a", "avg")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import os
+import stat
+import shutil
+import tempfile
+import unittest
+
+from mpi4py import MPI
+
+from pcircle import windex
+
+
+class Test(unittest.TestCase):
+    """ Unit test for the walk index """
+
+    def setUp(self):
+        self.top = tempfile.mkdtemp()
+        self.src = os.path.join(self.top, "src")
+        for d in range(5):
+            os.makedirs(os.path.join(self.src, "d%s" % d))
+            for f in range(40):
+                with open(os.path.join(self.src, "d%s" % d, "f%s" % f), "w") as fp:
+                    fp.write("x" * f)
+        os.symlink("d0", os.path.join(self.src, "link"))
+        self.index = os.path.join(self.top, "index")
+        self.write()
+
+    def write(self):
+        self.stats = {}
+        writer = windex.IndexWriter(self.index, 0)
+        for root, dirs, files in os.walk(self.src):
+            for path in [root] + [os.path.join(root, name) for name in files]:
+                self.stats[path] = os.lstat(path)
+                writer.add(path, self.stats[path])
+        link = os.path.join(self.src, "link")
+        self.stats[link] = os.lstat(link)
+        writer.add(link, self.stats[link])
+        windex.finish(writer, MPI.COMM_WORLD, [self.src])
+
+    def tearDown(self):
+        shutil.rmtree(self.top)
+
+    def test_round_trip(self):
+        manifest = windex.read_manifest(self.index, [self.src])
+        self.assertEqual(manifest["records"], 207)
+        self.assertEqual(manifest["files"], 200)
+        self.assertEqual(manifest["dirs"], 6)
+        self.assertEqual(manifest["bytes"], 5 * sum(range(40)))
+
+        got = dict(windex.load(manifest, 0, 1))
+        self.assertEqual(sorted(got), sorted(self.stats))
+        for path, st in got.items():
+            want = self.stats[path]
+            self.assertEqual((st.st_mode, st.st_size, st.st_uid, st.st_gid, st.st_ino, st.st_nlink),
+                             (want.st_mode, want.st_size, want.st_uid, want.st_gid, want.st_ino,
+                              want.st_nlink))
+            self.assertEqual((st.st_mtime_ns, st.st_ctime_ns), (want.st_mtime_ns, want.st_ctime_ns))
+
+        dirs = [path for path, _ in windex.load(manifest, 0, 1, kinds=(stat.S_IFDIR,))]
+        self.assertEqual(len(dirs), 6)
+
+    def test_assign(self):
+        """ any number of readers gets every record once """
+        saved = windex.BLOCK_RECORDS
+        windex.BLOCK_RECORDS = 16
+        try:
+            self.write()
+        finally:
+            windex.BLOCK_RECORDS = saved
+        manifest = windex.read_manifest(self.index)
+        self.assertGreater(len(manifest["shards"][0]["blocks"]), 10)
+        for size in (1, 3, 7, 300):
+            paths = []
+            for rank in range(size):
+                share = [path for path, _ in windex.load(manifest, rank, size)]
+                self.assertLessEqual(len(share), 207 // size + 1)
+                paths.extend(share)
+            self.assertEqual(sorted(paths), sorted(self.stats))
+
+    def test_wrong_src(self):
+        self.assertRaises(ValueError, windex.read_manifest, self.index, ["/elsewhere"])
+        self.assertRaises(ValueError, windex.read_manifest, self.top)
+
+
+if __name__ == "__main__":
+    unittest.main()
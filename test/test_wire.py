@@ -0,0 +1,84 @@
+import unittest
+
+from pcircle import wire
+from pcircle.globals import G
+from pcircle.fdef import FileItem, FileChunk, ChunkSum, ChunkRange
+from pcircle.filetable import table
+
+
+class Test(unittest.TestCase):
+    """ Unit test for work reply wire format """
+
+    def roundtrip(self, items):
+        buf = wire.encode_work(items)
+        reply = wire.decode(bytearray(buf))
+        self.assertEqual(reply[G.KEY], len(items))
+        return reply[G.VAL]
+
+    def test_filechunk(self):
+        chunks = [FileChunk(src="/a/f1", dest="/b/f1", offset=i * 1024, length=1024)
+                  for i in range(10)]
+        chunks.append(FileChunk(src="/a/f2", dest="/b/f2", offset=0, length=0))
+        self.assertEqual(self.roundtrip(chunks), chunks)
+
+    def test_range(self):
+        fid = FileChunk(src="/a/f4", dest="/b/f4").fid
+        rngs = [ChunkRange(fid, 0, 10 ** 12, 1 << 24, ChunkRange.SUM)]
+        self.assertEqual(self.roundtrip(rngs), rngs)
+
+    def test_chunksum(self):
+        cks = [ChunkSum("/a/f1", offset=0, length=10, digest="ab" * 20),
+               ChunkSum("/a/f2", offset=10, length=20, digest=""),
+               ChunkSum(fid=FileChunk(src="/a/f3", dest="/b/f3").fid,
+                        digest="cd" * 20, side=ChunkSum.DEST)]
+        out = self.roundtrip(cks)
+        for a, b in zip(cks, out):
+            self.assertEqual((a.filename, a.offset, a.length, a.digest),
+                             (b.filename, b.offset, b.length, b.digest))
+        self.assertEqual(out[2].filename, "/b/f3")
+
+    def test_fileitem(self):
+        fi = FileItem("/a/f1", st_mode=0o100644, st_size=3, st_uid=10, st_gid=20)
+        fi.dirname = "/a"
+        out = self.roundtrip([fi, FileItem("/a/f2")])
+        self.assertEqual(out[0].dirname, "/a")
+        self.assertEqual(out[1].dirname, None)
+        self.assertEqual(out[0].st_mode, 0o100644)
+        self.assertEqual(out[1].path, "/a/f2")
+
+    def test_paths(self):
+        paths = ["/a", "/a/b", "", "/a"]
+        self.assertEqual(self.roundtrip(paths), paths)
+
+    def test_pickle_fallback(self):
+        items = [1, "/a", FileChunk()]
+        self.assertEqual(self.roundtrip(items), items)
+
+    def test_ctrl(self):
+        self.assertEqual(wire.decode(wire.encode_ctrl(G.ZERO)), {G.KEY: G.ZERO})
+        self.assertEqual(wire.decode(wire.encode_ctrl(G.ABORT)), {G.KEY: G.ABORT})
+
+    def test_compact(self):
+        # the paths of a file go once, not with every chunk
+        chunks = [FileChunk(src="/a/long/source/path/file", dest="/b/long/dest/path/file",
+                            offset=i, length=1) for i in range(1000)]
+        self.assertLess(len(wire.encode_work(chunks)), 1000 * 3 * 8 + 200)
+
+    def test_file_entries(self):
+        chunks = [FileChunk(src="/a/f3", dest="/b/f3", offset=i, length=1) for i in range(3)]
+        first = wire.encode_work(chunks, peer=1)
+        wire.mark_sent(chunks, 1)
+        again = wire.encode_work(chunks, peer=1)
+        self.assertLess(len(again), len(first))
+        # the rank the file came from has the entry already
+        self.assertEqual(len(wire.encode_work(chunks, peer=table.rank)), len(again))
+
+        # a thief that never saw the file gets it with the chunks
+        fid = chunks[0].fid
+        table.entries.pop(fid)
+        table.index.pop("/a/f3")
+        out = wire.decode(bytearray(first), peer=0)[G.VAL]
+        self.assertEqual((out[0].src, out[0].dest), ("/a/f3", "/b/f3"))
+
+if __name__ == "__main__":
+    unittest.main()